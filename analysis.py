@@ -0,0 +1,83 @@
+# analysis.py
+import time
+from config import Config
+from db import get_db
+import cache
+import llm
+import metrics
+import textstore
+import search
+from extraction import ExtractionError, extract_prefix
+from summarize import prepare_prompt, summarize
+
+class AnalysisError(Exception):
+    pass
+
+def extract_text(path):
+    # Stop parsing once the analysed prefix is available.
+    try:
+        return extract_prefix(path, Config.ANALYSIS_MAX_CHARS)
+    except ExtractionError as e:
+        raise AnalysisError("Failed to extract text") from e
+
+def analysis_cache_key(path, content_hash=None):
+    # Stored objects are named by their SHA-256, so only legacy files are hashed here.
+    return cache.make_key(
+        content_hash or cache.file_sha256(path), Config.OLLAMA_MODEL, Config.ANALYSIS_PROMPT, Config.ANALYSIS_MAX_CHARS,
+        Config.SUMMARY_CHUNK_TOKENS, Config.SUMMARY_CHUNK_PROMPT, Config.SUMMARY_REDUCE_PROMPT,
+    )
+
+def analyze_text(text, conn_str=None):
+    return summarize(text, conn_str)
+
+# Parameters are (analysis, document_id); follow with search.REFRESH_VECTOR_SQL.
+SAVE_ANALYSIS_SQL = """
+    INSERT INTO document_analyses (document_id, analysis)
+    SELECT id, %s FROM documents WHERE id = %s
+    ON CONFLICT (document_id) DO UPDATE SET analysis = EXCLUDED.analysis, analyzed_at = now()
+"""
+
+def save_analysis(conn_str, document_id, analysis):
+    with get_db(conn_str) as conn:
+        cur = conn.cursor()
+        cur.execute(SAVE_ANALYSIS_SQL, (analysis, document_id))
+        search.refresh_vector(cur, document_id)
+
+def save_analyses(conn_str, analyses):
+    """Save {document_id: analysis} in one statement."""
+    ids = list(analyses)
+    with get_db(conn_str) as conn:
+        cur = conn.cursor()
+        cur.execute("""
+            INSERT INTO document_analyses (document_id, analysis)
+            SELECT v.id, v.analysis FROM unnest(%s::int[], %s::text[]) AS v(id, analysis)
+            JOIN documents d ON d.id = v.id
+            ON CONFLICT (document_id) DO UPDATE SET analysis = EXCLUDED.analysis, analyzed_at = now()
+        """, (ids, [analyses[i] for i in ids]))
+        search.refresh_vectors(cur, ids)
+
+def stream_document_analysis(conn_str, document_id, path, content_hash=None):
+    """Yield analysis tokens as they arrive; the full text is cached and saved once the stream ends.
+
+    Long documents run the (non-streamed) chunk summaries first; only the
+    final reduce call is streamed.
+    """
+    key = analysis_cache_key(path, content_hash)
+    analysis = cache.get(conn_str, key)
+    if analysis is not None:
+        save_analysis(conn_str, document_id, analysis)
+        yield analysis
+        return
+    with metrics.in_flight('analyses'):
+        try:
+            text = textstore.get_text(conn_str, document_id, path, Config.ANALYSIS_MAX_CHARS)
+        except ExtractionError as e:
+            raise AnalysisError("Failed to extract text") from e
+        start = time.monotonic()
+        parts = []
+        for token in llm.generate_stream(prepare_prompt(text, conn_str)):
+            parts.append(token)
+            yield token
+    analysis = ''.join(parts)
+    cache.put(conn_str, key, analysis, time.monotonic() - start)
+    save_analysis(conn_str, document_id, analysis)
@@ -1,28 +1,57 @@
-from flask import Flask, render_template, request, redirect, url_for, session, flash, send_file
+from flask import Flask, Response, render_template, request, redirect, url_for, session, flash, jsonify
 from flask_cors import CORS
 import os
-import datetime
 import jwt
-import bcrypt
 import psycopg2
 import psycopg2.extras
-import requests
-import pdfplumber
-from werkzeug.utils import secure_filename
-import time
 
 # config.py and db.py assumed to be as previously defined; adjust if needed
 from config import Config
-from db import init_db, get_db
+from db import init_db, get_db, pool_stats
+import batch
+import jobs
+import cache
+import llm
+import metrics
+import textstore
+import pagination
+import previews
+import search
+import serving
+import storage
+import uploads
+from analysis import stream_document_analysis
+from storage import document_path
+from utils.streaming import token_stream_response
+from utils.auth import get_user_by_username
+from utils.json_provider import JSONProvider
+from utils.passwords import PasswordServiceBusy, check_password, hash_password, rehash_if_needed
 
 def create_app():
     app = Flask(__name__)
     app.config.from_object(Config)
     app.secret_key = app.config['SECRET_KEY']
+    app.json = JSONProvider(app)
     CORS(app)
+    app.wsgi_app = metrics.WSGIMiddleware(app.wsgi_app)
+    app.jinja_env.globals['previews_enabled'] = previews.available()
+
+    @app.before_request
+    def label_route():
+        metrics.set_route(request.url_rule.rule if request.url_rule else None)
+
+    @app.before_request
+    def restrict_stats():
+        if request.endpoint in ('db_stats', 'cache_stats', 'llm_stats', 'metrics_page'):
+            status = metrics.stats_access(request.headers.get('Authorization'))
+            if status is not None:
+                return jsonify({"error": "Not found" if status == 404 else "Stats token required"}), status
 
     # Initialize database
     init_db(app.config['DB_CONN_STR'])
+    search.backfill(app.config['DB_CONN_STR'])
+    if app.config['JOB_WORKERS_EMBEDDED']:
+        jobs.start_workers(app.config['DB_CONN_STR'], app.config['JOB_WORKERS'])
 
     # Auth routes
     @app.route('/register', methods=['GET', 'POST'])
@@ -33,11 +62,15 @@ def create_app():
             if not username or not password:
                 flash('Missing fields', 'error')
                 return redirect(url_for('register_page'))
-            hashed = bcrypt.hashpw(password.encode(), bcrypt.gensalt())
+            try:
+                hashed = hash_password(password)
+            except PasswordServiceBusy:
+                flash('Server busy, please try again', 'error')
+                return redirect(url_for('register_page'))
             with get_db(app.config['DB_CONN_STR']) as conn:
                 cur = conn.cursor()
                 try:
-                    cur.execute("INSERT INTO users (username, password) VALUES (%s, %s)", (username, hashed.decode()))
+                    cur.execute("INSERT INTO users (username, password) VALUES (%s, %s)", (username, hashed))
                     conn.commit()
                     flash('User registered successfully')
                     return redirect(url_for('login_page'))
@@ -54,16 +87,19 @@ def create_app():
             if not username or not password:
                 flash('Missing fields', 'error')
                 return redirect(url_for('login_page'))
-            with get_db(app.config['DB_CONN_STR']) as conn:
-                cur = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
-                cur.execute("SELECT * FROM users WHERE username = %s", (username,))
-                user = cur.fetchone()
-                if user and bcrypt.checkpw(password.encode(), user['password'].encode()):
-                    session['user_id'] = user['id']
-                    flash('Logged in successfully')
-                    return redirect(url_for('dashboard'))
-                else:
-                    flash('Invalid credentials', 'error')
+            user = get_user_by_username(username)
+            try:
+                valid = user is not None and check_password(password, user['password'])
+            except PasswordServiceBusy:
+                flash('Server busy, please try again', 'error')
+                return redirect(url_for('login_page'))
+            if valid:
+                rehash_if_needed(user, password)
+                session['user_id'] = user['id']
+                flash('Logged in successfully')
+                return redirect(url_for('dashboard'))
+            else:
+                flash('Invalid credentials', 'error')
         return render_template('login.html')
 
     @app.route('/logout')
@@ -82,34 +118,71 @@ def create_app():
         if 'file' not in request.files:
             flash('File required', 'error')
             return redirect(url_for('dashboard'))
-        file = request.files['file']
-        if file.filename == '':
+        files = [file for file in request.files.getlist('file') if file.filename != '']
+        if not files:
             flash('No selected file', 'error')
             return redirect(url_for('dashboard'))
-        
-        # Retain exact original filename (no sanitization for MVP; use with caution in production)
-        filename = file.filename
-        path = os.path.join(app.config['UPLOADS_DIR'], filename)
-        
-        # Handle overwrites by appending timestamp
-        base, ext = os.path.splitext(filename)
-        counter = 1
-        original_path = path
-        while os.path.exists(path):
-            timestamp = int(time.time())
-            filename = f"{base} ({timestamp}){ext}"
-            path = os.path.join(app.config['UPLOADS_DIR'], filename)
-            counter += 1
-        
-        file.save(path)
-        upload_date = datetime.datetime.now().isoformat()
-        with get_db(app.config['DB_CONN_STR']) as conn:
-            cur = conn.cursor()
-            cur.execute("INSERT INTO documents (user_id, filename, upload_date) VALUES (%s, %s, %s)", (user_id, filename, upload_date))
-            conn.commit()
-        flash(f'Document "{filename}" uploaded successfully')
+
+        # Retain exact original filenames (no sanitization for MVP; use with caution in production).
+        # Files are stored by content hash, so equal names never collide on disk.
+        try:
+            results = batch.upload(app.config['DB_CONN_STR'], user_id, [(file.filename, file.stream) for file in files])
+        except batch.BatchError as e:
+            flash(str(e), 'error')
+            return redirect(url_for('dashboard'))
+        for result in results:
+            if result['status'] == 'uploaded':
+                flash(f'Document "{result["filename"]}" uploaded successfully')
+            else:
+                flash(f'"{result["filename"]}": {result["error"]}', 'error')
         return redirect(url_for('dashboard'))
 
+    # Resumable uploads, used by the dashboard for large files
+    @app.route('/uploads', methods=['POST'])
+    def create_upload():
+        if 'user_id' not in session:
+            return jsonify({"error": "Please log in"}), 401
+        data = request.get_json(silent=True) or {}
+        try:
+            upload = uploads.create_session(app.config['DB_CONN_STR'], session['user_id'],
+                                            data.get('filename'), data.get('size'), data.get('sha256'))
+        except uploads.UploadError as e:
+            return jsonify({"error": str(e)}), e.status
+        return jsonify(upload), 201
+
+    @app.route('/uploads/<upload_id>', methods=['GET', 'PUT', 'DELETE'])
+    def resumable_upload(upload_id):
+        if 'user_id' not in session:
+            return jsonify({"error": "Please log in"}), 401
+        conn_str, user_id = app.config['DB_CONN_STR'], session['user_id']
+        try:
+            if request.method == 'GET':
+                return jsonify(uploads.get_session(conn_str, upload_id, user_id))
+            if request.method == 'DELETE':
+                if not uploads.cancel(conn_str, upload_id, user_id):
+                    return jsonify({"error": "Upload not found"}), 404
+                return jsonify({"message": "Upload cancelled"})
+            offset = request.headers.get('Upload-Offset', type=int)
+            if offset is None:
+                return jsonify({"error": "Upload-Offset header required"}), 400
+            offset = uploads.append_chunk(conn_str, upload_id, user_id, offset, request.stream)
+        except uploads.UploadError as e:
+            return jsonify({"error": str(e), "offset": e.offset}), e.status
+        return jsonify({"upload_id": upload_id, "offset": offset})
+
+    @app.route('/uploads/<upload_id>/complete', methods=['POST'])
+    def complete_upload(upload_id):
+        if 'user_id' not in session:
+            return jsonify({"error": "Please log in"}), 401
+        user_id = session['user_id']
+        try:
+            doc_id, filename, path = uploads.complete(app.config['DB_CONN_STR'], upload_id, user_id)
+        except uploads.UploadError as e:
+            return jsonify({"error": str(e), "offset": e.offset}), e.status
+        jobs.after_upload(app.config['DB_CONN_STR'], doc_id, user_id, path)
+        flash(f'Document "{filename}" uploaded successfully')
+        return jsonify({"id": doc_id, "filename": filename}), 201
+
     @app.route('/analyze/<int:doc_id>', methods=['POST'])
     def analyze_document(doc_id):
         if 'user_id' not in session:
@@ -118,34 +191,42 @@ def create_app():
         user_id = session['user_id']
         with get_db(app.config['DB_CONN_STR']) as conn:
             cur = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
-            cur.execute("SELECT filename FROM documents WHERE id = %s AND user_id = %s", (doc_id, user_id))
+            cur.execute("SELECT filename, content_hash FROM documents WHERE id = %s AND user_id = %s", (doc_id, user_id))
             doc = cur.fetchone()
             if not doc:
                 flash('Document not found', 'error')
                 return redirect(url_for('dashboard'))
-        path = os.path.join(app.config['UPLOADS_DIR'], doc['filename'])
-        try:
-            with pdfplumber.open(path) as pdf:
-                text = ' '.join(page.extract_text() or '' for page in pdf.pages)
-        except Exception:
-            flash('Failed to extract text', 'error')
-            return redirect(url_for('dashboard'))
-        prompt = f"Summarize this document: {text[:2000]}"
-        ollama_req = {"model": "llama3", "prompt": prompt, "stream": False}
-        try:
-            resp = requests.post(app.config['OLLAMA_ENDPOINT'], json=ollama_req)
-            resp.raise_for_status()
-            analysis = resp.json().get('response', '')
-        except Exception:
-            flash('Failed to analyze', 'error')
+        if jobs.analyze_from_cache(app.config['DB_CONN_STR'], doc_id, doc['filename'], doc['content_hash']) is not None:
+            flash('Document analyzed successfully')
             return redirect(url_for('dashboard'))
-        with get_db(app.config['DB_CONN_STR']) as conn:
-            cur = conn.cursor()
-            cur.execute("UPDATE documents SET analysis = %s WHERE id = %s", (analysis, doc_id))
-            conn.commit()
-        flash('Document analyzed successfully')
+        job_id = jobs.enqueue(app.config['DB_CONN_STR'], 'analyze', doc_id, user_id)
+        flash(f'Analysis queued (job {job_id}); refresh the dashboard to see the result')
         return redirect(url_for('dashboard'))
 
+    @app.route('/analyze/<int:doc_id>/stream', methods=['POST'])
+    def analyze_document_stream(doc_id):
+        if 'user_id' not in session:
+            return jsonify({"error": "Please log in"}), 401
+        user_id = session['user_id']
+        with get_db(app.config['DB_CONN_STR']) as conn:
+            cur = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
+            cur.execute("SELECT filename, content_hash FROM documents WHERE id = %s AND user_id = %s", (doc_id, user_id))
+            doc = cur.fetchone()
+            if not doc:
+                return jsonify({"error": "Document not found"}), 404
+        path = document_path(doc['filename'], doc['content_hash'])
+        tokens = stream_document_analysis(app.config['DB_CONN_STR'], doc_id, path, doc['content_hash'])
+        return token_stream_response(tokens)
+
+    @app.route('/jobs/<int:job_id>')
+    def job_status(job_id):
+        if 'user_id' not in session:
+            return jsonify({"error": "Please log in"}), 401
+        job = jobs.get_job(app.config['DB_CONN_STR'], job_id, session['user_id'])
+        if not job:
+            return jsonify({"error": "Job not found"}), 404
+        return jsonify(job)
+
     @app.route('/sign/<int:doc_id>', methods=['POST'])
     def sign_document(doc_id):
         if 'user_id' not in session:
@@ -156,15 +237,9 @@ def create_app():
         if not signature:
             flash('Signature required', 'error')
             return redirect(url_for('dashboard'))
-        with get_db(app.config['DB_CONN_STR']) as conn:
-            cur = conn.cursor()
-            cur.execute("SELECT id FROM documents WHERE id = %s AND user_id = %s", (doc_id, user_id))
-            if cur.fetchone() is None:
-                flash('Document not found', 'error')
-                return redirect(url_for('dashboard'))
-            signed_date = datetime.datetime.now().isoformat()
-            cur.execute("UPDATE documents SET signature = %s, signed_date = %s WHERE id = %s", (signature, signed_date, doc_id))
-            conn.commit()
+        if batch.sign(app.config['DB_CONN_STR'], user_id, [(doc_id, signature)])[0]['status'] == 'not_found':
+            flash('Document not found', 'error')
+            return redirect(url_for('dashboard'))
         flash('Document signed successfully')
         return redirect(url_for('dashboard'))
 
@@ -176,13 +251,12 @@ def create_app():
         user_id = session['user_id']
         with get_db(app.config['DB_CONN_STR']) as conn:
             cur = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
-            cur.execute("SELECT filename FROM documents WHERE id = %s AND user_id = %s", (doc_id, user_id))
+            cur.execute("SELECT filename, content_hash FROM documents WHERE id = %s AND user_id = %s", (doc_id, user_id))
             doc = cur.fetchone()
             if not doc:
                 flash('Document not found', 'error')
                 return redirect(url_for('dashboard'))
-        path = os.path.join(app.config['UPLOADS_DIR'], doc['filename'])
-        return send_file(path, as_attachment=True)
+        return serving.send_document(doc, as_attachment=True)
 
     @app.route('/pdf/<int:doc_id>')
     def serve_pdf(doc_id):
@@ -192,13 +266,26 @@ def create_app():
         user_id = session['user_id']
         with get_db(app.config['DB_CONN_STR']) as conn:
             cur = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
-            cur.execute("SELECT filename FROM documents WHERE id = %s AND user_id = %s", (doc_id, user_id))
+            cur.execute("SELECT filename, content_hash FROM documents WHERE id = %s AND user_id = %s", (doc_id, user_id))
             doc = cur.fetchone()
             if not doc:
                 flash('Document not found', 'error')
                 return redirect(url_for('dashboard'))
-        path = os.path.join(app.config['UPLOADS_DIR'], doc['filename'])
-        return send_file(path, mimetype='application/pdf')
+        return serving.send_document(doc)
+
+    @app.route('/preview/<int:doc_id>/thumb')
+    @app.route('/preview/<int:doc_id>/page/<int:page_no>')
+    def preview_image(doc_id, page_no=None):
+        if 'user_id' not in session:
+            return jsonify({"error": "Please log in"}), 401
+        with get_db(app.config['DB_CONN_STR']) as conn:
+            cur = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
+            cur.execute("SELECT id, filename, content_hash FROM documents WHERE id = %s AND user_id = %s",
+                        (doc_id, session['user_id']))
+            doc = cur.fetchone()
+        if not doc or page_no == 0:
+            return jsonify({"error": "Document not found"}), 404
+        return serving.send_preview(doc, previews.THUMBNAIL if page_no is None else previews.page_name(page_no))
 
     @app.route('/document/<int:doc_id>')
     def view_document(doc_id):
@@ -209,14 +296,29 @@ def create_app():
         with get_db(app.config['DB_CONN_STR']) as conn:
             cur = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
             cur.execute("""
-                SELECT id, filename, upload_date, analysis, signature, signed_date 
-                FROM documents WHERE id = %s AND user_id = %s
+                SELECT d.id, d.filename, d.uploaded_at AS upload_date, a.analysis, s.signature, d.signed_at AS signed_date,
+                       d.content_hash
+                FROM documents d
+                LEFT JOIN document_analyses a ON a.document_id = d.id
+                LEFT JOIN document_signatures s ON s.document_id = d.id
+                WHERE d.id = %s AND d.user_id = %s
             """, (doc_id, user_id))
             doc = cur.fetchone()
             if not doc:
                 flash('Document not found', 'error')
                 return redirect(url_for('dashboard'))
-        return render_template('document.html', doc=doc)
+        text_preview = textstore.load_text(app.config['DB_CONN_STR'], doc_id, app.config['TEXT_PREVIEW_CHARS'])
+        text_info = textstore.text_info(app.config['DB_CONN_STR'], doc_id)
+        # Page images stand in for the PDF until the user asks for the full document.
+        preview_pages = 0
+        if previews.available():
+            try:
+                preview_pages = text_info['page_count'] if text_info else previews.page_count(
+                    document_path(doc['filename'], doc['content_hash']))
+            except previews.PreviewError:
+                pass
+        return render_template('document.html', doc=doc, text_preview=text_preview, text_info=text_info,
+                               preview_pages=min(preview_pages, app.config['PREVIEW_VIEWER_PAGES']))
 
     @app.route('/delete/<int:doc_id>', methods=['POST'])
     def delete_document(doc_id):
@@ -224,44 +326,82 @@ def create_app():
             flash('Please log in', 'error')
             return redirect(url_for('login_page'))
         user_id = session['user_id']
-        with get_db(app.config['DB_CONN_STR']) as conn:
-            cur = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
-            cur.execute("SELECT filename FROM documents WHERE id = %s AND user_id = %s", (doc_id, user_id))
-            doc = cur.fetchone()
-            if not doc:
-                flash('Document not found', 'error')
-                return redirect(url_for('dashboard'))
-            
-            # Delete file from disk
-            path = os.path.join(app.config['UPLOADS_DIR'], doc['filename'])
-            try:
-                os.remove(path)
-            except OSError:
-                pass  # File might not exist or permission issue; continue
-            
-            # Delete from DB
-            cur.execute("DELETE FROM documents WHERE id = %s", (doc_id,))
-            conn.commit()
-        
+        # The file goes with its last referencing document.
+        if not storage.delete_document(app.config['DB_CONN_STR'], doc_id, user_id):
+            flash('Document not found', 'error')
+            return redirect(url_for('dashboard'))
         flash('Document deleted successfully')
         return redirect(url_for('dashboard'))
 
+    # Batch actions on the documents selected in the dashboard
+    @app.route('/batch/<action>', methods=['POST'])
+    def batch_action(action):
+        if 'user_id' not in session:
+            flash('Please log in', 'error')
+            return redirect(url_for('login_page'))
+        conn_str, user_id = app.config['DB_CONN_STR'], session['user_id']
+        ids = request.form.getlist('ids')
+        try:
+            if action == 'analyze':
+                results = batch.analyze(conn_str, user_id, ids)
+            elif action == 'sign':
+                results = batch.sign(conn_str, user_id, [(i, request.form.get('signature')) for i in ids])
+            elif action == 'delete':
+                results = batch.delete(conn_str, user_id, ids)
+            else:
+                flash('Unknown action', 'error')
+                return redirect(url_for('dashboard'))
+        except batch.BatchError as e:
+            flash(str(e), 'error')
+            return redirect(url_for('dashboard'))
+        counts = {}
+        for result in results:
+            counts[result['status']] = counts.get(result['status'], 0) + 1
+        flash(', '.join(f"{count} {status.replace('_', ' ')}" for status, count in counts.items()))
+        return redirect(url_for('dashboard'))
+
     @app.route('/dashboard')
     def dashboard():
         if 'user_id' not in session:
             flash('Please log in', 'error')
             return redirect(url_for('login_page'))
         user_id = session['user_id']
-        with get_db(app.config['DB_CONN_STR']) as conn:
-            cur = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
-            cur.execute("SELECT id, filename, upload_date, analysis, signature, signed_date FROM documents WHERE user_id = %s", (user_id,))
-            docs = cur.fetchall()
-        return render_template('dashboard.html', docs=docs)
+        q = request.args.get('q', '').strip()
+        if q:
+            offset = request.args.get('offset', 0, type=int)
+            docs, next_offset = search.search_documents(app.config['DB_CONN_STR'], user_id, q, offset=max(offset, 0))
+            return render_template('dashboard.html', docs=docs, q=q, next_offset=next_offset, first_page=offset <= 0)
+        sort = request.args.get('sort', 'uploaded')
+        try:
+            docs, next_cursor = pagination.list_documents(
+                app.config['DB_CONN_STR'], user_id, sort=sort, cursor=request.args.get('cursor'))
+        except ValueError:
+            return redirect(url_for('dashboard'))
+        return render_template('dashboard.html', docs=docs, sort=sort, next_cursor=next_cursor,
+                               first_page=not request.args.get('cursor'))
 
     @app.route('/')
     def index():
         return render_template('index.html')
 
+    @app.route('/stats/db')
+    def db_stats():
+        return jsonify(pool_stats())
+
+    @app.route('/stats/cache')
+    def cache_stats():
+        return jsonify(cache.stats(app.config['DB_CONN_STR']))
+
+    @app.route('/stats/llm')
+    def llm_stats():
+        return jsonify(llm.backend_stats())
+
+    @app.route('/metrics')
+    def metrics_page():
+        metrics.update_gauges(pool_stats(), jobs.queue_counts(app.config['DB_CONN_STR']), cache.counters(),
+                              llm.backend_stats())
+        return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
     return app
 
 if __name__ == '__main__':
@@ -0,0 +1,296 @@
+# asgi.py
+# Async serving mode for the JSON APIs of blueprints/auth.py and
+# blueprints/documents.py, on Quart: asyncpg for Postgres and one shared
+# httpx client for Ollama, so a single process can keep hundreds of slow
+# analyses streaming. Queries are the sync modules' SQL (see async_db.sql).
+# Token/user caches, password hashing, uploads and text extraction are the
+# sync app's code, run in threads.
+# Run with: hypercorn asgi:app --bind 0.0.0.0:8000
+import asyncio
+import logging
+from functools import wraps
+import asyncpg
+import jwt
+from quart import Quart, Response, jsonify, request, send_file
+from config import Config
+from db import init_db
+import async_analysis
+import async_db
+import async_llm
+import batch
+import cache
+import jobs
+import llm
+import metrics
+import pagination
+import storage
+import textstore
+from utils import auth
+from utils.json_provider import JSONProvider
+from utils.passwords import PasswordServiceBusy, check_password, hash_password, rehash_if_needed
+from utils.streaming import STREAM_HEADERS, format_message, stream_mimetype
+
+log = logging.getLogger(__name__)
+
+def auth_required(f):
+    @wraps(f)
+    async def decorated_function(*args, **kwargs):
+        token = request.headers.get('Authorization')
+        if not token:
+            return jsonify({"error": "Authorization header required"}), 401
+        try:
+            user = await asyncio.to_thread(_authenticate, token)
+        except jwt.InvalidTokenError:
+            return jsonify({"error": "Invalid token"}), 401
+        if user is None:
+            return jsonify({"error": "Invalid token"}), 401
+        request.user_id = user['id']
+        request.user = user
+        return await f(*args, **kwargs)
+    return decorated_function
+
+def _authenticate(token):
+    # Cached in utils.auth; a miss or revocation refresh touches the database.
+    return auth.get_user(auth.verify_token(token)['user_id'])
+
+async def _document(doc_id, user_id):
+    async with async_db.acquire() as conn:
+        return await conn.fetchrow(async_db.sql(storage.DOCUMENT_SQL), doc_id, user_id)
+
+async def _enqueue(kind, document_id, user_id):
+    async with async_db.acquire() as conn:
+        return await conn.fetchval(async_db.sql(jobs.ENQUEUE_SQL), kind, document_id, user_id)
+
+async def list_documents(user_id, sort='uploaded', cursor=None, limit=None):
+    """pagination.list_documents on asyncpg."""
+    query, params, limit = pagination.listing_query(user_id, sort, cursor, limit)
+    async with async_db.acquire() as conn:
+        rows = await conn.fetch(async_db.sql(query), *params)
+    return pagination.page(rows, sort, limit)
+
+def create_asgi_app():
+    app = Quart(__name__)
+    app.config.from_object(Config)
+    app.json = JSONProvider(app)
+    app.config['MAX_CONTENT_LENGTH'] = Config.UPLOAD_MAX_SIZE
+    app.config['BODY_TIMEOUT'] = Config.OLLAMA_READ_TIMEOUT
+    app.config['RESPONSE_TIMEOUT'] = None  # analyses stream for as long as the model takes
+    app.asgi_app = metrics.ASGIMiddleware(app.asgi_app)
+
+    @app.before_request
+    async def label_route():
+        metrics.set_route(request.url_rule.rule if request.url_rule else None)
+
+    @app.before_request
+    async def restrict_stats():
+        if request.endpoint == 'metrics_page':
+            status = metrics.stats_access(request.headers.get('Authorization'))
+            if status is not None:
+                return jsonify({"error": "Not found" if status == 404 else "Stats token required"}), status
+
+    @app.before_serving
+    async def startup():
+        await asyncio.to_thread(init_db, Config.DB_CONN_STR)
+        await async_db.open_pool(Config.DB_CONN_STR)
+        if Config.JOB_WORKERS_EMBEDDED:
+            jobs.start_workers(Config.DB_CONN_STR, Config.JOB_WORKERS)
+
+    @app.after_serving
+    async def shutdown():
+        await asyncio.to_thread(jobs.stop_workers)
+        await async_llm.close()
+        await async_db.close_pool()
+
+    # Auth API
+    @app.route('/register', methods=['POST'])
+    async def register():
+        data = await request.get_json(silent=True) or {}
+        username = data.get('username')
+        password = data.get('password')
+        if not username or not password:
+            return jsonify({"error": "Missing fields"}), 400
+        try:
+            hashed = await asyncio.to_thread(hash_password, password)
+        except PasswordServiceBusy:
+            return jsonify({"error": "Server busy, try again"}), 503, {"Retry-After": "1"}
+        try:
+            async with async_db.acquire() as conn:
+                await conn.execute("INSERT INTO users (username, password) VALUES ($1, $2)", username, hashed)
+        except asyncpg.UniqueViolationError:
+            return jsonify({"error": "Username already exists"}), 400
+        return jsonify({"message": "User registered"}), 200
+
+    @app.route('/login', methods=['POST'])
+    async def login():
+        data = await request.get_json(silent=True) or {}
+        username = data.get('username')
+        password = data.get('password')
+        if not username or not password:
+            return jsonify({"error": "Missing fields"}), 400
+        user = await asyncio.to_thread(auth.get_user_by_username, username)
+        try:
+            valid = user is not None and await asyncio.to_thread(check_password, password, user['password'])
+        except PasswordServiceBusy:
+            return jsonify({"error": "Server busy, try again"}), 503, {"Retry-After": "1"}
+        if not valid:
+            return jsonify({"error": "Invalid credentials"}), 401
+        rehash_if_needed(user, password)
+        return jsonify({"token": auth.issue_token(user['id'])}), 200
+
+    @app.route('/logout', methods=['POST'])
+    @auth_required
+    async def logout():
+        await asyncio.to_thread(auth.revoke_token, request.headers['Authorization'])
+        return jsonify({"message": "Logged out"}), 200
+
+    # Document API
+    @app.route('/documents/upload', methods=['POST'])
+    @auth_required
+    async def upload_document():
+        files = await request.files
+        if 'file' not in files:
+            return jsonify({"error": "File required"}), 400
+        file = files['file']
+        if file.filename == '':
+            return jsonify({"error": "No selected file"}), 400
+        filename = storage.safe_filename(file.filename)
+        # The spooled upload and the object store are plain files: work on them off the loop.
+        try:
+            temp_path, content_hash, size = await asyncio.to_thread(storage.receive, file.stream)
+        except storage.UploadTooLarge:
+            return jsonify({"error": "File too large"}), 413
+        doc_id, path = await asyncio.to_thread(
+            storage.create_document, Config.DB_CONN_STR, request.user_id, filename, temp_path, content_hash, size)
+        await asyncio.to_thread(jobs.after_upload, Config.DB_CONN_STR, doc_id, request.user_id, path)
+        return jsonify({"message": "Document uploaded", "id": doc_id, "filename": filename, "sha256": content_hash}), 200
+
+    @app.route('/documents', methods=['GET'])
+    @auth_required
+    async def documents_list():
+        try:
+            docs, next_cursor = await list_documents(
+                request.user_id,
+                sort=request.args.get('sort', 'uploaded'),
+                cursor=request.args.get('cursor'),
+                limit=pagination.parse_limit(request.args.get('limit')),
+            )
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        return jsonify({"documents": docs, "next_cursor": next_cursor}), 200
+
+    @app.route('/documents/<int:doc_id>/analyze', methods=['POST'])
+    @auth_required
+    async def analyze_document(doc_id):
+        doc = await _document(doc_id, request.user_id)
+        if not doc:
+            return jsonify({"error": "Document not found"}), 404
+        path = storage.document_path(doc['filename'], doc['content_hash'])
+        try:
+            key = await async_analysis.document_cache_key(path, doc['content_hash'])
+            analysis = await async_analysis.cache_get(key)
+        except OSError:
+            analysis = None  # file missing; the queued job reports it
+        if analysis is not None:
+            await async_analysis.save_analysis(doc_id, analysis)
+            return jsonify({"analysis": analysis, "cached": True}), 200
+        job_id = await _enqueue('analyze', doc_id, request.user_id)
+        return jsonify({"job_id": job_id, "status": "queued"}), 202
+
+    @app.route('/documents/<int:doc_id>/analyze/stream', methods=['POST'])
+    @auth_required
+    async def analyze_document_stream(doc_id):
+        doc = await _document(doc_id, request.user_id)
+        if not doc:
+            return jsonify({"error": "Document not found"}), 404
+        ndjson = request.accept_mimetypes.best_match(['text/event-stream', 'application/x-ndjson']) == 'application/x-ndjson'
+        path = storage.document_path(doc['filename'], doc['content_hash'])
+        tokens = async_analysis.stream_document_analysis(doc_id, path, doc['content_hash'])
+
+        async def generate():
+            parts = []
+            try:
+                async for token in tokens:
+                    parts.append(token)
+                    yield format_message({"token": token}, ndjson=ndjson)
+            except Exception:
+                log.exception("Streaming analysis failed")
+                yield format_message({"error": "Failed to analyze"}, event="error", ndjson=ndjson)
+                return
+            yield format_message({"analysis": ''.join(parts)}, event="done", ndjson=ndjson)
+
+        return Response(generate(), mimetype=stream_mimetype(ndjson), headers=STREAM_HEADERS)
+
+    @app.route('/documents/jobs/<int:job_id>', methods=['GET'])
+    @auth_required
+    async def job_status(job_id):
+        async with async_db.acquire() as conn:
+            job = await conn.fetchrow(async_db.sql(jobs.JOB_SQL), job_id, request.user_id)
+        if not job:
+            return jsonify({"error": "Job not found"}), 404
+        return jsonify(dict(job)), 200
+
+    @app.route('/documents/<int:doc_id>/text', methods=['GET'])
+    @auth_required
+    async def document_text(doc_id):
+        try:
+            start = int(request.args.get('start', 0))
+            stop = int(request.args['stop']) if 'stop' in request.args else None
+        except ValueError:
+            return jsonify({"error": "Invalid document ID or page range"}), 400
+        if not await _document(doc_id, request.user_id):
+            return jsonify({"error": "Document not found"}), 404
+        async with async_db.acquire() as conn:
+            page_count = await conn.fetchval(async_db.sql(textstore.PAGE_COUNT_SQL), doc_id)
+            if page_count is None:
+                return jsonify({"error": "Text not extracted yet"}), 409
+            rows = await conn.fetch(async_db.sql(textstore.PAGES_SQL), doc_id, start, stop, stop)
+        pages = [textstore.decompress(row['content']) for row in rows]
+        return jsonify({"page_count": page_count, "start": start, "pages": pages}), 200
+
+    @app.route('/documents/<int:doc_id>/sign', methods=['POST'])
+    @auth_required
+    async def sign_document(doc_id):
+        data = await request.get_json(silent=True) or {}
+        signature = data.get('signature')
+        if not signature:
+            return jsonify({"error": "Signature required"}), 400
+        async with async_db.acquire() as conn:
+            signed = await conn.fetchval(async_db.sql(batch.SIGN_SQL), [doc_id], [signature], request.user_id)
+        if signed is None:
+            return jsonify({"error": "Document not found"}), 404
+        return jsonify({"message": "Document signed"}), 200
+
+    @app.route('/documents/<int:doc_id>/download', methods=['GET'])
+    @auth_required
+    async def download_document(doc_id):
+        doc = await _document(doc_id, request.user_id)
+        if not doc:
+            return jsonify({"error": "Document not found"}), 404
+        path = storage.document_path(doc['filename'], doc['content_hash'])
+        try:
+            response = await send_file(path, mimetype='application/pdf', as_attachment=True,
+                                       attachment_filename=doc['filename'], add_etags=not doc['content_hash'])
+        except FileNotFoundError:
+            return jsonify({"error": "File missing"}), 404
+        if doc['content_hash']:
+            response.set_etag(doc['content_hash'])
+        # Private and revalidated, like serving.send_document.
+        response.cache_control.public = False
+        response.cache_control.max_age = None
+        response.cache_control.no_cache = True
+        response.cache_control.private = True
+        response.expires = None
+        await response.make_conditional(request, accept_ranges=True, complete_length=response.content_length)
+        return response
+
+    @app.route('/metrics')
+    async def metrics_page():
+        async with async_db.acquire() as conn:
+            rows = await conn.fetch(jobs.QUEUE_COUNTS_SQL)
+        queue = {(row['kind'], row['status']): row['count'] for row in rows}
+        metrics.update_gauges(async_db.pool_stats(), queue, cache.counters(), llm.backend_stats())
+        return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
+    return app
+
+app = create_asgi_app()
@@ -0,0 +1,111 @@
+# async_analysis.py
+# The analysis pipeline of analysis.py and summarize.py for the ASGI app:
+# their SQL, cache keys, text joining and map-reduce plan, awaited on asyncpg
+# and the shared httpx client so a waiting analysis holds no thread.
+# Text extraction is CPU-bound and still runs in a worker thread.
+import asyncio
+import time
+from config import Config
+import async_db
+import async_llm
+import cache
+import metrics
+import search
+import summarize
+import textstore
+from analysis import SAVE_ANALYSIS_SQL, AnalysisError, analysis_cache_key
+from extraction import ExtractionError
+
+async def cache_get(key):
+    analysis = cache.memory_get(key)
+    if analysis is not None:
+        return analysis
+    async with async_db.acquire() as conn:
+        row = await conn.fetchrow(async_db.sql(cache.GET_SQL), key, cache.ttl())
+    return cache.remember(key, row)
+
+async def cache_put(key, analysis, generation_seconds=0.0):
+    cache.memory_put(key, analysis, generation_seconds)
+    async with async_db.acquire() as conn:
+        await conn.execute(async_db.sql(cache.PUT_SQL), key, analysis, generation_seconds)
+        if not cache.eviction_due():
+            return
+        async with conn.transaction():
+            await conn.execute(async_db.sql(cache.EVICT_EXPIRED_SQL), cache.ttl())
+            await conn.execute(async_db.sql(cache.EVICT_LRU_SQL), Config.ANALYSIS_CACHE_MAX_ROWS)
+
+async def document_cache_key(path, content_hash):
+    if content_hash:
+        return analysis_cache_key(path, content_hash)
+    return await asyncio.to_thread(analysis_cache_key, path)  # legacy file: hash it off the loop
+
+async def load_text(document_id, max_chars=None):
+    """textstore.load_text: stored text, or None if the document was never extracted."""
+    builder = textstore.TextBuilder(max_chars)
+    async with async_db.acquire() as conn, conn.transaction():
+        async for record in conn.cursor(async_db.sql(textstore.TEXT_SQL), document_id, prefetch=16):
+            if not builder.add(record['content']):
+                break
+    return builder.text()
+
+async def get_text(document_id, path, max_chars=None):
+    text = await load_text(document_id, max_chars)
+    if text is None:
+        text = await asyncio.to_thread(textstore.get_text, Config.DB_CONN_STR, document_id, path, max_chars)
+    return text
+
+async def _summarize_chunk(chunk, slots):
+    key = summarize.chunk_cache_key(chunk)
+    summary = await cache_get(key)
+    if summary is None:
+        async with slots:
+            start = time.monotonic()
+            summary = await async_llm.generate(summarize.chunk_prompt(chunk))
+        await cache_put(key, summary, time.monotonic() - start)
+    return summary
+
+async def map_chunks(chunks, parallelism=None):
+    """Summarize chunks concurrently; raises the first failure after every chunk has finished."""
+    slots = asyncio.Semaphore(parallelism or Config.SUMMARY_PARALLELISM)
+    results = await asyncio.gather(*(_summarize_chunk(chunk, slots) for chunk in chunks), return_exceptions=True)
+    for result in results:
+        if isinstance(result, BaseException):
+            raise result
+    return results
+
+async def prepare_prompt(text, parallelism=None):
+    """summarize.prepare_prompt, driving the same summarize.plan_prompt."""
+    plan = summarize.plan_prompt(text)
+    summaries = None
+    try:
+        while True:
+            summaries = await map_chunks(plan.send(summaries), parallelism)
+    except StopIteration as done:
+        return done.value
+
+async def save_analysis(document_id, analysis):
+    async with async_db.acquire() as conn, conn.transaction():
+        await conn.execute(async_db.sql(SAVE_ANALYSIS_SQL), analysis, document_id)
+        await conn.execute(async_db.sql(search.REFRESH_VECTOR_SQL), document_id)
+
+async def stream_document_analysis(document_id, path, content_hash=None):
+    """analysis.stream_document_analysis: yield tokens, then cache and save the full text."""
+    key = await document_cache_key(path, content_hash)
+    analysis = await cache_get(key)
+    if analysis is not None:
+        await save_analysis(document_id, analysis)
+        yield analysis
+        return
+    with metrics.in_flight('analyses'):
+        try:
+            text = await get_text(document_id, path, Config.ANALYSIS_MAX_CHARS)
+        except ExtractionError as e:
+            raise AnalysisError("Failed to extract text") from e
+        start = time.monotonic()
+        parts = []
+        async for token in async_llm.generate_stream(await prepare_prompt(text)):
+            parts.append(token)
+            yield token
+    analysis = ''.join(parts)
+    await cache_put(key, analysis, time.monotonic() - start)
+    await save_analysis(document_id, analysis)
@@ -0,0 +1,67 @@
+# async_db.py
+# asyncpg pool for the ASGI app (asgi.py). It is opened when the app starts
+# serving and shared by every request in the process; DB_POOL_MAX_SIZE and
+# DB_POOL_TIMEOUT bound it like the psycopg2 pool in db.py. Queries are the
+# sync modules' own SQL strings, translated by sql().
+import functools
+import itertools
+import re
+import time
+from contextlib import asynccontextmanager
+import asyncpg
+from psycopg2.extensions import parse_dsn
+from config import Config
+import metrics
+
+_pool = None
+
+_PLACEHOLDER = re.compile(r'%s|%%')
+
+@functools.lru_cache(maxsize=256)
+def sql(query):
+    """A psycopg2 query (%s placeholders, %% for a literal %) with asyncpg's $1, $2, ... placeholders."""
+    numbers = itertools.count(1)
+    return _PLACEHOLDER.sub(lambda m: '%' if m.group() == '%%' else f'${next(numbers)}', query)
+
+def connect_args(conn_str):
+    """asyncpg keyword arguments for a libpq connection string."""
+    args = parse_dsn(conn_str)
+    result = {key: args[key] for key in ('host', 'user', 'password') if key in args}
+    if 'dbname' in args:
+        result['database'] = args['dbname']
+    if 'port' in args:
+        result['port'] = int(args['port'])
+    return result
+
+def _log_query(query):
+    metrics.record_stage('db_query', query.elapsed)
+
+async def _init_connection(conn):
+    conn.add_query_logger(_log_query)
+
+async def open_pool(conn_str):
+    global _pool
+    _pool = await asyncpg.create_pool(
+        min_size=Config.DB_POOL_MIN_SIZE, max_size=Config.DB_POOL_MAX_SIZE, init=_init_connection,
+        **connect_args(conn_str))
+    return _pool
+
+async def close_pool():
+    global _pool
+    if _pool is not None:
+        await _pool.close()
+        _pool = None
+
+def pool_stats():
+    if _pool is None:
+        return {"max_size": 0, "in_use": 0, "idle": 0}
+    size, idle = _pool.get_size(), _pool.get_idle_size()
+    return {"max_size": _pool.get_max_size(), "in_use": size - idle, "idle": idle}
+
+@asynccontextmanager
+async def acquire():
+    """`async with acquire() as conn:`; raises asyncio.TimeoutError after DB_POOL_TIMEOUT seconds."""
+    start = time.perf_counter()
+    async with _pool.acquire(timeout=Config.DB_POOL_TIMEOUT) as conn:
+        metrics.record_stage('db_connect', time.perf_counter() - start)
+        yield conn
@@ -0,0 +1,99 @@
+# async_llm.py
+# Ollama calls for the ASGI app. One httpx.AsyncClient per process keeps a
+# pool of keep-alive connections (at most OLLAMA_MAX_CONNECTIONS), so
+# concurrent analyses reuse connections instead of opening one per call.
+# Backend choice, caps, retries and circuit breaking are llm's, and share
+# its per-process state.
+import asyncio
+import logging
+import httpx
+from config import Config
+import llm
+import metrics
+from llm import LLMError
+
+log = logging.getLogger(__name__)
+
+RETRYABLE = (httpx.TransportError, llm.BackendError)
+
+_client = None
+
+def client():
+    global _client
+    if _client is None:
+        _client = httpx.AsyncClient(
+            timeout=httpx.Timeout(Config.OLLAMA_READ_TIMEOUT, connect=Config.OLLAMA_CONNECT_TIMEOUT),
+            limits=httpx.Limits(max_connections=Config.OLLAMA_MAX_CONNECTIONS,
+                                max_keepalive_connections=Config.OLLAMA_MAX_CONNECTIONS),
+        )
+    return _client
+
+async def close():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+async def generate(prompt):
+    owner = llm.balancer()
+    tried = []
+    for attempt in range(Config.OLLAMA_MAX_RETRIES + 1):
+        if attempt:
+            await asyncio.sleep(llm.backoff(attempt))
+        with metrics.stage('llm_queue'):
+            backend, trial = await owner.acquire_async(tried)
+        ok = None
+        try:
+            with metrics.stage('llm'):
+                resp = await client().post(backend.url, json=llm.payload(prompt, False))
+            if resp.status_code >= 400:
+                raise llm.status_error(resp.status_code, resp.text)
+            response = resp.json().get('response', '')
+            ok = True
+            return response
+        except RETRYABLE as e:
+            ok = False
+            error = e
+            log.warning("LLM call to %s failed (attempt %d): %s", backend.url, attempt + 1, e)
+        finally:
+            owner.release(backend, trial, ok)
+        tried.append(backend)
+    raise LLMError(f"LLM call failed after {Config.OLLAMA_MAX_RETRIES + 1} attempts") from error
+
+async def generate_stream(prompt):
+    """Yield response tokens as Ollama generates them."""
+    owner = llm.balancer()
+    tried = []
+    for attempt in range(Config.OLLAMA_MAX_RETRIES + 1):
+        if attempt:
+            await asyncio.sleep(llm.backoff(attempt))
+        with metrics.stage('llm_queue'):
+            backend, trial = await owner.acquire_async(tried)
+        ok = None
+        started = False
+        try:
+            with metrics.stage('llm'):
+                async with client().stream('POST', backend.url, json=llm.payload(prompt, True)) as resp:
+                    if resp.status_code >= 400:
+                        raise llm.status_error(resp.status_code, (await resp.aread()).decode(errors='replace'))
+                    async for line in resp.aiter_lines():
+                        if not line:
+                            continue
+                        token, done = llm.parse_chunk(line)
+                        if token:
+                            started = True
+                            yield token
+                        if done:
+                            break
+            ok = True
+            return
+        except RETRYABLE as e:
+            ok = False
+            if started:
+                raise LLMError(f"LLM stream from {backend.url} broke off") from e
+            error = e
+            log.warning("LLM stream from %s failed (attempt %d): %s", backend.url, attempt + 1, e)
+        finally:
+            owner.release(backend, trial, ok)
+        tried.append(backend)
+    raise LLMError(f"LLM stream failed after {Config.OLLAMA_MAX_RETRIES + 1} attempts") from error
@@ -0,0 +1,124 @@
+# batch.py
+# Bulk document operations. Each call runs its database work as a few
+# set-based statements and returns one result per item, in request order.
+# Analyses are not run inline: cache hits are saved at once and the rest go
+# to the job queue, where JOB_WORKERS bounds how many run concurrently.
+import psycopg2.extras
+from config import Config
+from db import get_db
+from analysis import analysis_cache_key, save_analyses
+import cache
+import jobs
+import storage
+
+class BatchError(Exception):
+    pass
+
+def _check_size(items):
+    if not items:
+        raise BatchError("No items given")
+    if len(items) > Config.BATCH_MAX_ITEMS:
+        raise BatchError(f"At most {Config.BATCH_MAX_ITEMS} items per batch")
+
+def _unique_ids(ids):
+    try:
+        ids = list(dict.fromkeys(int(i) for i in ids or ()))
+    except (TypeError, ValueError):
+        raise BatchError("Document ids must be integers")
+    _check_size(ids)
+    return ids
+
+def _owned(conn_str, ids, user_id):
+    with get_db(conn_str) as conn:
+        cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+        cur.execute("SELECT id, filename, content_hash FROM documents WHERE id = ANY(%s) AND user_id = %s",
+                    (ids, user_id))
+        return {row['id']: row for row in cur.fetchall()}
+
+def upload(conn_str, user_id, files):
+    """Store (filename, stream) pairs; every row is inserted in one transaction."""
+    _check_size(files)
+    results, received = [], []
+    try:
+        for filename, stream in files:
+            result = {"filename": filename}
+            results.append(result)
+            if not filename:
+                result.update(status="error", error="No selected file")
+                continue
+            try:
+                temp_path, content_hash, size = storage.receive(stream)
+            except storage.UploadTooLarge:
+                result.update(status="error", error="File too large")
+                continue
+            result.update(status="uploaded", sha256=content_hash)
+            received.append((result, (filename, temp_path, content_hash, size)))
+    except BaseException:
+        for _, item in received:
+            storage.remove_file(item[1])
+        raise
+    if received:
+        created = storage.create_documents(conn_str, user_id, [item for _, item in received])
+        for (result, _), (doc_id, _) in zip(received, created):
+            result['id'] = doc_id
+        jobs.after_upload_many(conn_str, created, user_id)
+    return results
+
+def analyze(conn_str, user_id, ids):
+    ids = _unique_ids(ids)
+    docs = _owned(conn_str, ids, user_id)
+    keys = {}
+    for doc_id, doc in docs.items():
+        try:
+            keys[doc_id] = analysis_cache_key(
+                storage.document_path(doc['filename'], doc['content_hash']), doc['content_hash'])
+        except OSError:
+            pass  # the queued job reports the missing file
+    hits = cache.get_many(conn_str, keys.values())
+    cached = {doc_id: hits[key] for doc_id, key in keys.items() if key in hits}
+    if cached:
+        save_analyses(conn_str, cached)
+    queued = jobs.enqueue_many(conn_str, 'analyze', [i for i in ids if i in docs and i not in cached], user_id)
+    results = []
+    for doc_id in ids:
+        if doc_id not in docs:
+            results.append({"id": doc_id, "status": "not_found"})
+        elif doc_id in cached:
+            results.append({"id": doc_id, "status": "cached"})
+        else:
+            results.append({"id": doc_id, "status": "queued", "job_id": queued[doc_id]})
+    return results
+
+# Parameters are (ids, signatures, user_id) as parallel arrays; returns the signed ids.
+SIGN_SQL = """
+    WITH signed AS (
+        UPDATE documents d SET signed_at = now()
+        FROM unnest(%s::int[], %s::text[]) AS v(id, signature)
+        WHERE d.id = v.id AND d.user_id = %s
+        RETURNING d.id, v.signature
+    )
+    INSERT INTO document_signatures (document_id, signature)
+    SELECT id, signature FROM signed
+    ON CONFLICT (document_id) DO UPDATE SET signature = EXCLUDED.signature
+    RETURNING document_id
+"""
+
+def sign(conn_str, user_id, items):
+    """Sign (id, signature) pairs; the last signature given for an id wins."""
+    items = list(items or ())
+    ids = _unique_ids([doc_id for doc_id, _ in items])
+    signatures = {}
+    for doc_id, signature in items:
+        if not signature:
+            raise BatchError("Signature required")
+        signatures[int(doc_id)] = signature
+    with get_db(conn_str) as conn:
+        cur = conn.cursor()
+        cur.execute(SIGN_SQL, (ids, [signatures[i] for i in ids], user_id))
+        signed = {row[0] for row in cur.fetchall()}
+    return [{"id": i, "status": "signed" if i in signed else "not_found"} for i in ids]
+
+def delete(conn_str, user_id, ids):
+    ids = _unique_ids(ids)
+    deleted = storage.delete_documents(conn_str, ids, user_id)
+    return [{"id": i, "status": "deleted" if i in deleted else "not_found"} for i in ids]
@@ -0,0 +1,182 @@
+# bench/bench_async.py
+# Concurrent streaming analyses against a slow LLM stub: the sync documents
+# API on a fixed pool of request threads (what a threaded WSGI server gives
+# one process) versus the ASGI app under hypercorn. Every request analyzes a
+# different document and each server run uses its own model name, so none
+# of them is answered from the analysis cache. Servers and the stub run as
+# subprocesses; needs the database from Config.DB_CONN_STR.
+# Usage: python -m bench.bench_async --concurrency 50 200 --requests 400 --threads 16
+import argparse
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+import httpx
+from werkzeug.serving import BaseWSGIServer
+from config import Config
+from db import get_db, init_db
+import textstore
+from utils.auth import issue_token
+
+USERNAME = 'bench_async'
+PAGE = 'The parties agree to the terms set out in this agreement. ' * 20
+
+class PooledWSGIServer(BaseWSGIServer):
+    """Werkzeug server handling requests on a fixed number of threads."""
+
+    def __init__(self, host, port, app, threads):
+        super().__init__(host, port, app)
+        self.pool = ThreadPoolExecutor(threads)
+
+    def process_request(self, request, client_address):
+        self.pool.submit(self._handle, request, client_address)
+
+    def _handle(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+def serve_sync(port, threads):
+    from app import create_app
+    from blueprints import documents_bp
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    app = create_app()
+    app.register_blueprint(documents_bp)
+    PooledWSGIServer('127.0.0.1', port, app, threads).serve_forever()
+
+def seed(conn_str, count):
+    init_db(conn_str)
+    with get_db(conn_str) as conn:
+        cur = conn.cursor()
+        cur.execute("INSERT INTO users (username, password) VALUES (%s, '') "
+                    "ON CONFLICT (username) DO UPDATE SET username = EXCLUDED.username RETURNING id", (USERNAME,))
+        user_id = cur.fetchone()[0]
+        cur.execute("SELECT id FROM documents WHERE user_id = %s ORDER BY id", (user_id,))
+        ids = [row[0] for row in cur.fetchall()]
+    while len(ids) < count:
+        # Text is stored up front, so the analysis never needs the file itself.
+        content_hash = hashlib.sha256(uuid.uuid4().bytes).hexdigest()
+        with get_db(conn_str) as conn:
+            cur = conn.cursor()
+            cur.execute("INSERT INTO documents (user_id, filename, content_hash, size) "
+                        "VALUES (%s, 'bench.pdf', %s, 0) RETURNING id", (user_id, content_hash))
+            doc_id = cur.fetchone()[0]
+        textstore.store_pages(conn_str, doc_id, [PAGE])
+        ids.append(doc_id)
+    return user_id, ids[:count]
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def wait_for_port(port, process, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"server exited with {process.returncode}")
+        try:
+            socket.create_connection(('127.0.0.1', port), 0.2).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"nothing listening on port {port}")
+
+def start(args, port, env=None):
+    process = subprocess.Popen([sys.executable, '-m', *args], env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    wait_for_port(port, process)
+    return process
+
+async def load(base, token, ids, concurrency):
+    slots = asyncio.Semaphore(concurrency)
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async def one(client, doc_id):
+        async with slots:
+            began = time.perf_counter()
+            try:
+                async with client.stream('POST', f"{base}/documents/{doc_id}/analyze/stream",
+                                         headers={'Authorization': token}) as resp:
+                    body = (await resp.aread()).decode()
+                ok = resp.status_code == 200 and 'event: done' in body
+            except httpx.HTTPError:
+                ok = False
+            return time.perf_counter() - began, ok
+
+    async with httpx.AsyncClient(limits=limits, timeout=httpx.Timeout(600, connect=30)) as client:
+        start_time = time.perf_counter()
+        samples = await asyncio.gather(*(one(client, doc_id) for doc_id in ids))
+        return samples, time.perf_counter() - start_time
+
+def run_mode(mode, ids, token, concurrency, threads, ollama_url):
+    port = free_port()
+    env = dict(os.environ, OLLAMA_ENDPOINT=ollama_url, OLLAMA_MODEL=f"bench-{uuid.uuid4().hex[:8]}",
+               OLLAMA_MAX_CONNECTIONS=str(concurrency), OLLAMA_BACKEND_CONCURRENCY=str(concurrency),
+               JOB_WORKERS_EMBEDDED='0')
+    if mode == 'sync':
+        server = start(['bench.bench_async', '--serve-sync', str(port), '--threads', str(threads)], port, env)
+    else:
+        server = start(['hypercorn', 'asgi:app', '--bind', f'127.0.0.1:{port}'], port, env)
+    try:
+        samples, elapsed = asyncio.run(load(f"http://127.0.0.1:{port}", token, ids, concurrency))
+    finally:
+        server.terminate()
+        server.wait()
+    latencies = sorted(s[0] for s in samples if s[1])
+    result = {"mode": mode, "concurrency": concurrency, "requests": len(ids),
+              "ok": len(latencies), "errors": len(samples) - len(latencies),
+              "requests_per_s": round(len(latencies) / elapsed, 1)}
+    if latencies:
+        result["p50_ms"] = round(statistics.median(latencies) * 1000, 1)
+        result["p95_ms"] = round(latencies[int(0.95 * (len(latencies) - 1))] * 1000, 1)
+    return result
+
+def run(concurrency_levels, requests_count, threads, latency, token_delay):
+    user_id, ids = seed(Config.DB_CONN_STR, requests_count)
+    token = issue_token(user_id)
+    port = free_port()
+    stub = start(['bench.fake_ollama', '--port', str(port), '--latency', str(latency),
+                  '--token-delay', str(token_delay)], port)
+    results = []
+    try:
+        for concurrency in concurrency_levels:
+            for mode in ('sync', 'async'):
+                results.append(run_mode(mode, ids, token, concurrency, threads,
+                                        f"http://127.0.0.1:{port}/api/generate"))
+    finally:
+        stub.terminate()
+        stub.wait()
+    return results
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark sync vs async streaming analyses')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[50, 200])
+    parser.add_argument('--requests', type=int, default=400)
+    parser.add_argument('--threads', type=int, default=16, help='request threads of the sync server')
+    parser.add_argument('--latency', type=float, default=1.0, help='stub seconds before the first token')
+    parser.add_argument('--token-delay', type=float, default=0.05)
+    parser.add_argument('--serve-sync', type=int, metavar='PORT', help=argparse.SUPPRESS)
+    parser.add_argument('--json')
+    args = parser.parse_args()
+    if args.serve_sync:
+        serve_sync(args.serve_sync, args.threads)
+        sys.exit()
+    results = run(args.concurrency, args.requests, args.threads, args.latency, args.token_delay)
+    for r in results:
+        print(f"{r['mode']:<6} c={r['concurrency']:<4} {r['requests_per_s']:>7.1f} req/s "
+              f"ok {r['ok']}/{r['requests']}  p50 {r.get('p50_ms', 0):>8.1f} ms  p95 {r.get('p95_ms', 0):>8.1f} ms")
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
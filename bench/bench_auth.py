@@ -0,0 +1,55 @@
+# bench/bench_auth.py
+# Per-request overhead of auth_required with and without the token/user
+# caches. Needs the database from Config.DB_CONN_STR (the user row lookup).
+# Usage: python -m bench.bench_auth --requests 2000
+import argparse
+import json
+import time
+from flask import Flask, jsonify, request
+from config import Config
+from db import get_db, init_db
+from utils import auth
+
+def make_app():
+    app = Flask(__name__)
+
+    @app.route('/ping')
+    @auth.auth_required
+    def ping():
+        return jsonify({"user_id": request.user_id})
+
+    return app
+
+def run(requests_count):
+    init_db(Config.DB_CONN_STR)
+    with get_db(Config.DB_CONN_STR) as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT id FROM users ORDER BY id LIMIT 1")
+        user_id = cur.fetchone()[0]
+    token = auth.issue_token(user_id)
+    client = make_app().test_client()
+    headers = {'Authorization': token}
+    results = []
+    for enabled in (False, True):
+        Config.AUTH_CACHE_ENABLED = enabled
+        for _ in range(50):  # warm up the pool and caches
+            client.get('/ping', headers=headers)
+        start = time.perf_counter()
+        for _ in range(requests_count):
+            assert client.get('/ping', headers=headers).status_code == 200
+        elapsed = time.perf_counter() - start
+        results.append({"cache": enabled, "requests": requests_count,
+                        "us_per_request": round(elapsed / requests_count * 1e6, 1)})
+    return results
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark auth_required overhead')
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--json')
+    args = parser.parse_args()
+    results = run(args.requests)
+    for r in results:
+        print(f"cache {'on ' if r['cache'] else 'off'}  {r['us_per_request']:>8.1f} us/request")
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
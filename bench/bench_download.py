@@ -0,0 +1,113 @@
+# bench/bench_download.py
+# Concurrent download throughput through the real WSGI stack: whole-file
+# downloads, 1 MiB Range reads (what a PDF viewer issues), If-None-Match
+# revalidation, and the X-Accel-Redirect handoff (headers only; the proxy
+# would send the body). Needs the database from Config.DB_CONN_STR.
+# Usage: python -m bench.bench_download --size-mb 100 --clients 8 --requests 32
+import argparse
+import io
+import json
+import logging
+import os
+import random
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import bcrypt
+import requests
+from werkzeug.serving import make_server
+from config import Config
+from db import get_db
+import storage
+
+USERNAME = 'bench_download'
+PASSWORD = 'bench'
+RANGE_BYTES = 1024 * 1024
+
+def seed(conn_str, size_mb):
+    hashed = bcrypt.hashpw(PASSWORD.encode(), bcrypt.gensalt(4)).decode()
+    with get_db(conn_str) as conn:
+        cur = conn.cursor()
+        cur.execute("INSERT INTO users (username, password) VALUES (%s, %s) "
+                    "ON CONFLICT (username) DO UPDATE SET password = EXCLUDED.password RETURNING id", (USERNAME, hashed))
+        user_id = cur.fetchone()[0]
+    data = io.BytesIO(b'%PDF-1.4\n' + os.urandom(size_mb * 1024 * 1024))
+    temp_path, content_hash, size = storage.receive(data)
+    doc_id, _ = storage.create_document(conn_str, user_id, 'bench.pdf', temp_path, content_hash, size)
+    return user_id, doc_id, content_hash, size
+
+def start_server(app):
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}"
+
+def run_mode(session, url, size, etag, mode, clients, requests_count):
+    def one(_):
+        headers = {}
+        if mode == 'range':
+            start = random.randrange(0, max(size - RANGE_BYTES, 1))
+            headers['Range'] = f"bytes={start}-{start + RANGE_BYTES - 1}"
+        elif mode == 'revalidate':
+            headers['If-None-Match'] = f'"{etag}"'
+        began = time.perf_counter()
+        received = 0
+        with session.get(url, headers=headers, stream=True) as resp:
+            assert resp.status_code == {'range': 206, 'revalidate': 304}.get(mode, 200), resp.status_code
+            for block in resp.iter_content(256 * 1024):
+                received += len(block)
+        return time.perf_counter() - began, received
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(clients) as pool:
+        samples = list(pool.map(one, range(requests_count)))
+    elapsed = time.perf_counter() - start
+    latencies = sorted(s[0] for s in samples)
+    received = sum(s[1] for s in samples)
+    return {
+        "mode": mode, "clients": clients, "requests": requests_count,
+        "mb_received": round(received / 1e6, 1),
+        "mb_per_s": round(received / 1e6 / elapsed, 1),
+        "requests_per_s": round(requests_count / elapsed, 1),
+        "p50_ms": round(statistics.median(latencies) * 1000, 1),
+        "p95_ms": round(latencies[int(0.95 * (len(latencies) - 1))] * 1000, 1),
+    }
+
+def run(size_mb, clients, requests_count, keep=False):
+    os.environ['JOB_WORKERS_EMBEDDED'] = '0'
+    Config.JOB_WORKERS_EMBEDDED = False
+    from app import create_app
+    app = create_app()
+    user_id, doc_id, content_hash, size = seed(Config.DB_CONN_STR, size_mb)
+    server, base = start_server(app)
+    session = requests.Session()
+    session.mount('http://', requests.adapters.HTTPAdapter(pool_maxsize=clients))
+    session.post(f"{base}/login", data={'username': USERNAME, 'password': PASSWORD})
+    results = []
+    try:
+        for mode, path in (('full', 'download'), ('range', 'pdf'), ('revalidate', 'pdf'), ('x-accel', 'pdf')):
+            Config.FILE_SERVE_ACCEL = 'x-accel' if mode == 'x-accel' else ''
+            results.append(run_mode(session, f"{base}/{path}/{doc_id}", size, content_hash, mode, clients, requests_count))
+    finally:
+        Config.FILE_SERVE_ACCEL = ''
+        server.shutdown()
+        if not keep:
+            storage.delete_document(Config.DB_CONN_STR, doc_id, user_id)
+    return results
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark concurrent document downloads')
+    parser.add_argument('--size-mb', type=int, default=100)
+    parser.add_argument('--clients', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=32)
+    parser.add_argument('--keep', action='store_true', help='keep the benchmark document')
+    parser.add_argument('--json')
+    args = parser.parse_args()
+    results = run(args.size_mb, args.clients, args.requests, args.keep)
+    for r in results:
+        print(f"{r['mode']:<11} {r['mb_per_s']:>8.1f} MB/s {r['requests_per_s']:>8.1f} req/s "
+              f"p50 {r['p50_ms']:>8.1f} ms  p95 {r['p95_ms']:>8.1f} ms")
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
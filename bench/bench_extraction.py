@@ -0,0 +1,52 @@
+# bench/bench_extraction.py
+# Pages/second for each extraction backend and mode on a generated corpus.
+# Usage: python -m bench.bench_extraction --sizes 10 100 500 [--json out.json]
+import argparse
+import json
+import tempfile
+import time
+import extraction
+from analysis import extract_text
+from bench.corpus import make_corpus
+from config import Config
+
+MODES = [
+    ('pdfplumber', False),
+    ('pdfplumber', True),
+    ('pdfium', False),
+    ('pdfium', True),
+]
+
+def timed(fn):
+    start = time.perf_counter()
+    fn()
+    return time.perf_counter() - start
+
+def run(sizes, repeat):
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for path, pages in zip(make_corpus(tmp, sizes), sizes):
+            for backend, parallel in MODES:
+                extraction.extract_pages(path, backend, parallel)  # warm the process pool
+                best = min(timed(lambda: extraction.extract_pages(path, backend, parallel)) for _ in range(repeat))
+                results.append({"pages": pages, "backend": backend, "parallel": parallel,
+                                "seconds": round(best, 4), "pages_per_sec": round(pages / best, 1)})
+            best = min(timed(lambda: extract_text(path)) for _ in range(repeat))
+            results.append({"pages": pages, "backend": Config.PDF_BACKEND, "parallel": False,
+                            "mode": f"prefix {Config.ANALYSIS_MAX_CHARS} chars", "seconds": round(best, 4)})
+    return results
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark PDF text extraction')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 100, 500])
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--json')
+    args = parser.parse_args()
+    results = run(args.sizes, args.repeat)
+    for r in results:
+        mode = r.get('mode') or ('parallel' if r['parallel'] else 'serial')
+        rate = f"{r['pages_per_sec']:>10} pages/s" if 'pages_per_sec' in r else ''
+        print(f"{r['pages']:>6} pages  {r['backend']:<10} {mode:<20} {r['seconds']:>9.4f}s {rate}")
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
@@ -0,0 +1,103 @@
+# bench/bench_listing.py
+# Seeds one user with many documents and times keyset pages at increasing
+# depth, against the equivalent OFFSET query for reference.
+# Usage: python -m bench.bench_listing --rows 1000000 [--keep] [--json out.json]
+import argparse
+import json
+import statistics
+import time
+from config import Config
+from db import get_db, init_db
+import pagination
+
+USERNAME = 'bench_listing'
+
+def seed(conn_str, rows):
+    with get_db(conn_str) as conn:
+        cur = conn.cursor()
+        cur.execute("INSERT INTO users (username, password) VALUES (%s, '!') "
+                    "ON CONFLICT (username) DO UPDATE SET username = EXCLUDED.username RETURNING id", (USERNAME,))
+        user_id = cur.fetchone()[0]
+        cur.execute("SELECT count(*) FROM documents WHERE user_id = %s", (user_id,))
+        existing = cur.fetchone()[0]
+        if existing < rows:
+            cur.execute("""
+                WITH new_docs AS (
+                    INSERT INTO documents (user_id, filename, uploaded_at, signed_at)
+                    SELECT %s, 'doc_' || g || '.pdf', timestamptz '2020-01-01' + g * interval '17 seconds',
+                           CASE WHEN g %% 3 = 0 THEN timestamptz '2021-01-01' + g * interval '11 seconds' END
+                    FROM generate_series(%s, %s) AS g
+                    RETURNING id, signed_at
+                ), analyses AS (
+                    INSERT INTO document_analyses (document_id, analysis)
+                    SELECT id, repeat('analysis text ', 200) FROM new_docs
+                )
+                INSERT INTO document_signatures (document_id, signature)
+                SELECT id, 'signer ' || id FROM new_docs WHERE signed_at IS NOT NULL
+            """, (user_id, existing + 1, rows))
+        conn.commit()
+        cur.execute("ANALYZE documents")
+    return user_id
+
+def timed(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return round(statistics.median(samples), 3)
+
+def offset_page(conn_str, user_id, offset):
+    with get_db(conn_str) as conn:
+        cur = conn.cursor()
+        cur.execute(f"""
+            SELECT {pagination.LIST_COLUMNS} FROM documents d {pagination.LIST_JOINS}
+            WHERE d.user_id = %s ORDER BY d.uploaded_at DESC, d.id DESC LIMIT %s OFFSET %s
+        """, (user_id, Config.PAGE_SIZE, offset))
+        cur.fetchall()
+
+def run(conn_str, rows, depths, repeat):
+    user_id = seed(conn_str, rows)
+    results = []
+    for sort in pagination.SORTS:
+        cursor = None
+        page = 0
+        for depth in depths:
+            while page < depth:
+                _, cursor = pagination.list_documents(conn_str, user_id, sort, cursor)
+                page += 1
+                if cursor is None:
+                    break
+            if page < depth:
+                break
+            ms = timed(lambda: pagination.list_documents(conn_str, user_id, sort, cursor), repeat)
+            result = {"sort": sort, "page": depth, "keyset_ms": ms}
+            if sort == 'uploaded':
+                result["offset_ms"] = timed(lambda: offset_page(conn_str, user_id, depth * Config.PAGE_SIZE), repeat)
+            results.append(result)
+    return user_id, results
+
+def cleanup(conn_str, user_id):
+    with get_db(conn_str) as conn:
+        cur = conn.cursor()
+        cur.execute("DELETE FROM documents WHERE user_id = %s", (user_id,))
+        cur.execute("DELETE FROM users WHERE id = %s", (user_id,))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark keyset document listing')
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--depths', type=int, nargs='+', default=[0, 10, 100, 1000])
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--keep', action='store_true', help='keep the seeded rows for the next run')
+    parser.add_argument('--json')
+    args = parser.parse_args()
+    init_db(Config.DB_CONN_STR)
+    user_id, results = run(Config.DB_CONN_STR, args.rows, args.depths, args.repeat)
+    for r in results:
+        offset = f"  offset {r['offset_ms']:>9.3f} ms" if 'offset_ms' in r else ''
+        print(f"{r['sort']:<9} page {r['page']:>6}  keyset {r['keyset_ms']:>8.3f} ms{offset}")
+    if not args.keep:
+        cleanup(Config.DB_CONN_STR, user_id)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
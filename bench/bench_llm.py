@@ -0,0 +1,76 @@
+# bench/bench_llm.py
+# The LLM client against local fake Ollama backends: throughput of
+# concurrent generate calls on one backend versus several, then the same
+# load with one backend refusing connections and with one failing every
+# third request. Reports calls that still failed and how the calls were
+# spread over the backends. Needs no database.
+# Usage: python -m bench.bench_llm --backends 3 --calls 120 --concurrency 24 --latency 0.2
+import argparse
+import json
+import logging
+import socket
+import time
+from concurrent.futures import ThreadPoolExecutor
+from bench.fake_ollama import start_fake_ollama
+from config import Config
+import llm
+
+def dead_url():
+    # A port that was free a moment ago: connections are refused.
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return f"http://127.0.0.1:{s.getsockname()[1]}/api/generate"
+
+def call(prompt):
+    try:
+        llm.generate(prompt)
+        return True
+    except llm.LLMError:
+        return False
+
+def run_scenario(name, urls, calls, concurrency):
+    Config.OLLAMA_ENDPOINTS = urls
+    llm.reset()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        results = list(pool.map(call, (f"prompt {i}" for i in range(calls))))
+    elapsed = time.perf_counter() - start
+    return {"scenario": name, "backends": len(urls), "calls": calls, "failed": results.count(False),
+            "seconds": round(elapsed, 3), "calls_per_s": round(calls / elapsed, 1),
+            "spread": {b['url']: {"requests": b['requests'], "errors": b['errors'], "circuit": b['circuit']}
+                       for b in llm.backend_stats()}}
+
+def run(backends, calls, concurrency, latency):
+    servers = [start_fake_ollama(latency=latency) for _ in range(backends)]
+    flaky, flaky_url = start_fake_ollama(latency=latency, fail_rate=3)
+    urls = [url for _, url in servers]
+    Config.OLLAMA_HEALTH_INTERVAL = 0  # failures below are left to retries and the circuit breaker
+    Config.OLLAMA_RETRY_BACKOFF = 0.05
+    try:
+        return [
+            run_scenario('single', urls[:1], calls, concurrency),
+            run_scenario('balanced', urls, calls, concurrency),
+            run_scenario('one_down', urls[:-1] + [dead_url()], calls, concurrency),
+            run_scenario('one_flaky', urls[:-1] + [flaky_url], calls, concurrency),
+        ]
+    finally:
+        for server, _ in servers + [(flaky, flaky_url)]:
+            server.shutdown()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark LLM backend balancing, retries and circuit breaking')
+    parser.add_argument('--backends', type=int, default=3)
+    parser.add_argument('--calls', type=int, default=120)
+    parser.add_argument('--concurrency', type=int, default=24)
+    parser.add_argument('--latency', type=float, default=0.2, help='fake LLM seconds per call')
+    parser.add_argument('--json')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.ERROR)
+    results = run(args.backends, args.calls, args.concurrency, args.latency)
+    for r in results:
+        spread = '  '.join(f"{s['requests']}/{s['errors']}err/{s['circuit']}" for s in r['spread'].values())
+        print(f"{r['scenario']:<10} {r['backends']} backends  {r['calls_per_s']:>7.1f} calls/s  "
+              f"failed {r['failed']}/{r['calls']}  [{spread}]")
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
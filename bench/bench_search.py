@@ -0,0 +1,90 @@
+# bench/bench_search.py
+# Seeds a corpus of documents with extracted-text and analysis vectors and
+# times ranked search queries through search.search_documents.
+# Usage: python -m bench.bench_search --rows 200000 [--keep] [--json out.json]
+import argparse
+import json
+import statistics
+import time
+from bench.corpus import WORDS
+from config import Config
+from db import get_db, init_db
+import search
+
+USERNAME = 'bench_search'
+QUERIES = ['zephyr', 'warranty', 'termination notice', '"governing law"', 'invoice -tax', 'doc_4242']
+
+def seed(conn_str, rows):
+    with get_db(conn_str) as conn:
+        cur = conn.cursor()
+        cur.execute("INSERT INTO users (username, password) VALUES (%s, '!') "
+                    "ON CONFLICT (username) DO UPDATE SET username = EXCLUDED.username RETURNING id", (USERNAME,))
+        user_id = cur.fetchone()[0]
+        cur.execute("SELECT count(*) FROM documents WHERE user_id = %s", (user_id,))
+        existing = cur.fetchone()[0]
+        if existing < rows:
+            # Random word soup per row; every 1000th document mentions a rare term.
+            words = f"ARRAY{WORDS!r}::text[]"
+            soup = f"""array_to_string(ARRAY(
+                SELECT ({words})[1 + floor(random() * {len(WORDS)})::int]
+                FROM generate_series(1, %s) WHERE id > 0), ' ')"""
+            cur.execute(f"""
+                WITH new_docs AS (
+                    INSERT INTO documents (user_id, filename, uploaded_at)
+                    SELECT %s, 'doc_' || g || '.pdf', timestamptz '2020-01-01' + g * interval '17 seconds'
+                    FROM generate_series(%s, %s) AS g
+                    RETURNING id
+                ), analyses AS (
+                    INSERT INTO document_analyses (document_id, analysis)
+                    SELECT id, {soup} || CASE WHEN id %% 1000 = 0 THEN ' zephyr' ELSE '' END
+                    FROM new_docs
+                )
+                INSERT INTO document_text (document_id, page_count, char_count, byte_size, content_tsv)
+                SELECT id, 10, 0, 0, setweight(to_tsvector('english', {soup}), 'C')
+                FROM new_docs
+            """, (user_id, existing + 1, rows, 40, 400))
+            cur.execute(f"UPDATE documents d SET search_vector = {search.DOCUMENT_VECTOR} "
+                        "WHERE d.user_id = %s AND d.search_vector IS NULL", (user_id,))
+        conn.commit()
+        cur.execute("ANALYZE documents")
+    return user_id
+
+def timed(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return round(statistics.median(samples), 3)
+
+def run(conn_str, rows, repeat):
+    user_id = seed(conn_str, rows)
+    results = []
+    for q in QUERIES:
+        hits, _ = search.search_documents(conn_str, user_id, q)
+        ms = timed(lambda: search.search_documents(conn_str, user_id, q), repeat)
+        results.append({"query": q, "rows": rows, "page_hits": len(hits), "ms": ms})
+    return user_id, results
+
+def cleanup(conn_str, user_id):
+    with get_db(conn_str) as conn:
+        cur = conn.cursor()
+        cur.execute("DELETE FROM documents WHERE user_id = %s", (user_id,))
+        cur.execute("DELETE FROM users WHERE id = %s", (user_id,))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark full-text document search')
+    parser.add_argument('--rows', type=int, default=200000)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--keep', action='store_true', help='keep the seeded rows for the next run')
+    parser.add_argument('--json')
+    args = parser.parse_args()
+    init_db(Config.DB_CONN_STR)
+    user_id, results = run(Config.DB_CONN_STR, args.rows, args.repeat)
+    for r in results:
+        print(f"{r['query']:<22} {r['page_hits']:>4} hits on page  {r['ms']:>9.3f} ms")
+    if not args.keep:
+        cleanup(Config.DB_CONN_STR, user_id)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
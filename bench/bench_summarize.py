@@ -0,0 +1,50 @@
+# bench/bench_summarize.py
+# Wall-clock time of map-reduce summarization, sequential vs parallel chunk
+# calls, against the local fake Ollama server (no caching, no database).
+# Usage: python -m bench.bench_summarize --chunks 16 --latency 0.5 --parallelism 1 4 8
+import argparse
+import json
+import random
+import time
+from bench.corpus import WORDS
+from bench.fake_ollama import start_fake_ollama
+from config import Config
+
+def make_text(chunks, rng):
+    # Each word is estimated at 2-3 tokens, so this yields roughly `chunks` chunks.
+    words_per_chunk = Config.SUMMARY_CHUNK_TOKENS // 3
+    return ' '.join(rng.choice(WORDS) for _ in range(words_per_chunk * chunks))
+
+def run(chunks, latency, parallelisms):
+    server, url = start_fake_ollama(latency=latency)
+    Config.OLLAMA_ENDPOINTS = [url]
+    import summarize
+    text = make_text(chunks, random.Random(0))
+    actual_chunks = len(summarize.split_chunks(text, Config.SUMMARY_CHUNK_TOKENS))
+    results = []
+    try:
+        for parallelism in parallelisms:
+            start = time.perf_counter()
+            summarize.summarize(text, conn_str=None, parallelism=parallelism)
+            elapsed = time.perf_counter() - start
+            results.append({"chunks": actual_chunks, "latency": latency, "parallelism": parallelism,
+                            "seconds": round(elapsed, 3)})
+    finally:
+        server.shutdown()
+    return results
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark map-reduce summarization')
+    parser.add_argument('--chunks', type=int, default=16)
+    parser.add_argument('--latency', type=float, default=0.5, help='fake LLM seconds per call')
+    parser.add_argument('--parallelism', type=int, nargs='+', default=[1, 4, 8])
+    parser.add_argument('--json')
+    args = parser.parse_args()
+    results = run(args.chunks, args.latency, args.parallelism)
+    baseline = results[0]['seconds']
+    for r in results:
+        print(f"{r['chunks']:>4} chunks  parallelism {r['parallelism']:>3}  {r['seconds']:>8.3f}s  "
+              f"x{baseline / r['seconds']:.1f}")
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
@@ -0,0 +1,58 @@
+# bench/corpus.py
+# Synthetic PDF corpora for benchmarks. The PDFs are written directly (one
+# Helvetica text stream per page) so no PDF-writing dependency is needed.
+import os
+import random
+
+WORDS = (
+    "agreement party term payment invoice clause liability warranty notice "
+    "termination confidential schedule annex delivery service obligation "
+    "effective date signature governing law dispute amount tax period"
+).split()
+
+def _escape(text):
+    return text.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+
+def page_lines(page_no, lines, rng):
+    return [
+        f"Page {page_no + 1} line {i + 1}: " + ' '.join(rng.choice(WORDS) for _ in range(10))
+        for i in range(lines)
+    ]
+
+def make_pdf(path, pages, lines_per_page=45, seed=0):
+    rng = random.Random(seed)
+    objects = [b"<< /Type /Catalog /Pages 2 0 R >>", None,
+               b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    kids = []
+    for page_no in range(pages):
+        ops = ' '.join(f"({_escape(line)}) '" for line in page_lines(page_no, lines_per_page, rng))
+        content = f"BT /F1 10 Tf 14 TL 40 780 Td {ops} ET".encode()
+        objects.append(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(content), content))
+        objects.append(
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+            b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % len(objects)
+        )
+        kids.append(len(objects))
+    objects[1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (
+        b' '.join(b"%d 0 R" % kid for kid in kids), pages)
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n%s\nendobj\n" % (number, body)
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    out += b''.join(b"%010d 00000 n \n" % offset for offset in offsets)
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    with open(path, 'wb') as f:
+        f.write(out)
+    return path
+
+def make_corpus(directory, sizes, lines_per_page=45):
+    """Write one PDF per page count in sizes; returns the paths."""
+    os.makedirs(directory, exist_ok=True)
+    return [
+        make_pdf(os.path.join(directory, f"doc_{pages:05d}p.pdf"), pages, lines_per_page, seed=pages)
+        for pages in sizes
+    ]
@@ -0,0 +1,91 @@
+# bench/fake_ollama.py
+# Minimal stand-in for the Ollama /api/generate endpoint (and /api/tags, which
+# llm's health checks probe), for local testing and benchmarks.
+# Usage: python -m bench.fake_ollama --port 11434 --latency 0.5
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+class FakeOllamaHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    latency = 0.0  # seconds before the (first) response byte
+    token_delay = 0.0  # seconds between streamed tokens
+    fail_rate = 0  # fail every Nth request with a 500 when > 0
+    requests_seen = 0
+    lock = threading.Lock()
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path == '/api/tags':
+            self._send_json(200, {"models": [{"name": "fake"}]})
+        else:
+            self._send_json(404, {"error": "not found"})
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = json.loads(self.rfile.read(length) or b'{}')
+        cls = type(self)
+        with cls.lock:
+            cls.requests_seen += 1
+            seen = cls.requests_seen
+        time.sleep(self.latency)
+        if self.fail_rate and seen % self.fail_rate == 0:
+            self._send_json(500, {"error": "injected failure"})
+            return
+        prompt = body.get('prompt', '')
+        words = ['summary', f'of {len(prompt)} chars:'] + prompt.split()[-8:]
+        if body.get('stream', True):
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/x-ndjson')
+            self.send_header('Transfer-Encoding', 'chunked')
+            self.end_headers()
+            for word in words:
+                time.sleep(self.token_delay)
+                self._write_chunk({"model": body.get('model'), "response": word + ' ', "done": False})
+            self._write_chunk({"model": body.get('model'), "response": '', "done": True})
+            self.wfile.write(b'0\r\n\r\n')
+        else:
+            time.sleep(self.token_delay * len(words))
+            self._send_json(200, {"model": body.get('model'), "response": ' '.join(words), "done": True})
+
+    def _send_json(self, status, payload):
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _write_chunk(self, payload):
+        data = json.dumps(payload).encode() + b'\n'
+        self.wfile.write(f'{len(data):x}\r\n'.encode() + data + b'\r\n')
+        self.wfile.flush()
+
+def start_fake_ollama(port=0, latency=0.0, token_delay=0.0, fail_rate=0):
+    """Start the stub in a daemon thread; returns (server, generate_url)."""
+    handler = type('Handler', (FakeOllamaHandler,), {
+        'latency': latency, 'token_delay': token_delay, 'fail_rate': fail_rate,
+        'requests_seen': 0, 'lock': threading.Lock(),
+    })
+    server = ThreadingHTTPServer(('127.0.0.1', port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'http://127.0.0.1:{server.server_address[1]}/api/generate'
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Fake Ollama server')
+    parser.add_argument('--port', type=int, default=11434)
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--token-delay', type=float, default=0.0)
+    parser.add_argument('--fail-rate', type=int, default=0)
+    args = parser.parse_args()
+    server, url = start_fake_ollama(args.port, args.latency, args.token_delay, args.fail_rate)
+    print(f'Fake Ollama listening on {url}')
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,398 @@
+# bench/loadtest.py
+# End-to-end load test of create_app(). It sets up a throwaway Postgres, a
+# synthetic PDF corpus and the fake Ollama stub, then drives the app with
+# concurrent browser-like users. The traffic is a weighted mix of login,
+# list, upload, analyze (queued and streamed), download, Range reads of the
+# viewer and sign.
+#
+# It reports throughput and p50/p95/p99 per endpoint, plus the server's
+# stage totals from /metrics. --json saves the run; --compare checks it
+# against a saved run and exits non-zero on a regression.
+#
+# Postgres: if initdb/pg_ctl can be found (--pg-bin, PATH or pg_config) and
+# we are not root, a cluster is created in a temporary directory. Otherwise a
+# database is created on the server at --admin-dsn (default
+# Config.DB_CONN_STR). Either one is removed afterwards.
+# Usage: python -m bench.loadtest --users 16 --duration 60 --json run.json [--compare base.json]
+import argparse
+import json
+import math
+import os
+import platform
+import random
+import re
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+import psycopg2
+import psycopg2.extensions
+import requests
+from bench.corpus import make_pdf
+from config import Config
+
+DEFAULT_MIX = 'login=2,list=30,upload=8,analyze=8,analyze_stream=4,download=18,view=20,sign=10'
+PASSWORD = 'bench-password'
+VIEW_BYTES = 64 * 1024
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def wait_for_port(port, process, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process is not None and process.poll() is not None:
+            raise RuntimeError(f"process exited with {process.returncode}")
+        try:
+            socket.create_connection(('127.0.0.1', port), 0.2).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"nothing listening on port {port}")
+
+def find_pg_bin(pg_bin=None):
+    if pg_bin:
+        return pg_bin
+    initdb = shutil.which('initdb')
+    if initdb:
+        return os.path.dirname(initdb)
+    try:
+        return subprocess.run(['pg_config', '--bindir'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+@contextmanager
+def temporary_cluster(pg_bin, workdir):
+    data = os.path.join(workdir, 'pgdata')
+    port = free_port()
+    subprocess.run([os.path.join(pg_bin, 'initdb'), '-D', data, '-U', 'postgres', '-A', 'trust', '-N'],
+                   check=True, capture_output=True)
+    options = f"-p {port} -k {workdir} -c listen_addresses=127.0.0.1 -c fsync=off"
+    subprocess.run([os.path.join(pg_bin, 'pg_ctl'), '-D', data, '-o', options, '-l', os.path.join(workdir, 'postgres.log'),
+                    '-w', 'start'], check=True, capture_output=True)
+    try:
+        yield f"dbname=postgres user=postgres host=127.0.0.1 port={port}"
+    finally:
+        subprocess.run([os.path.join(pg_bin, 'pg_ctl'), '-D', data, '-m', 'immediate', 'stop'], capture_output=True)
+
+@contextmanager
+def temporary_database(admin_dsn):
+    name = f"lucudocs_bench_{uuid.uuid4().hex[:8]}"
+    admin = psycopg2.connect(admin_dsn)
+    admin.autocommit = True
+    try:
+        admin.cursor().execute(f'CREATE DATABASE "{name}"')
+        try:
+            yield psycopg2.extensions.make_dsn(admin_dsn, dbname=name)
+        finally:
+            admin.cursor().execute(f'DROP DATABASE IF EXISTS "{name}" WITH (FORCE)')
+    finally:
+        admin.close()
+
+@contextmanager
+def disposable_postgres(pg_bin, admin_dsn, workdir):
+    pg_bin = find_pg_bin(pg_bin)
+    if pg_bin and os.geteuid() != 0:
+        with temporary_cluster(pg_bin, workdir) as dsn:
+            yield dsn, 'cluster'
+    else:
+        with temporary_database(admin_dsn) as dsn:
+            yield dsn, 'database'
+
+def make_corpus(directory, pages, files_per_size):
+    """files_per_size distinct PDFs per page count, so uploads are not all deduplicated."""
+    os.makedirs(directory, exist_ok=True)
+    return [
+        make_pdf(os.path.join(directory, f"doc_{count:04d}p_{i}.pdf"), count, seed=count * 1000 + i)
+        for count in pages for i in range(files_per_size)
+    ]
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(','):
+        name, _, weight = part.partition('=')
+        if name not in ACTIONS:
+            raise SystemExit(f"unknown action {name!r}; choose from {', '.join(ACTIONS)}")
+        mix[name] = float(weight or 1)
+    return mix
+
+class User:
+    def __init__(self, base, username, corpus, rng):
+        self.base = base
+        self.username = username
+        self.corpus = corpus
+        self.rng = rng
+        self.session = requests.Session()
+        self.doc_ids = []
+
+    def request(self, method, path, **kwargs):
+        return self.session.request(method, self.base + path, allow_redirects=False, **kwargs)
+
+    def register(self):
+        resp = self.request('POST', '/register', data={'username': self.username, 'password': PASSWORD})
+        return resp.status_code == 302
+
+    def login(self):
+        resp = self.request('POST', '/login', data={'username': self.username, 'password': PASSWORD})
+        return resp.status_code == 302 and resp.headers.get('Location', '').endswith('/dashboard')
+
+    def list(self):
+        sort = self.rng.choice(['uploaded', 'uploaded', 'signed'])
+        resp = self.request('GET', '/dashboard', params={'sort': sort})
+        if resp.status_code != 200:
+            return False
+        ids = [int(i) for i in dict.fromkeys(re.findall(r'/download/(\d+)', resp.text))]
+        if sort == 'uploaded' and ids:
+            self.doc_ids = ids
+        return True
+
+    def upload(self):
+        path = self.rng.choice(self.corpus)
+        with open(path, 'rb') as f:
+            resp = self.request('POST', '/upload', files={'file': (os.path.basename(path), f, 'application/pdf')})
+        return resp.status_code == 302
+
+    def _doc(self):
+        return self.rng.choice(self.doc_ids) if self.doc_ids else None
+
+    def analyze(self):
+        doc_id = self._doc()
+        if doc_id is None:
+            return None
+        return self.request('POST', f'/analyze/{doc_id}').status_code == 302
+
+    def analyze_stream(self):
+        doc_id = self._doc()
+        if doc_id is None:
+            return None
+        resp = self.request('POST', f'/analyze/{doc_id}/stream')
+        return resp.status_code == 200 and 'event: done' in resp.text
+
+    def download(self):
+        doc_id = self._doc()
+        if doc_id is None:
+            return None
+        with self.request('GET', f'/download/{doc_id}', stream=True) as resp:
+            for _ in resp.iter_content(256 * 1024):
+                pass
+            return resp.status_code == 200
+
+    def view(self):
+        doc_id = self._doc()
+        if doc_id is None:
+            return None
+        resp = self.request('GET', f'/pdf/{doc_id}', headers={'Range': f'bytes=0-{VIEW_BYTES - 1}'})
+        return resp.status_code in (200, 206)
+
+    def sign(self):
+        doc_id = self._doc()
+        if doc_id is None:
+            return None
+        return self.request('POST', f'/sign/{doc_id}', data={'signature': self.username}).status_code == 302
+
+ACTIONS = {name: getattr(User, name) for name in
+           ('login', 'list', 'upload', 'analyze', 'analyze_stream', 'download', 'view', 'sign')}
+
+def drive(users, mix, duration, warmup, think):
+    names, weights = list(mix), list(mix.values())
+    samples = []  # (action, seconds, ok)
+    lock = threading.Lock()
+    start = time.monotonic()
+    measure_from = start + warmup
+    stop_at = measure_from + duration
+
+    def loop(user):
+        while time.monotonic() < stop_at:
+            name = user.rng.choices(names, weights)[0]
+            began = time.monotonic()
+            try:
+                ok = ACTIONS[name](user)
+            except requests.RequestException:
+                ok = False
+            ended = time.monotonic()
+            if ok is not None and began >= measure_from:  # None: nothing to act on yet
+                with lock:
+                    samples.append((name, ended - began, ok))
+            if think:
+                time.sleep(user.rng.expovariate(1 / think))
+
+    threads = [threading.Thread(target=loop, args=(user,)) for user in users]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return samples, time.monotonic() - measure_from
+
+def percentile(sorted_values, q):
+    return sorted_values[min(len(sorted_values) - 1, max(0, math.ceil(q * len(sorted_values)) - 1))]
+
+def summarize(samples, elapsed):
+    endpoints = {}
+    for name in sorted({s[0] for s in samples}):
+        latencies = sorted(s[1] for s in samples if s[0] == name)
+        errors = sum(1 for s in samples if s[0] == name and not s[2])
+        endpoints[name] = {
+            "requests": len(latencies), "errors": errors,
+            "requests_per_s": round(len(latencies) / elapsed, 2),
+            "p50_ms": round(percentile(latencies, 0.50) * 1000, 1),
+            "p95_ms": round(percentile(latencies, 0.95) * 1000, 1),
+            "p99_ms": round(percentile(latencies, 0.99) * 1000, 1),
+        }
+    total = {"requests": len(samples), "errors": sum(1 for s in samples if not s[2]),
+             "requests_per_s": round(len(samples) / elapsed, 2)}
+    return endpoints, total
+
+def stage_totals(base, token):
+    """Seconds per stage from the server's /metrics, summed over the whole run."""
+    try:
+        text = requests.get(base + '/metrics', headers={'Authorization': f'Bearer {token}'}, timeout=10).text
+    except requests.RequestException:
+        return {}
+    return {stage: round(float(value), 3) for stage, value in
+            re.findall(r'^lucudocs_stage_duration_seconds_sum\{stage="([^"]+)"\} (\S+)$', text, re.M)}
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def serve(port, threads):
+    import logging
+    from app import create_app
+    from bench.bench_async import PooledWSGIServer
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    PooledWSGIServer('127.0.0.1', port, create_app(), threads).serve_forever()
+
+def run(args):
+    workdir = tempfile.mkdtemp(prefix='lucudocs-loadtest-')
+    processes = []
+    try:
+        corpus = make_corpus(os.path.join(workdir, 'corpus'), args.pages, args.files_per_size)
+        with disposable_postgres(args.pg_bin, args.admin_dsn, workdir) as (dsn, pg_mode):
+            ollama_port, port = free_port(), free_port()
+            processes.append(subprocess.Popen(
+                [sys.executable, '-m', 'bench.fake_ollama', '--port', str(ollama_port), '--latency', str(args.llm_latency),
+                 '--token-delay', str(args.llm_token_delay)], stdout=subprocess.DEVNULL))
+            wait_for_port(ollama_port, processes[-1])
+            env = dict(os.environ, DB_CONN_STR=dsn, UPLOADS_DIR=os.path.join(workdir, 'uploads'),
+                       OLLAMA_ENDPOINT=f'http://127.0.0.1:{ollama_port}/api/generate',
+                       JOB_WORKERS=str(args.job_workers), STATS_TOKEN=uuid.uuid4().hex)
+            if args.bcrypt_rounds:
+                env['BCRYPT_ROUNDS'] = str(args.bcrypt_rounds)
+            log_path = os.path.join(workdir, 'server.log')
+            with open(log_path, 'w') as log:
+                processes.append(subprocess.Popen(
+                    [sys.executable, '-m', 'bench.loadtest', '--serve', str(port), '--threads', str(args.threads)],
+                    env=env, stdout=log, stderr=subprocess.STDOUT))
+            try:
+                wait_for_port(port, processes[-1])
+            except RuntimeError:
+                with open(log_path) as f:
+                    sys.stderr.write(f.read()[-4000:])
+                raise
+            base = f'http://127.0.0.1:{port}'
+            rng = random.Random(args.seed)
+            users = [User(base, f'bench{i}', corpus, random.Random(rng.random())) for i in range(args.users)]
+            for user in users:
+                assert user.register() and user.login(), f"could not sign up {user.username}"
+                for _ in range(args.docs_per_user):
+                    user.upload()
+                user.list()
+            samples, elapsed = drive(users, parse_mix(args.mix), args.duration, args.warmup, args.think)
+            endpoints, total = summarize(samples, elapsed)
+            stages = stage_totals(base, env['STATS_TOKEN'])
+    finally:
+        for process in reversed(processes):
+            process.terminate()
+            process.wait()
+        shutil.rmtree(workdir, ignore_errors=True)
+    return {
+        "meta": {
+            "revision": git_revision(), "started_at": time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            "python": platform.python_version(), "cpus": os.cpu_count(), "postgres": pg_mode,
+            "users": args.users, "duration": round(elapsed, 1), "mix": args.mix, "pages": args.pages,
+            "llm_latency": args.llm_latency, "llm_token_delay": args.llm_token_delay,
+            "threads": args.threads, "job_workers": args.job_workers, "seed": args.seed,
+        },
+        "total": total,
+        "endpoints": endpoints,
+        "stage_seconds": stages,
+    }
+
+def compare(result, baseline, threshold, min_requests=20):
+    """Print per-endpoint changes; returns the regressions (p95 up or throughput down by more than threshold).
+
+    Endpoints with fewer than min_requests samples in either run are shown but never flagged.
+    """
+    regressions = []
+    print(f"\n{'endpoint':<16}{'req/s':>10}{'change':>9}{'p95 ms':>11}{'change':>9}")
+    for name, current in result['endpoints'].items():
+        before = baseline.get('endpoints', {}).get(name)
+        if not before:
+            print(f"{name:<16}{current['requests_per_s']:>10.2f}{'new':>9}{current['p95_ms']:>11.1f}")
+            continue
+        rps = (current['requests_per_s'] - before['requests_per_s']) / before['requests_per_s'] if before['requests_per_s'] else 0.0
+        p95 = (current['p95_ms'] - before['p95_ms']) / before['p95_ms'] if before['p95_ms'] else 0.0
+        flag = ''
+        if min(current['requests'], before['requests']) < min_requests:
+            flag = '  (too few samples)'
+        elif p95 > threshold or rps < -threshold:
+            regressions.append(name)
+            flag = '  REGRESSION'
+        print(f"{name:<16}{current['requests_per_s']:>10.2f}{rps:>+9.1%}{current['p95_ms']:>11.1f}{p95:>+9.1%}{flag}")
+    return regressions
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Load test the Flask app end to end')
+    parser.add_argument('--users', type=int, default=16, help='concurrent virtual users')
+    parser.add_argument('--duration', type=float, default=60, help='measured seconds')
+    parser.add_argument('--warmup', type=float, default=5, help='seconds of traffic before measuring')
+    parser.add_argument('--think', type=float, default=0.0, help='mean seconds between a user\'s requests')
+    parser.add_argument('--mix', default=DEFAULT_MIX, help='action=weight pairs')
+    parser.add_argument('--pages', type=int, nargs='+', default=[1, 5, 20, 100], help='page counts of the corpus')
+    parser.add_argument('--files-per-size', type=int, default=5)
+    parser.add_argument('--docs-per-user', type=int, default=5, help='uploads per user before the run')
+    parser.add_argument('--llm-latency', type=float, default=0.5)
+    parser.add_argument('--llm-token-delay', type=float, default=0.01)
+    parser.add_argument('--threads', type=int, default=32, help='request threads of the server')
+    parser.add_argument('--job-workers', type=int, default=2)
+    parser.add_argument('--bcrypt-rounds', type=int, help='override BCRYPT_ROUNDS for the server')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--pg-bin', help='directory with initdb and pg_ctl')
+    parser.add_argument('--admin-dsn', default=Config.DB_CONN_STR,
+                        help='server to create a throwaway database on when no cluster can be started')
+    parser.add_argument('--json', help='save the results here')
+    parser.add_argument('--compare', help='results JSON of an earlier run')
+    parser.add_argument('--threshold', type=float, default=0.10, help='relative change counted as a regression')
+    parser.add_argument('--min-requests', type=int, default=20, help='samples an endpoint needs to be compared')
+    parser.add_argument('--serve', type=int, metavar='PORT', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.serve:
+        serve(args.serve, args.threads)
+        sys.exit()
+    result = run(args)
+    print(f"{'endpoint':<16}{'requests':>9}{'errors':>8}{'req/s':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for name, r in result['endpoints'].items():
+        print(f"{name:<16}{r['requests']:>9}{r['errors']:>8}{r['requests_per_s']:>9.2f}"
+              f"{r['p50_ms']:>10.1f}{r['p95_ms']:>10.1f}{r['p99_ms']:>10.1f}")
+    total = result['total']
+    print(f"{'total':<16}{total['requests']:>9}{total['errors']:>8}{total['requests_per_s']:>9.2f}")
+    if result['stage_seconds']:
+        print("server stages: " + ', '.join(f"{k} {v:.1f}s" for k, v in sorted(result['stage_seconds'].items())))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(result, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(result, json.load(f), args.threshold, args.min_requests)
+        if regressions:
+            sys.exit(f"regressions: {', '.join(regressions)}")
@@ -1,11 +1,10 @@
 # blueprints/auth.py
 from flask import Blueprint, request, jsonify, render_template
-import datetime
-import jwt
-import bcrypt
 import psycopg2
 from db import get_db
 from config import Config
+from utils.auth import auth_required, get_user_by_username, issue_token, revoke_token
+from utils.passwords import PasswordServiceBusy, check_password, hash_password, rehash_if_needed
 
 auth_bp = Blueprint('auth', __name__)
 
@@ -17,11 +16,14 @@ def register():
     if not username or not password:
         return jsonify({"error": "Missing fields"}), 400
 
-    hashed = bcrypt.hashpw(password.encode(), bcrypt.gensalt())
+    try:
+        hashed = hash_password(password)
+    except PasswordServiceBusy:
+        return jsonify({"error": "Server busy, try again"}), 503, {"Retry-After": "1"}
     with get_db(Config.DB_CONN_STR) as conn:
         cur = conn.cursor()
         try:
-            cur.execute("INSERT INTO users (username, password) VALUES (%s, %s)", (username, hashed.decode()))
+            cur.execute("INSERT INTO users (username, password) VALUES (%s, %s)", (username, hashed))
             conn.commit()
             return jsonify({"message": "User registered"}), 200
         except psycopg2.IntegrityError:
@@ -35,13 +37,19 @@ def login():
     if not username or not password:
         return jsonify({"error": "Missing fields"}), 400
 
-    with get_db(Config.DB_CONN_STR) as conn:
-        cur = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
-        cur.execute("SELECT * FROM users WHERE username = %s", (username,))
-        user = cur.fetchone()
-        if not user or not bcrypt.checkpw(password.encode(), user['password'].encode()):
-            return jsonify({"error": "Invalid credentials"}), 401
+    user = get_user_by_username(username)
+    try:
+        valid = user is not None and check_password(password, user['password'])
+    except PasswordServiceBusy:
+        return jsonify({"error": "Server busy, try again"}), 503, {"Retry-After": "1"}
+    if not valid:
+        return jsonify({"error": "Invalid credentials"}), 401
+    rehash_if_needed(user, password)
+
+    return jsonify({"token": issue_token(user['id'])}), 200
 
-        expiration = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(hours=24)
-        token = jwt.encode({"user_id": user['id'], "exp": expiration}, Config.JWT_SECRET, algorithm="HS256")
-        return jsonify({"token": token}), 200
\ No newline at end of file
+@auth_bp.route('/logout', methods=['POST'])
+@auth_required
+def logout():
+    revoke_token(request.headers['Authorization'])
+    return jsonify({"message": "Logged out"}), 200
@@ -1,14 +1,19 @@
 # blueprints/documents.py
-from flask import Blueprint, request, jsonify, send_file
-import datetime
-import requests
-import pdfplumber
-import os
-from werkzeug.utils import secure_filename
+from flask import Blueprint, request, jsonify
 from utils.auth import auth_required
 from db import get_db
 from config import Config
-import psycopg2
+import batch
+import jobs
+import textstore
+import pagination
+import search
+import serving
+import storage
+import uploads
+from analysis import stream_document_analysis
+from storage import document_path
+from utils.streaming import token_stream_response
 from psycopg2.extras import DictCursor
 
 documents_bp = Blueprint('documents', __name__)
@@ -23,27 +28,141 @@ def upload_document():
     if file.filename == '':
         return jsonify({"error": "No selected file"}), 400
 
-    filename = secure_filename(f"{user_id}_{file.filename}")
-    path = os.path.join(Config.UPLOADS_DIR, filename)
-    file.save(path)
+    filename = storage.safe_filename(file.filename)
+    try:
+        temp_path, content_hash, size = storage.receive(file.stream)
+    except storage.UploadTooLarge:
+        return jsonify({"error": "File too large"}), 413
+    doc_id, path = storage.create_document(Config.DB_CONN_STR, user_id, filename, temp_path, content_hash, size)
 
-    upload_date = datetime.datetime.now().isoformat()
-    with get_db(Config.DB_CONN_STR) as conn:
-        cur = conn.cursor()
-        cur.execute("INSERT INTO documents (user_id, filename, upload_date) VALUES (%s, %s, %s)", (user_id, filename, upload_date))
-        conn.commit()
+    jobs.after_upload(Config.DB_CONN_STR, doc_id, user_id, path)
+    return jsonify({"message": "Document uploaded", "id": doc_id, "filename": filename, "sha256": content_hash}), 200
+
+# Resumable uploads: POST /documents/uploads {filename, size[, sha256]} opens a
+# session; PUT /documents/uploads/<id> with an Upload-Offset header appends the
+# request body; GET reports the offset to resume from; POST .../complete
+# creates the document.
+@documents_bp.route('/documents/uploads', methods=['POST'])
+@auth_required
+def create_upload():
+    data = request.get_json(silent=True) or {}
+    try:
+        upload = uploads.create_session(Config.DB_CONN_STR, request.user_id,
+                                        storage.safe_filename(data.get('filename') or ''), data.get('size'), data.get('sha256'))
+    except uploads.UploadError as e:
+        return jsonify({"error": str(e)}), e.status
+    return jsonify(upload), 201
+
+@documents_bp.route('/documents/uploads/<upload_id>', methods=['GET'])
+@auth_required
+def upload_status(upload_id):
+    try:
+        return jsonify(uploads.get_session(Config.DB_CONN_STR, upload_id, request.user_id)), 200
+    except uploads.UploadError as e:
+        return jsonify({"error": str(e)}), e.status
+
+@documents_bp.route('/documents/uploads/<upload_id>', methods=['PUT'])
+@auth_required
+def upload_chunk(upload_id):
+    offset = request.headers.get('Upload-Offset', type=int)
+    if offset is None:
+        return jsonify({"error": "Upload-Offset header required"}), 400
+    try:
+        offset = uploads.append_chunk(Config.DB_CONN_STR, upload_id, request.user_id, offset, request.stream)
+    except uploads.UploadError as e:
+        return jsonify({"error": str(e), "offset": e.offset}), e.status
+    return jsonify({"upload_id": upload_id, "offset": offset}), 200
+
+@documents_bp.route('/documents/uploads/<upload_id>/complete', methods=['POST'])
+@auth_required
+def complete_upload(upload_id):
+    user_id = request.user_id
+    try:
+        doc_id, filename, path = uploads.complete(Config.DB_CONN_STR, upload_id, user_id)
+    except uploads.UploadError as e:
+        return jsonify({"error": str(e), "offset": e.offset}), e.status
+
+    jobs.after_upload(Config.DB_CONN_STR, doc_id, user_id, path)
+    return jsonify({"message": "Document uploaded", "id": doc_id, "filename": filename}), 201
 
-    return jsonify({"message": "Document uploaded", "filename": filename}), 200
+@documents_bp.route('/documents/uploads/<upload_id>', methods=['DELETE'])
+@auth_required
+def cancel_upload(upload_id):
+    if not uploads.cancel(Config.DB_CONN_STR, upload_id, request.user_id):
+        return jsonify({"error": "Upload not found"}), 404
+    return jsonify({"message": "Upload cancelled"}), 200
+
+# Batch endpoints take up to BATCH_MAX_ITEMS files or ids and return
+# {"results": [...]} with one entry per item, in request order.
+def _batch_response(fn, *args):
+    try:
+        results = fn(Config.DB_CONN_STR, request.user_id, *args)
+    except batch.BatchError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify({"results": results}), 200
+
+@documents_bp.route('/documents/batch/upload', methods=['POST'])
+@auth_required
+def batch_upload():
+    files = request.files.getlist('files')
+    return _batch_response(batch.upload, [(storage.safe_filename(file.filename), file.stream) for file in files])
+
+@documents_bp.route('/documents/batch/analyze', methods=['POST'])
+@auth_required
+def batch_analyze():
+    data = request.get_json(silent=True) or {}
+    return _batch_response(batch.analyze, data.get('ids'))
+
+@documents_bp.route('/documents/batch/sign', methods=['POST'])
+@auth_required
+def batch_sign():
+    # Either {"items": [{"id": 1, "signature": "..."}, ...]} or {"ids": [...], "signature": "..."}
+    data = request.get_json(silent=True) or {}
+    if 'items' in data:
+        if not all(isinstance(item, dict) for item in data['items']):
+            return jsonify({"error": "Items must be objects with id and signature"}), 400
+        items = [(item.get('id'), item.get('signature')) for item in data['items']]
+    elif isinstance(data.get('ids'), list):
+        items = [(doc_id, data.get('signature')) for doc_id in data['ids']]
+    else:
+        items = []
+    return _batch_response(batch.sign, items)
+
+@documents_bp.route('/documents/batch/delete', methods=['POST'])
+@auth_required
+def batch_delete():
+    data = request.get_json(silent=True) or {}
+    return _batch_response(batch.delete, data.get('ids'))
 
 @documents_bp.route('/documents', methods=['GET'])
 @auth_required
 def list_documents():
     user_id = request.user_id
-    with get_db(Config.DB_CONN_STR) as conn:
-        cur = conn.cursor(cursor_factory=DictCursor)
-        cur.execute("SELECT id, filename, upload_date, analysis, signature, signed_date FROM documents WHERE user_id = %s", (user_id,))
-        docs = cur.fetchall()
-    return jsonify(docs), 200
+    try:
+        docs, next_cursor = pagination.list_documents(
+            Config.DB_CONN_STR, user_id,
+            sort=request.args.get('sort', 'uploaded'),
+            cursor=request.args.get('cursor'),
+            limit=pagination.parse_limit(request.args.get('limit')),
+        )
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify({"documents": docs, "next_cursor": next_cursor}), 200
+
+@documents_bp.route('/documents/search', methods=['GET'])
+@auth_required
+def search_documents():
+    q = request.args.get('q', '').strip()
+    if not q:
+        return jsonify({"error": "Query required"}), 400
+    try:
+        offset = max(int(request.args.get('offset', 0)), 0)
+        limit = pagination.parse_limit(request.args.get('limit'))
+    except ValueError:
+        return jsonify({"error": "Invalid offset or limit"}), 400
+
+    docs, next_offset = search.search_documents(Config.DB_CONN_STR, request.user_id, q, limit, offset)
+    return jsonify({"documents": docs, "next_offset": next_offset}), 200
 
 @documents_bp.route('/documents/<doc_id>/analyze', methods=['POST'])
 @auth_required
@@ -56,37 +175,75 @@ def analyze_document(doc_id):
     user_id = request.user_id
     with get_db(Config.DB_CONN_STR) as conn:
         cur = conn.cursor(cursor_factory=DictCursor)
-        cur.execute("SELECT filename FROM documents WHERE id = %s AND user_id = %s", (doc_id, user_id))
+        cur.execute("SELECT filename, content_hash FROM documents WHERE id = %s AND user_id = %s", (doc_id, user_id))
+        doc = cur.fetchone()
+        if not doc:
+            return jsonify({"error": "Document not found"}), 404
+
+    analysis = jobs.analyze_from_cache(Config.DB_CONN_STR, doc_id, doc['filename'], doc['content_hash'])
+    if analysis is not None:
+        return jsonify({"analysis": analysis, "cached": True}), 200
+
+    job_id = jobs.enqueue(Config.DB_CONN_STR, 'analyze', doc_id, user_id)
+    return jsonify({"job_id": job_id, "status": "queued"}), 202
+
+@documents_bp.route('/documents/<doc_id>/analyze/stream', methods=['POST'])
+@auth_required
+def analyze_document_stream(doc_id):
+    try:
+        doc_id = int(doc_id)
+    except ValueError:
+        return jsonify({"error": "Invalid document ID"}), 400
+
+    user_id = request.user_id
+    with get_db(Config.DB_CONN_STR) as conn:
+        cur = conn.cursor(cursor_factory=DictCursor)
+        cur.execute("SELECT filename, content_hash FROM documents WHERE id = %s AND user_id = %s", (doc_id, user_id))
         doc = cur.fetchone()
         if not doc:
             return jsonify({"error": "Document not found"}), 404
 
-    path = os.path.join(Config.UPLOADS_DIR, doc['filename'])
+    # Server-Sent Events by default; chunked JSON lines for clients that ask for them.
+    ndjson = request.accept_mimetypes.best_match(['text/event-stream', 'application/x-ndjson']) == 'application/x-ndjson'
+    path = document_path(doc['filename'], doc['content_hash'])
+    tokens = stream_document_analysis(Config.DB_CONN_STR, doc_id, path, doc['content_hash'])
+    return token_stream_response(tokens, ndjson=ndjson)
 
-    # Extract text from PDF
+@documents_bp.route('/documents/jobs/<job_id>', methods=['GET'])
+@auth_required
+def job_status(job_id):
     try:
-        with pdfplumber.open(path) as pdf:
-            text = ' '.join(page.extract_text() or '' for page in pdf.pages)
-    except Exception as e:
-        return jsonify({"error": "Failed to extract text"}), 500
-
-    # Call Ollama
-    prompt = f"Summarize this document: {text[:2000]}"
-    ollama_req = {"model": "llama3", "prompt": prompt, "stream": False}
+        job_id = int(job_id)
+    except ValueError:
+        return jsonify({"error": "Invalid job ID"}), 400
+
+    job = jobs.get_job(Config.DB_CONN_STR, job_id, request.user_id)
+    if not job:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(job), 200
+
+@documents_bp.route('/documents/<doc_id>/text', methods=['GET'])
+@auth_required
+def document_text(doc_id):
     try:
-        resp = requests.post(Config.OLLAMA_ENDPOINT, json=ollama_req)
-        resp.raise_for_status()
-        analysis = resp.json().get('response', '')
-    except Exception as e:
-        return jsonify({"error": "Failed to analyze"}), 500
+        doc_id = int(doc_id)
+        start = int(request.args.get('start', 0))
+        stop = int(request.args['stop']) if 'stop' in request.args else None
+    except ValueError:
+        return jsonify({"error": "Invalid document ID or page range"}), 400
 
-    # Update DB
+    user_id = request.user_id
     with get_db(Config.DB_CONN_STR) as conn:
         cur = conn.cursor()
-        cur.execute("UPDATE documents SET analysis = %s WHERE id = %s", (analysis, doc_id))
-        conn.commit()
+        cur.execute("SELECT id FROM documents WHERE id = %s AND user_id = %s", (doc_id, user_id))
+        if cur.fetchone() is None:
+            return jsonify({"error": "Document not found"}), 404
 
-    return jsonify({"analysis": analysis}), 200
+    pages = textstore.load_pages(Config.DB_CONN_STR, doc_id, start, stop)
+    if pages is None:
+        return jsonify({"error": "Text not extracted yet"}), 409
+    info = textstore.text_info(Config.DB_CONN_STR, doc_id)
+    return jsonify({"page_count": info['page_count'], "start": start, "pages": pages}), 200
 
 @documents_bp.route('/documents/<doc_id>/sign', methods=['POST'])
 @auth_required
@@ -102,15 +259,8 @@ def sign_document(doc_id):
     if not signature:
         return jsonify({"error": "Signature required"}), 400
 
-    with get_db(Config.DB_CONN_STR) as conn:
-        cur = conn.cursor()
-        cur.execute("SELECT id FROM documents WHERE id = %s AND user_id = %s", (doc_id, user_id))
-        if cur.fetchone() is None:
-            return jsonify({"error": "Document not found"}), 404
-
-        signed_date = datetime.datetime.now().isoformat()
-        cur.execute("UPDATE documents SET signature = %s, signed_date = %s WHERE id = %s", (signature, signed_date, doc_id))
-        conn.commit()
+    if batch.sign(Config.DB_CONN_STR, user_id, [(doc_id, signature)])[0]['status'] == 'not_found':
+        return jsonify({"error": "Document not found"}), 404
 
     return jsonify({"message": "Document signed"}), 200
 
@@ -125,10 +275,9 @@ def download_document(doc_id):
     user_id = request.user_id
     with get_db(Config.DB_CONN_STR) as conn:
         cur = conn.cursor(cursor_factory=DictCursor)
-        cur.execute("SELECT filename FROM documents WHERE id = %s AND user_id = %s", (doc_id, user_id))
+        cur.execute("SELECT filename, content_hash FROM documents WHERE id = %s AND user_id = %s", (doc_id, user_id))
         doc = cur.fetchone()
         if not doc:
             return jsonify({"error": "Document not found"}), 404
 
-    path = os.path.join(Config.UPLOADS_DIR, doc['filename'])
-    return send_file(path, as_attachment=True)
\ No newline at end of file
+    return serving.send_document(doc, as_attachment=True)
\ No newline at end of file
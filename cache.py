@@ -0,0 +1,195 @@
+# cache.py
+# Two-tier cache for analysis results: a bounded in-process LRU in front of
+# the analysis_cache table. Keys are hashes of file content + model + prompt,
+# so re-uploads of the same file hit regardless of filename or owner.
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from config import Config
+from db import get_db
+import metrics
+
+class LRUCache:
+    def __init__(self, max_entries, ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            value, expires = item
+            if expires < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def put(self, key, value, ttl=None):
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + (self.ttl if ttl is None else min(ttl, self.ttl)))
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def pop(self, key):
+        with self._lock:
+            item = self._data.pop(key, None)
+        return None if item is None else item[0]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+_memory = LRUCache(Config.ANALYSIS_CACHE_MEMORY_ENTRIES, Config.ANALYSIS_CACHE_TTL)
+_counters = {"memory_hits": 0, "db_hits": 0, "misses": 0, "stores": 0, "seconds_saved": 0.0}
+_counters_lock = threading.Lock()
+_stores_since_eviction = 0
+
+def _count(name, seconds_saved=0.0):
+    with _counters_lock:
+        _counters[name] += 1
+        _counters["seconds_saved"] += seconds_saved
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with metrics.stage('hashing'), open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def make_key(*parts):
+    return hashlib.sha256('\0'.join(str(p) for p in parts).encode()).hexdigest()
+
+def memory_get(key):
+    """The in-process tier alone; counts a hit. Returns None on a miss."""
+    entry = _memory.get(key)
+    if entry is None:
+        return None
+    _count("memory_hits", entry[1])
+    return entry[0]
+
+def remember(key, row):
+    """Record a database-tier lookup: row is (analysis, generation_seconds), or None on a miss."""
+    if row is None:
+        _count("misses")
+        return None
+    _memory.put(key, tuple(row))
+    _count("db_hits", row[1])
+    return row[0]
+
+# Database-tier statements, shared with async_analysis. Parameters are
+# (key, ttl()), (key, analysis, generation_seconds), (ttl(),) and (Config.ANALYSIS_CACHE_MAX_ROWS,).
+GET_SQL = """
+    UPDATE analysis_cache SET hit_count = hit_count + 1, last_used_at = now()
+    WHERE cache_key = %s AND created_at > now() - make_interval(secs => %s)
+    RETURNING analysis, generation_seconds
+"""
+PUT_SQL = """
+    INSERT INTO analysis_cache (cache_key, analysis, generation_seconds) VALUES (%s, %s, %s)
+    ON CONFLICT (cache_key) DO UPDATE
+    SET analysis = EXCLUDED.analysis, generation_seconds = EXCLUDED.generation_seconds,
+        created_at = now(), last_used_at = now()
+"""
+EVICT_EXPIRED_SQL = "DELETE FROM analysis_cache WHERE created_at < now() - make_interval(secs => %s)"
+EVICT_LRU_SQL = """
+    DELETE FROM analysis_cache WHERE cache_key IN (
+        SELECT cache_key FROM analysis_cache ORDER BY last_used_at DESC OFFSET %s
+    )
+"""
+
+def ttl():
+    return float(Config.ANALYSIS_CACHE_TTL)
+
+def get(conn_str, key):
+    """Return the cached analysis for key, or None."""
+    analysis = memory_get(key)
+    if analysis is not None:
+        return analysis
+    with get_db(conn_str) as conn:
+        cur = conn.cursor()
+        cur.execute(GET_SQL, (key, ttl()))
+        row = cur.fetchone()
+    return remember(key, row)
+
+def get_many(conn_str, keys):
+    """Return {key: analysis} for the keys that are cached, with one query for the database tier."""
+    found, missing = {}, []
+    for key in set(keys):
+        analysis = memory_get(key)
+        if analysis is None:
+            missing.append(key)
+        else:
+            found[key] = analysis
+    if missing:
+        with get_db(conn_str) as conn:
+            cur = conn.cursor()
+            cur.execute("""
+                UPDATE analysis_cache SET hit_count = hit_count + 1, last_used_at = now()
+                WHERE cache_key = ANY(%s) AND created_at > now() - make_interval(secs => %s)
+                RETURNING cache_key, analysis, generation_seconds
+            """, (missing, ttl()))
+            rows = cur.fetchall()
+        for key, analysis, generation_seconds in rows:
+            found[key] = remember(key, (analysis, generation_seconds))
+        for _ in range(len(missing) - len(rows)):
+            _count("misses")
+    return found
+
+def memory_put(key, analysis, generation_seconds=0.0):
+    _memory.put(key, (analysis, generation_seconds))
+    _count("stores")
+
+def eviction_due():
+    """True on every ANALYSIS_CACHE_EVICT_EVERY-th store in this process."""
+    # Eviction scans the whole table and a chunked summary stores once per
+    # chunk, so it runs in occasional passes rather than on every store.
+    global _stores_since_eviction
+    with _counters_lock:
+        _stores_since_eviction += 1
+        if _stores_since_eviction < Config.ANALYSIS_CACHE_EVICT_EVERY:
+            return False
+        _stores_since_eviction = 0
+        return True
+
+def put(conn_str, key, analysis, generation_seconds=0.0):
+    memory_put(key, analysis, generation_seconds)
+    with get_db(conn_str) as conn:
+        cur = conn.cursor()
+        cur.execute(PUT_SQL, (key, analysis, generation_seconds))
+    if eviction_due():
+        evict(conn_str)
+
+def evict(conn_str):
+    """Delete expired rows, then the least recently used beyond ANALYSIS_CACHE_MAX_ROWS."""
+    with get_db(conn_str) as conn:
+        cur = conn.cursor()
+        cur.execute(EVICT_EXPIRED_SQL, (ttl(),))
+        cur.execute(EVICT_LRU_SQL, (Config.ANALYSIS_CACHE_MAX_ROWS,))
+
+def counters():
+    with _counters_lock:
+        return dict(_counters)
+
+def stats(conn_str):
+    result = counters()
+    result["seconds_saved"] = round(result["seconds_saved"], 3)
+    result["memory_entries"] = len(_memory)
+    with get_db(conn_str) as conn:
+        cur = conn.cursor()
+        cur.execute("""
+            SELECT count(*), coalesce(sum(hit_count), 0), coalesce(sum(hit_count * generation_seconds), 0)
+            FROM analysis_cache
+        """)
+        rows, hits, saved = cur.fetchone()
+    result["db_entries"] = rows
+    result["db_hits_total"] = int(hits)
+    result["db_seconds_saved_total"] = round(float(saved), 3)
+    return result
@@ -4,6 +4,82 @@ import os
 class Config:
     SECRET_KEY = os.environ.get('SECRET_KEY') or 'your-secret-key'
     DB_CONN_STR = os.environ.get('DB_CONN_STR') or "dbname=lucudocs user=postgres password=1234 host=localhost port=5432"
-    UPLOADS_DIR = "./uploads"
-    OLLAMA_ENDPOINT = "http://localhost:11434/api/generate"
-    JWT_SECRET = "your-secret-key"  # Move from app
\ No newline at end of file
+    DB_POOL_MIN_SIZE = int(os.environ.get('DB_POOL_MIN_SIZE', 1))
+    DB_POOL_MAX_SIZE = int(os.environ.get('DB_POOL_MAX_SIZE', 10))
+    DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', 5))  # seconds to wait for a free connection
+    DB_POOL_HEALTH_CHECK = os.environ.get('DB_POOL_HEALTH_CHECK', '1') == '1'  # SELECT 1 on checkout
+    MIGRATION_BATCH_SIZE = int(os.environ.get('MIGRATION_BATCH_SIZE', 5000))  # rows per backfill transaction
+    MIGRATION_LOCK_TIMEOUT = os.environ.get('MIGRATION_LOCK_TIMEOUT') or '5s'  # per attempt at a brief exclusive lock
+    UPLOADS_DIR = os.environ.get('UPLOADS_DIR') or "./uploads"
+    UPLOAD_MAX_SIZE = int(os.environ.get('UPLOAD_MAX_SIZE', 2 * 1024 ** 3))  # bytes per document
+    UPLOAD_BLOCK_SIZE = 1024 * 1024  # bytes read from the request per write
+    FILE_SERVE_ACCEL = os.environ.get('FILE_SERVE_ACCEL') or ''  # '', 'x-accel' (nginx) or 'x-sendfile'
+    FILE_ACCEL_PREFIX = os.environ.get('FILE_ACCEL_PREFIX') or '/_protected_uploads'  # internal location mapped to UPLOADS_DIR
+    UPLOAD_SESSION_TTL = int(os.environ.get('UPLOAD_SESSION_TTL', 24 * 3600))  # seconds an idle resumable upload is kept
+    PREVIEW_DIR = os.environ.get('PREVIEW_DIR') or os.path.join(UPLOADS_DIR, 'previews')
+    PREVIEW_CACHE_MAX_BYTES = int(os.environ.get('PREVIEW_CACHE_MAX_BYTES', 1024 ** 3))  # least recently used images go first
+    PREVIEW_ON_UPLOAD = os.environ.get('PREVIEW_ON_UPLOAD', '1') == '1'  # queue a 'preview' job per upload
+    PREVIEW_PAGES = int(os.environ.get('PREVIEW_PAGES', 3))  # page images rendered at upload; later pages on first view
+    PREVIEW_VIEWER_PAGES = 100  # page images shown in the document view before falling back to the PDF
+    PREVIEW_THUMB_WIDTH = 240  # pixels
+    PREVIEW_PAGE_WIDTH = 800
+    PREVIEW_FORMAT = os.environ.get('PREVIEW_FORMAT') or 'webp'  # 'webp', 'jpeg' or 'png'
+    PREVIEW_QUALITY = 70
+    PREVIEW_MAX_AGE = 365 * 24 * 3600  # seconds; a document's content never changes under its id
+    BATCH_MAX_ITEMS = int(os.environ.get('BATCH_MAX_ITEMS', 500))  # files or ids per batch request
+    PAGE_SIZE = 50  # documents per listing page
+    MAX_PAGE_SIZE = 200
+    SEARCH_MAX_CHARS = 200000  # extracted text indexed per document
+    SEARCH_MAX_CANDIDATES = 1000  # newest matches ranked per query
+    OLLAMA_ENDPOINT = os.environ.get('OLLAMA_ENDPOINT') or "http://localhost:11434/api/generate"
+    OLLAMA_MODEL = os.environ.get('OLLAMA_MODEL') or "llama3"
+    OLLAMA_CONNECT_TIMEOUT = float(os.environ.get('OLLAMA_CONNECT_TIMEOUT', 5))
+    OLLAMA_READ_TIMEOUT = float(os.environ.get('OLLAMA_READ_TIMEOUT', 300))
+    OLLAMA_ENDPOINTS = [url.strip() for url in (os.environ.get('OLLAMA_ENDPOINTS') or OLLAMA_ENDPOINT).split(',')
+                        if url.strip()]  # generate URLs to balance across, comma-separated
+    OLLAMA_MAX_CONNECTIONS = int(os.environ.get('OLLAMA_MAX_CONNECTIONS', 100))  # keep-alive pool per process
+    OLLAMA_BACKEND_CONCURRENCY = int(os.environ.get('OLLAMA_BACKEND_CONCURRENCY', 8))  # in-flight calls per backend per process
+    OLLAMA_QUEUE_TIMEOUT = float(os.environ.get('OLLAMA_QUEUE_TIMEOUT', 60))  # seconds to wait for a free backend
+    OLLAMA_MAX_RETRIES = int(os.environ.get('OLLAMA_MAX_RETRIES', 2))  # after the first attempt
+    OLLAMA_RETRY_BACKOFF = float(os.environ.get('OLLAMA_RETRY_BACKOFF', 0.5))  # seconds, doubled per retry
+    OLLAMA_BREAKER_THRESHOLD = int(os.environ.get('OLLAMA_BREAKER_THRESHOLD', 5))  # consecutive failures that open a backend's circuit
+    OLLAMA_BREAKER_COOLDOWN = float(os.environ.get('OLLAMA_BREAKER_COOLDOWN', 30))  # seconds before a trial request
+    OLLAMA_HEALTH_INTERVAL = float(os.environ.get('OLLAMA_HEALTH_INTERVAL', 15))  # seconds between /api/tags probes, 0 disables
+    PDF_BACKEND = os.environ.get('PDF_BACKEND') or 'auto'  # 'auto', 'pdfium' or 'pdfplumber'
+    EXTRACTION_WORKERS = int(os.environ.get('EXTRACTION_WORKERS', os.cpu_count() or 1))
+    EXTRACTION_PARALLEL_MIN_PAGES = int(os.environ.get('EXTRACTION_PARALLEL_MIN_PAGES', 64))
+    EXTRACT_ON_UPLOAD = os.environ.get('EXTRACT_ON_UPLOAD') or 'background'  # 'background', 'inline' or 'off'
+    TEXT_PREVIEW_CHARS = 1500
+    ANALYSIS_PROMPT = "Summarize this document: {text}"
+    ANALYSIS_MAX_CHARS = int(os.environ.get('ANALYSIS_MAX_CHARS', 200000))  # document text fed to the summarizer
+    SUMMARY_CHUNK_TOKENS = int(os.environ.get('SUMMARY_CHUNK_TOKENS', 1500))  # per LLM call
+    SUMMARY_PARALLELISM = int(os.environ.get('SUMMARY_PARALLELISM', 4))  # concurrent chunk calls per analysis
+    SUMMARY_MAX_LEVELS = 3
+    SUMMARY_CHUNK_PROMPT = "Summarize this section of a longer document: {text}"
+    SUMMARY_REDUCE_PROMPT = "Combine these section summaries into a single summary of the whole document:\n\n{summaries}"
+    ANALYSIS_CACHE_MEMORY_ENTRIES = int(os.environ.get('ANALYSIS_CACHE_MEMORY_ENTRIES', 256))
+    ANALYSIS_CACHE_TTL = int(os.environ.get('ANALYSIS_CACHE_TTL', 30 * 24 * 3600))  # seconds
+    ANALYSIS_CACHE_MAX_ROWS = int(os.environ.get('ANALYSIS_CACHE_MAX_ROWS', 10000))
+    ANALYSIS_CACHE_EVICT_EVERY = int(os.environ.get('ANALYSIS_CACHE_EVICT_EVERY', 100))  # stores per eviction pass
+    JOB_WORKERS = int(os.environ.get('JOB_WORKERS', 2))  # max concurrent analyses per worker group
+    JOB_WORKERS_EMBEDDED = os.environ.get('JOB_WORKERS_EMBEDDED', '1') == '1'  # start workers from create_app
+    JOB_POLL_INTERVAL = float(os.environ.get('JOB_POLL_INTERVAL', 1))
+    JOB_STALE_AFTER = int(os.environ.get('JOB_STALE_AFTER', 900))  # seconds before a 'running' job is reclaimed
+    JOB_MAX_ATTEMPTS = int(os.environ.get('JOB_MAX_ATTEMPTS', 3))
+    JOB_RETRY_BACKOFF = float(os.environ.get('JOB_RETRY_BACKOFF', 30))  # seconds before the first retry; doubles after each
+    JOB_STOP_TIMEOUT = float(os.environ.get('JOB_STOP_TIMEOUT', 30))  # seconds a stopping worker may finish its job
+    JWT_SECRET = "your-secret-key"  # Move from app
+    BCRYPT_ROUNDS = int(os.environ.get('BCRYPT_ROUNDS', 12))  # work factor for new hashes; older ones are upgraded on login
+    BCRYPT_WORKERS = int(os.environ.get('BCRYPT_WORKERS', 2))  # hashing processes; 0 hashes in the request thread
+    BCRYPT_MAX_QUEUE = int(os.environ.get('BCRYPT_MAX_QUEUE', 16))  # waiting operations before failing fast
+    BCRYPT_TIMEOUT = float(os.environ.get('BCRYPT_TIMEOUT', 10))
+    AUTH_CACHE_ENABLED = os.environ.get('AUTH_CACHE_ENABLED', '1') == '1'
+    AUTH_CACHE_SIZE = int(os.environ.get('AUTH_CACHE_SIZE', 10000))  # entries per cache (tokens, users)
+    AUTH_CACHE_TTL = int(os.environ.get('AUTH_CACHE_TTL', 300))  # seconds
+    AUTH_REVOCATION_DB = os.environ.get('AUTH_REVOCATION_DB', '1') == '1'  # share revocations via Postgres
+    AUTH_REVOCATION_REFRESH = int(os.environ.get('AUTH_REVOCATION_REFRESH', 30))  # seconds between reloads
+    METRICS_ENABLED = os.environ.get('METRICS_ENABLED', '1') == '1'  # latency histograms for /metrics
+    STATS_TOKEN = os.environ.get('STATS_TOKEN') or ''  # bearer token for /metrics and /stats/*; unset disables them
+    PROFILE_SLOW_REQUESTS = float(os.environ.get('PROFILE_SLOW_REQUESTS', 0))  # seconds; sample stacks of slower requests, 0 disables
+    PROFILE_INTERVAL = float(os.environ.get('PROFILE_INTERVAL', 0.01))  # seconds between stack samples
+    PROFILE_DIR = os.environ.get('PROFILE_DIR') or './profiles'
@@ -1,41 +1,578 @@
 # db.py
+import logging
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
 import psycopg2
+import psycopg2.errors
 import psycopg2.extras
-import bcrypt
+import psycopg2.pool
+from config import Config
+import metrics
 
+log = logging.getLogger(__name__)
+
+class PoolTimeout(psycopg2.pool.PoolError):
+    pass
+
+class _TimedCursor:
+    def execute(self, query, vars=None):
+        with metrics.stage('db_query'):
+            return super().execute(query, vars)
+
+    def executemany(self, query, vars_list):
+        with metrics.stage('db_query'):
+            return super().executemany(query, vars_list)
+
+_timed_cursors = {}
+
+class TimedConnection(psycopg2.extensions.connection):
+    """Connection whose cursors, of whatever cursor_factory, record statement time as the db_query stage."""
+
+    def cursor(self, *args, **kwargs):
+        factory = kwargs.get('cursor_factory') or self.cursor_factory or psycopg2.extensions.cursor
+        timed = _timed_cursors.get(factory)
+        if timed is None:
+            timed = _timed_cursors[factory] = type(f"Timed{factory.__name__}", (_TimedCursor, factory), {})
+        kwargs['cursor_factory'] = timed
+        return super().cursor(*args, **kwargs)
+
+class ConnectionPool:
+    """Thread-safe pool that blocks (up to a timeout) when every connection is checked out."""
+
+    def __init__(self, conn_str, minconn, maxconn, timeout, health_check):
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.health_check = health_check
+        self._pool = psycopg2.pool.ThreadedConnectionPool(minconn, maxconn, conn_str, connection_factory=TimedConnection)
+        self._slots = threading.BoundedSemaphore(maxconn)
+        self._lock = threading.Lock()
+        self._in_use = 0
+        self._checkouts = 0
+        self._timeouts = 0
+        self._discarded = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+    def getconn(self):
+        start = time.monotonic()
+        if not self._slots.acquire(timeout=self.timeout):
+            with self._lock:
+                self._timeouts += 1
+            raise PoolTimeout(f"No database connection available after {self.timeout}s")
+        try:
+            conn = self._pool.getconn()
+            if self.health_check and not self._is_healthy(conn):
+                self._pool.putconn(conn, close=True)
+                with self._lock:
+                    self._discarded += 1
+                conn = self._pool.getconn()
+        except Exception:
+            self._slots.release()
+            raise
+        waited = time.monotonic() - start
+        with self._lock:
+            self._in_use += 1
+            self._checkouts += 1
+            self._wait_total += waited
+            self._wait_max = max(self._wait_max, waited)
+        return conn
+
+    def putconn(self, conn, close=False):
+        try:
+            self._pool.putconn(conn, close=close or bool(conn.closed))
+        finally:
+            with self._lock:
+                self._in_use -= 1
+            self._slots.release()
+
+    def closeall(self):
+        self._pool.closeall()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "max_size": self.maxconn,
+                "in_use": self._in_use,
+                "idle": len(self._pool._pool),
+                "checkouts": self._checkouts,
+                "timeouts": self._timeouts,
+                "discarded": self._discarded,
+                "wait_time_total": round(self._wait_total, 6),
+                "wait_time_max": round(self._wait_max, 6),
+                "wait_time_avg": round(self._wait_total / self._checkouts, 6) if self._checkouts else 0.0,
+            }
+
+    @staticmethod
+    def _is_healthy(conn):
+        if conn.closed:
+            return False
+        try:
+            cur = conn.cursor()
+            cur.execute("SELECT 1")
+            cur.close()
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+# One pool per connection string per process. A forked child builds its own
+# and keeps the inherited ones referenced so their sockets are never closed
+# (and the parent's sessions terminated) from the child.
+_pools = {}
+_pools_lock = threading.Lock()
+_pools_pid = os.getpid()
+_inherited_pools = []
+
+def get_pool(conn_str):
+    global _pools, _pools_pid
+    with _pools_lock:
+        if _pools_pid != os.getpid():
+            _inherited_pools.append(_pools)
+            _pools = {}
+            _pools_pid = os.getpid()
+        pool = _pools.get(conn_str)
+        if pool is None:
+            pool = ConnectionPool(
+                conn_str,
+                Config.DB_POOL_MIN_SIZE,
+                Config.DB_POOL_MAX_SIZE,
+                Config.DB_POOL_TIMEOUT,
+                Config.DB_POOL_HEALTH_CHECK,
+            )
+            _pools[conn_str] = pool
+        return pool
+
+def pool_stats():
+    with _pools_lock:
+        pools = list(_pools.values()) if _pools_pid == os.getpid() else []
+    stats = {"pools": len(pools), "max_size": 0, "in_use": 0, "idle": 0, "checkouts": 0,
+             "timeouts": 0, "discarded": 0, "wait_time_total": 0.0, "wait_time_max": 0.0}
+    for pool in pools:
+        for key, value in pool.stats().items():
+            if key == "wait_time_max":
+                stats[key] = max(stats[key], value)
+            elif key in stats:
+                stats[key] += value
+    stats["wait_time_avg"] = round(stats["wait_time_total"] / stats["checkouts"], 6) if stats["checkouts"] else 0.0
+    return stats
+
+@contextmanager
 def get_db(conn_str):
-    return psycopg2.connect(conn_str)
+    """Check out a pooled connection; commit on success, roll back on error."""
+    pool = get_pool(conn_str)
+    with metrics.stage('db_connect'):
+        conn = pool.getconn()
+    try:
+        yield conn
+        if not conn.closed:
+            with metrics.stage('db_query'):
+                conn.commit()
+    except Exception:
+        if not conn.closed:
+            conn.rollback()
+        raise
+    finally:
+        pool.putconn(conn)
+
+# Schema migrations. Each runs once, in version order, and is recorded in
+# schema_migrations. A session-level advisory lock serializes processes that
+# start together: the rest wait, then find the migrations applied. Every
+# migration can be re-run after failing part way.
+#
+# Migrations run on their own autocommit connection, so each statement is its
+# own transaction: backfills commit batch by batch and CREATE INDEX
+# CONCURRENTLY is allowed. A statement that cannot get a lock within
+# MIGRATION_LOCK_TIMEOUT gives up and is retried, rather than queueing every
+# other query on the table behind it.
+#
+# Large tables change by expand, backfill, contract. init_db only expands and
+# backfills: new columns are added empty (a catalog-only change) next to the
+# old ones, triggers copy every write to one side over to the other, and
+# existing rows are copied in batches of MIGRATION_BATCH_SIZE ids. Processes
+# still on the previous release keep reading and writing the old columns
+# meanwhile. Dropping them is a separate step, which an operator runs once no
+# process of the previous release is left:
+#
+#   python db.py contract   drop the old columns and the sync triggers
+#   python db.py compact    rewrite rows that still carry dropped payloads, then VACUUM
+
+MIGRATION_LOCK = 7201634  # pg_advisory_lock key
+LOCK_ATTEMPTS = 20
+
+def _run(conn, sql, params=None):
+    for attempt in range(1, LOCK_ATTEMPTS + 1):
+        try:
+            with conn.cursor() as cur:
+                cur.execute(sql, params)
+                return cur.fetchall() if cur.description else cur.rowcount
+        except psycopg2.errors.LockNotAvailable:
+            if attempt == LOCK_ATTEMPTS:
+                raise
+            log.warning("Migration statement timed out waiting for a lock; retrying (%d/%d)", attempt, LOCK_ATTEMPTS)
+            time.sleep(min(attempt, 10))
+
+def _in_batches(conn, sql):
+    """Run sql over documents one id range at a time; it filters on id >= %(low)s AND id < %(high)s."""
+    (low, high), = _run(conn, "SELECT min(id), max(id) FROM documents")
+    total = 0
+    if low is None:
+        return total
+    for start in range(low, high + 1, Config.MIGRATION_BATCH_SIZE):
+        total += _run(conn, sql, {'low': start, 'high': start + Config.MIGRATION_BATCH_SIZE})
+    return total
+
+def _column_exists(conn, table, column):
+    return bool(_run(conn, "SELECT 1 FROM information_schema.columns WHERE table_name = %s AND column_name = %s",
+                     (table, column)))
+
+def _create_index_concurrently(conn, name, definition):
+    # A failed concurrent build leaves an invalid index that IF NOT EXISTS would keep.
+    found = _run(conn, "SELECT i.indisvalid FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid "
+                       "WHERE c.relname = %s", (name,))
+    if found and found[0][0]:
+        return
+    if found:
+        _run(conn, f"DROP INDEX CONCURRENTLY IF EXISTS {name}")
+    _run(conn, f"CREATE INDEX CONCURRENTLY {name} ON {definition}")
+
+def _add_foreign_key(conn, table, name, definition):
+    """Add the constraint without scanning existing rows, then validate them without blocking writes."""
+    found = _run(conn, "SELECT convalidated FROM pg_constraint WHERE conname = %s", (name,))
+    if found and found[0][0]:
+        return
+    if not found:
+        _run(conn, f"ALTER TABLE {table} ADD CONSTRAINT {name} FOREIGN KEY {definition} NOT VALID")
+    try:
+        _run(conn, f"ALTER TABLE {table} VALIDATE CONSTRAINT {name}")
+    except psycopg2.errors.ForeignKeyViolation:
+        log.warning("Existing rows of %s violate %s; it is enforced for new rows only", table, name)
+
+def _baseline(conn):
+    _run(conn, """
+        CREATE TABLE IF NOT EXISTS users (
+            id SERIAL PRIMARY KEY,
+            username TEXT UNIQUE,
+            password TEXT
+        );
+        CREATE TABLE IF NOT EXISTS documents (
+            id SERIAL PRIMARY KEY,
+            user_id INTEGER,
+            filename TEXT,
+            upload_date TEXT,
+            analysis TEXT,
+            signature TEXT,
+            signed_date TEXT
+        );
+        CREATE INDEX IF NOT EXISTS documents_user_upload_idx ON documents (user_id, upload_date DESC, id DESC);
+        CREATE INDEX IF NOT EXISTS documents_user_signed_idx ON documents (user_id, signed_date DESC, id DESC)
+            WHERE signed_date IS NOT NULL;
+        CREATE TABLE IF NOT EXISTS jobs (
+            id SERIAL PRIMARY KEY,
+            kind TEXT NOT NULL,
+            document_id INTEGER,
+            user_id INTEGER,
+            status TEXT NOT NULL DEFAULT 'queued',
+            result TEXT,
+            error TEXT,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+            started_at TIMESTAMPTZ,
+            finished_at TIMESTAMPTZ
+        );
+        CREATE INDEX IF NOT EXISTS jobs_pending_idx ON jobs (id) WHERE status IN ('queued', 'running');
+        CREATE TABLE IF NOT EXISTS analysis_cache (
+            cache_key TEXT PRIMARY KEY,
+            analysis TEXT NOT NULL,
+            generation_seconds DOUBLE PRECISION NOT NULL DEFAULT 0,
+            hit_count INTEGER NOT NULL DEFAULT 0,
+            created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+            last_used_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        );
+        CREATE INDEX IF NOT EXISTS analysis_cache_last_used_idx ON analysis_cache (last_used_at);
+        CREATE TABLE IF NOT EXISTS revoked_tokens (
+            token_id TEXT PRIMARY KEY,
+            expires_at TIMESTAMPTZ NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS document_text (
+            document_id INTEGER PRIMARY KEY REFERENCES documents(id) ON DELETE CASCADE,
+            page_count INTEGER NOT NULL,
+            char_count INTEGER NOT NULL,
+            byte_size INTEGER NOT NULL,
+            extracted_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        );
+        CREATE TABLE IF NOT EXISTS document_pages (
+            document_id INTEGER NOT NULL REFERENCES document_text(document_id) ON DELETE CASCADE,
+            page_no INTEGER NOT NULL,
+            content BYTEA NOT NULL,
+            PRIMARY KEY (document_id, page_no)
+        );
+        ALTER TABLE document_text ADD COLUMN IF NOT EXISTS content_tsv TSVECTOR;
+        ALTER TABLE documents ADD COLUMN IF NOT EXISTS search_vector TSVECTOR;
+        CREATE INDEX IF NOT EXISTS documents_search_idx ON documents USING GIN (search_vector);
+        ALTER TABLE documents ADD COLUMN IF NOT EXISTS content_hash TEXT;
+        ALTER TABLE documents ADD COLUMN IF NOT EXISTS size BIGINT;
+        CREATE INDEX IF NOT EXISTS documents_content_hash_idx ON documents (content_hash);
+        CREATE TABLE IF NOT EXISTS upload_sessions (
+            id TEXT PRIMARY KEY,
+            user_id INTEGER NOT NULL,
+            filename TEXT NOT NULL,
+            size BIGINT NOT NULL,
+            sha256 TEXT,
+            created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+            updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        );
+    """)
+
+def _documents_expand(conn):
+    # Typed dates and the side tables start out empty. Until the contract step
+    # the triggers keep both sides in step: the old TEXT dates and documents.analysis
+    # and .signature, still used by the previous release, and uploaded_at,
+    # signed_at and the side tables, used by this one. pg_trigger_depth() stops
+    # a copied write from being copied back.
+    _run(conn, """
+        ALTER TABLE documents ADD COLUMN IF NOT EXISTS uploaded_at TIMESTAMPTZ,
+                              ADD COLUMN IF NOT EXISTS signed_at TIMESTAMPTZ;
+        CREATE TABLE IF NOT EXISTS document_analyses (
+            document_id INTEGER PRIMARY KEY REFERENCES documents(id) ON DELETE CASCADE,
+            analysis TEXT NOT NULL,
+            analyzed_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        );
+        CREATE TABLE IF NOT EXISTS document_signatures (
+            document_id INTEGER PRIMARY KEY REFERENCES documents(id) ON DELETE CASCADE,
+            signature TEXT NOT NULL
+        );
+        CREATE OR REPLACE FUNCTION lucudocs_to_timestamptz(value TEXT) RETURNS TIMESTAMPTZ
+        LANGUAGE plpgsql STABLE AS $$
+        BEGIN
+            RETURN value::timestamptz;
+        EXCEPTION WHEN others THEN
+            RETURN NULL;
+        END $$;
+        -- The format of datetime.isoformat(), which the previous release wrote.
+        CREATE OR REPLACE FUNCTION lucudocs_to_text(value TIMESTAMPTZ) RETURNS TEXT
+        LANGUAGE sql STABLE AS $$ SELECT to_char(value, 'YYYY-MM-DD"T"HH24:MI:SS.US') $$;
+        CREATE OR REPLACE FUNCTION lucudocs_documents_sync_dates() RETURNS TRIGGER LANGUAGE plpgsql AS $$
+        BEGIN
+            IF TG_OP = 'INSERT' AND NEW.upload_date IS NOT NULL
+               OR TG_OP = 'UPDATE' AND NEW.upload_date IS DISTINCT FROM OLD.upload_date THEN
+                NEW.uploaded_at := coalesce(lucudocs_to_timestamptz(NEW.upload_date), NEW.uploaded_at, now());
+            ELSIF TG_OP = 'INSERT' OR NEW.uploaded_at IS DISTINCT FROM OLD.uploaded_at THEN
+                NEW.upload_date := lucudocs_to_text(NEW.uploaded_at);
+            END IF;
+            IF TG_OP = 'INSERT' AND NEW.signed_date IS NOT NULL
+               OR TG_OP = 'UPDATE' AND NEW.signed_date IS DISTINCT FROM OLD.signed_date THEN
+                NEW.signed_at := CASE WHEN NEW.signed_date IS NOT NULL
+                                      THEN coalesce(lucudocs_to_timestamptz(NEW.signed_date), now()) END;
+            ELSIF TG_OP = 'INSERT' OR NEW.signed_at IS DISTINCT FROM OLD.signed_at THEN
+                NEW.signed_date := lucudocs_to_text(NEW.signed_at);
+            END IF;
+            RETURN NEW;
+        END $$;
+        CREATE OR REPLACE FUNCTION lucudocs_documents_sync_payloads() RETURNS TRIGGER LANGUAGE plpgsql AS $$
+        BEGIN
+            IF pg_trigger_depth() > 1 THEN
+                RETURN NULL;
+            END IF;
+            IF TG_OP = 'INSERT' OR NEW.analysis IS DISTINCT FROM OLD.analysis THEN
+                IF NEW.analysis IS NULL THEN
+                    DELETE FROM document_analyses WHERE document_id = NEW.id;
+                ELSE
+                    INSERT INTO document_analyses (document_id, analysis) VALUES (NEW.id, NEW.analysis)
+                    ON CONFLICT (document_id) DO UPDATE SET analysis = EXCLUDED.analysis, analyzed_at = now();
+                END IF;
+            END IF;
+            IF TG_OP = 'INSERT' OR NEW.signature IS DISTINCT FROM OLD.signature THEN
+                IF NEW.signature IS NULL THEN
+                    DELETE FROM document_signatures WHERE document_id = NEW.id;
+                ELSE
+                    INSERT INTO document_signatures (document_id, signature) VALUES (NEW.id, NEW.signature)
+                    ON CONFLICT (document_id) DO UPDATE SET signature = EXCLUDED.signature;
+                END IF;
+            END IF;
+            RETURN NULL;
+        END $$;
+        CREATE OR REPLACE FUNCTION lucudocs_analyses_sync() RETURNS TRIGGER LANGUAGE plpgsql AS $$
+        BEGIN
+            IF pg_trigger_depth() = 1 THEN
+                UPDATE documents SET analysis = NEW.analysis
+                WHERE id = NEW.document_id AND analysis IS DISTINCT FROM NEW.analysis;
+            END IF;
+            RETURN NULL;
+        END $$;
+        CREATE OR REPLACE FUNCTION lucudocs_signatures_sync() RETURNS TRIGGER LANGUAGE plpgsql AS $$
+        BEGIN
+            IF pg_trigger_depth() = 1 THEN
+                UPDATE documents SET signature = NEW.signature
+                WHERE id = NEW.document_id AND signature IS DISTINCT FROM NEW.signature;
+            END IF;
+            RETURN NULL;
+        END $$;
+        DROP TRIGGER IF EXISTS documents_sync_dates ON documents;
+        CREATE TRIGGER documents_sync_dates BEFORE INSERT OR UPDATE ON documents
+            FOR EACH ROW EXECUTE FUNCTION lucudocs_documents_sync_dates();
+        DROP TRIGGER IF EXISTS documents_sync_payloads ON documents;
+        CREATE TRIGGER documents_sync_payloads AFTER INSERT OR UPDATE OF analysis, signature ON documents
+            FOR EACH ROW EXECUTE FUNCTION lucudocs_documents_sync_payloads();
+        DROP TRIGGER IF EXISTS document_analyses_sync ON document_analyses;
+        CREATE TRIGGER document_analyses_sync AFTER INSERT OR UPDATE OF analysis ON document_analyses
+            FOR EACH ROW EXECUTE FUNCTION lucudocs_analyses_sync();
+        DROP TRIGGER IF EXISTS document_signatures_sync ON document_signatures;
+        CREATE TRIGGER document_signatures_sync AFTER INSERT OR UPDATE OF signature ON document_signatures
+            FOR EACH ROW EXECUTE FUNCTION lucudocs_signatures_sync();
+    """)
+    # A statement of its own, after the column exists: a default given with
+    # ADD COLUMN would fill the existing rows too, and the backfill finds
+    # them by uploaded_at IS NULL.
+    _run(conn, "ALTER TABLE documents ALTER COLUMN uploaded_at SET DEFAULT now()")
+
+def _documents_backfill(conn):
+    dates = _in_batches(conn, """
+        UPDATE documents SET
+            uploaded_at = coalesce(lucudocs_to_timestamptz(upload_date), now()),
+            signed_at = CASE WHEN signed_date IS NOT NULL
+                             THEN coalesce(lucudocs_to_timestamptz(signed_date), now()) END
+        WHERE id >= %(low)s AND id < %(high)s AND uploaded_at IS NULL
+    """)
+    analyses = _in_batches(conn, """
+        INSERT INTO document_analyses (document_id, analysis)
+        SELECT id, analysis FROM documents
+        WHERE id >= %(low)s AND id < %(high)s AND analysis IS NOT NULL
+        ON CONFLICT (document_id) DO NOTHING
+    """)
+    signatures = _in_batches(conn, """
+        INSERT INTO document_signatures (document_id, signature)
+        SELECT id, signature FROM documents
+        WHERE id >= %(low)s AND id < %(high)s AND signature IS NOT NULL
+        ON CONFLICT (document_id) DO NOTHING
+    """)
+    log.info("Backfilled dates of %d documents, %d analyses and %d signatures", dates, analyses, signatures)
+
+def _documents_constraints(conn):
+    _create_index_concurrently(
+        conn, 'documents_user_uploaded_at_idx', "documents (user_id, uploaded_at DESC, id DESC)")
+    _create_index_concurrently(
+        conn, 'documents_user_signed_at_idx',
+        "documents (user_id, signed_at DESC, id DESC) WHERE signed_at IS NOT NULL")
+    # Validated now, so the contract step can SET NOT NULL without a table scan.
+    if not _run(conn, "SELECT 1 FROM pg_constraint WHERE conname = 'documents_uploaded_at_not_null'"):
+        _run(conn, "ALTER TABLE documents ADD CONSTRAINT documents_uploaded_at_not_null "
+                   "CHECK (uploaded_at IS NOT NULL) NOT VALID")
+    _run(conn, "ALTER TABLE documents VALIDATE CONSTRAINT documents_uploaded_at_not_null")
+    _add_foreign_key(conn, 'documents', 'documents_user_id_fkey', "(user_id) REFERENCES users(id)")
+    _add_foreign_key(conn, 'upload_sessions', 'upload_sessions_user_id_fkey', "(user_id) REFERENCES users(id)")
+
+def _documents_contract(conn):
+    # SET NOT NULL gets a statement of its own: within one ALTER TABLE, DROP
+    # subcommands run first, so the CHECK would be gone before SET NOT NULL
+    # looked for it. Dropping the old columns also drops their indexes.
+    _run(conn, """
+        DROP TRIGGER IF EXISTS documents_sync_dates ON documents;
+        DROP TRIGGER IF EXISTS documents_sync_payloads ON documents;
+        DROP TRIGGER IF EXISTS document_analyses_sync ON document_analyses;
+        DROP TRIGGER IF EXISTS document_signatures_sync ON document_signatures;
+        ALTER TABLE documents ALTER COLUMN uploaded_at SET NOT NULL;
+        ALTER TABLE documents DROP CONSTRAINT IF EXISTS documents_uploaded_at_not_null,
+                              DROP COLUMN IF EXISTS upload_date,
+                              DROP COLUMN IF EXISTS signed_date,
+                              DROP COLUMN IF EXISTS analysis,
+                              DROP COLUMN IF EXISTS signature;
+        DROP FUNCTION IF EXISTS lucudocs_documents_sync_dates();
+        DROP FUNCTION IF EXISTS lucudocs_documents_sync_payloads();
+        DROP FUNCTION IF EXISTS lucudocs_analyses_sync();
+        DROP FUNCTION IF EXISTS lucudocs_signatures_sync();
+        DROP FUNCTION IF EXISTS lucudocs_to_timestamptz(TEXT);
+        DROP FUNCTION IF EXISTS lucudocs_to_text(TIMESTAMPTZ);
+    """)
+
+def _jobs_run_after(conn):
+    # Nullable and without a default, so adding it does not rewrite the table.
+    _run(conn, "ALTER TABLE jobs ADD COLUMN IF NOT EXISTS run_after TIMESTAMPTZ")
+
+MIGRATIONS = [
+    (1, 'baseline', _baseline),
+    (2, 'documents_expand', _documents_expand),
+    (3, 'documents_backfill', _documents_backfill),
+    (4, 'documents_constraints', _documents_constraints),
+    (5, 'jobs_run_after', _jobs_run_after),
+]
+
+# Applied only by `python db.py contract`, never by init_db.
+CONTRACTIONS = [
+    (6, 'documents_contract', _documents_contract),
+]
+
+def _connect(conn_str):
+    conn = psycopg2.connect(conn_str)
+    conn.autocommit = True
+    return conn
+
+def migrate(conn_str, contract=False):
+    """Apply pending MIGRATIONS (and with contract, CONTRACTIONS) in version order; returns the versions applied."""
+    conn = _connect(conn_str)
+    applied = []
+    try:
+        # Poll rather than block: a session waiting inside pg_advisory_lock is an
+        # open transaction, which CREATE INDEX CONCURRENTLY would wait for in turn.
+        while not _run(conn, "SELECT pg_try_advisory_lock(%s)", (MIGRATION_LOCK,))[0][0]:
+            time.sleep(0.5)
+        _run(conn, "SET lock_timeout = %s", (Config.MIGRATION_LOCK_TIMEOUT,))
+        _run(conn, """
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                version INTEGER PRIMARY KEY,
+                name TEXT NOT NULL,
+                applied_at TIMESTAMPTZ NOT NULL DEFAULT now()
+            )
+        """)
+        done = {row[0] for row in _run(conn, "SELECT version FROM schema_migrations")}
+        for version, name, migration in sorted(MIGRATIONS + (CONTRACTIONS if contract else [])):
+            if version in done:
+                continue
+            log.info("Applying migration %d (%s)", version, name)
+            start = time.monotonic()
+            migration(conn)
+            _run(conn, "INSERT INTO schema_migrations (version, name) VALUES (%s, %s)", (version, name))
+            log.info("Applied migration %d (%s) in %.1fs", version, name, time.monotonic() - start)
+            applied.append(version)
+    finally:
+        conn.close()  # releases the advisory lock
+    return applied
+
+def compact(conn_str):
+    """Rewrite documents in batches so no row keeps payloads of dropped columns, then VACUUM it."""
+    conn = _connect(conn_str)
+    try:
+        _run(conn, "SET lock_timeout = %s", (Config.MIGRATION_LOCK_TIMEOUT,))
+        rows = _in_batches(conn, "UPDATE documents SET id = id WHERE id >= %(low)s AND id < %(high)s")
+        _run(conn, "VACUUM (ANALYZE) documents")
+        log.info("Rewrote %d documents", rows)
+    finally:
+        conn.close()
 
 def init_db(conn_str):
+    migrate(conn_str)
     with get_db(conn_str) as conn:
         cur = conn.cursor()
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS users (
-                id SERIAL PRIMARY KEY,
-                username TEXT UNIQUE,
-                password TEXT
-            );
-            CREATE TABLE IF NOT EXISTS documents (
-                id SERIAL PRIMARY KEY,
-                user_id INTEGER,
-                filename TEXT,
-                upload_date TEXT,
-                analysis TEXT,
-                signature TEXT,
-                signed_date TEXT
-            );
-        """)
-        conn.commit()
-
-        # Add dummy users if they don't exist
+        # Add dummy users if they don't exist. Hashes are precomputed (bcrypt,
+        # cost 12) so startup does no hashing; passwords are dummypass1..3.
         dummy_users = [
-            ('dummyuser1', 'dummypass1'),
-            ('dummyuser2', 'dummypass2'),
-            ('dummyuser3', 'dummypass3'),
+            ('dummyuser1', '$2b$12$0l57hq297xVTkq5AQYBmsOPcXXgb7Hwb15iBBZaFGqz4.XBdA.xFC'),
+            ('dummyuser2', '$2b$12$rDmYXo7CSCmD2RdaZuNG/.2xX4ekazDK6zf8w2m1n3itROkqm9T3.'),
+            ('dummyuser3', '$2b$12$r48q/1osWybJXHW9gknEFerNis4YPRe2BD4zOBVo5ZmcdnO5c2A16'),
         ]
-        for username, password in dummy_users:
-            cur.execute("SELECT 1 FROM users WHERE username = %s", (username,))
-            if cur.fetchone() is None:
-                hashed = bcrypt.hashpw(password.encode(), bcrypt.gensalt()).decode()
-                cur.execute("INSERT INTO users (username, password) VALUES (%s, %s)", (username, hashed))
-                conn.commit()
\ No newline at end of file
+        psycopg2.extras.execute_values(
+            cur, "INSERT INTO users (username, password) VALUES %s ON CONFLICT (username) DO NOTHING", dummy_users)
+        conn.commit()
+
+if __name__ == '__main__':
+    # python db.py [migrate|contract|compact]
+    logging.basicConfig(level=logging.INFO)
+    command = sys.argv[1] if len(sys.argv) > 1 else 'migrate'
+    if command == 'compact':
+        compact(Config.DB_CONN_STR)
+    elif command in ('migrate', 'contract'):
+        migrate(Config.DB_CONN_STR, contract=command == 'contract')
+    else:
+        sys.exit(f"Unknown command: {command}")
@@ -0,0 +1,164 @@
+# extraction.py
+# PDF text extraction. Pages are produced lazily so callers that only need a
+# prefix (the analysis prompt) stop parsing early; full-text callers can fan
+# page ranges out across a process pool. pypdfium2 is used when available and
+# pdfplumber is the fallback.
+#
+# pdfium is not thread-safe, and request threads, asyncio.to_thread and the
+# job workers all extract and render in the same process, so every pdfium
+# call here and in previews holds PDFIUM_LOCK. It is taken per call, not per
+# document, so a lazy page iterator never holds it while its consumer runs.
+import math
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from config import Config
+import metrics
+
+try:
+    import pypdfium2 as pdfium
+except ImportError:
+    pdfium = None
+
+PDFIUM_LOCK = threading.RLock()
+
+class ExtractionError(Exception):
+    pass
+
+def _pdfium_pages(path, start, stop):
+    with PDFIUM_LOCK:
+        pdf = pdfium.PdfDocument(path)
+    try:
+        with PDFIUM_LOCK:
+            stop = len(pdf) if stop is None else min(stop, len(pdf))
+        for index in range(start, stop):
+            with PDFIUM_LOCK:
+                page = pdf[index]
+                textpage = page.get_textpage()
+                try:
+                    text = textpage.get_text_bounded()
+                finally:
+                    textpage.close()
+                    page.close()
+            yield text.replace('\r\n', '\n')
+    finally:
+        with PDFIUM_LOCK:
+            pdf.close()
+
+def _pdfplumber_pages(path, start, stop):
+    import pdfplumber
+    with pdfplumber.open(path) as pdf:
+        for page in pdf.pages[start:stop]:
+            yield page.extract_text() or ''
+            page.close()  # drop cached layout objects as we go
+
+BACKENDS = {
+    'pdfium': _pdfium_pages,
+    'pdfplumber': _pdfplumber_pages,
+}
+
+def _backend_order(backend):
+    backend = backend or Config.PDF_BACKEND
+    if backend == 'auto':
+        return ['pdfium', 'pdfplumber'] if pdfium is not None else ['pdfplumber']
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown PDF backend: {backend}")
+    return [backend]
+
+def iter_pages(path, backend=None, start=0, stop=None):
+    """Yield the text of each page in [start, stop), falling back to the next backend on failure."""
+    errors = []
+    for name in _backend_order(backend):
+        produced = 0
+        try:
+            for text in BACKENDS[name](path, start, stop):
+                produced += 1
+                yield text
+            return
+        except Exception as e:
+            if produced:
+                raise ExtractionError(f"{name} failed on page {start + produced} of {path}") from e
+            errors.append(e)
+    raise ExtractionError(f"Failed to extract text from {path}") from errors[-1]
+
+def page_count(path, backend=None):
+    error = None
+    for name in _backend_order(backend):
+        try:
+            if name == 'pdfium':
+                with PDFIUM_LOCK:
+                    pdf = pdfium.PdfDocument(path)
+                    try:
+                        return len(pdf)
+                    finally:
+                        pdf.close()
+            import pdfplumber
+            with pdfplumber.open(path) as pdf:
+                return len(pdf.pages)
+        except Exception as e:
+            error = e
+    raise ExtractionError(f"Failed to open {path}") from error
+
+def extract_prefix(path, max_chars, backend=None):
+    """Join page texts until max_chars are available; later pages are never parsed."""
+    parts = []
+    length = 0
+    with metrics.stage('extraction'):
+        for text in iter_pages(path, backend):
+            parts.append(text)
+            length += len(text) + 1
+            if length >= max_chars:
+                break
+    return ' '.join(parts)[:max_chars]
+
+_executor = None
+_executor_lock = threading.Lock()
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(
+                max_workers=Config.EXTRACTION_WORKERS,
+                mp_context=multiprocessing.get_context('spawn'),
+            )
+        return _executor
+
+def shutdown():
+    """Stop the process pool. A process that started it must call this before exiting: multiprocessing
+    joins a child process's own children before the pool's exit handler would stop them."""
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown()
+            _executor = None
+
+def _extract_range(path, backend, start, stop):
+    return list(iter_pages(path, backend, start, stop))
+
+def extract_pages(path, backend=None, parallel=None):
+    """Return the text of every page, split across the process pool for large documents."""
+    with metrics.stage('extraction'):
+        return _extract_pages(path, backend, parallel)
+
+def _extract_pages(path, backend, parallel):
+    count = page_count(path, backend)
+    workers = Config.EXTRACTION_WORKERS
+    if parallel is None:
+        parallel = workers > 1 and count >= Config.EXTRACTION_PARALLEL_MIN_PAGES
+    if multiprocessing.current_process().daemon:
+        parallel = False  # daemonic processes may not start the pool
+    if not parallel:
+        return list(iter_pages(path, backend))
+    step = max(1, math.ceil(count / workers))
+    futures = [
+        _get_executor().submit(_extract_range, path, backend, start, start + step)
+        for start in range(0, count, step)
+    ]
+    pages = []
+    for future in futures:
+        pages.extend(future.result())
+    return pages
+
+def extract_all(path, backend=None, parallel=None):
+    return ' '.join(extract_pages(path, backend, parallel))
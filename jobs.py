@@ -0,0 +1,304 @@
+# jobs.py
+# Postgres-backed background jobs. Rows in `jobs` are claimed with
+# FOR UPDATE SKIP LOCKED, so any number of worker processes (embedded in the
+# web app or started with `python jobs.py`) can share one queue, and queued
+# work survives a restart.
+import atexit
+import logging
+import multiprocessing
+import signal
+import sys
+import threading
+import time
+import psycopg2.extras
+from config import Config
+from db import get_db
+from analysis import analysis_cache_key, analyze_text, save_analysis
+from extraction import ExtractionError
+import cache
+import extraction
+import metrics
+import previews
+import textstore
+from storage import DOCUMENT_SQL, document_path
+
+log = logging.getLogger(__name__)
+
+class JobError(Exception):
+    """A failure that retrying will not fix; the job is marked failed immediately."""
+
+# Shared with asgi.py. Parameters are (kind, document_id, user_id) and (job_id, user_id).
+ENQUEUE_SQL = "INSERT INTO jobs (kind, document_id, user_id) VALUES (%s, %s, %s) RETURNING id"
+JOB_SQL = """
+    SELECT id, kind, document_id, status, result, error, attempts, run_after, created_at, started_at, finished_at
+    FROM jobs WHERE id = %s AND user_id = %s
+"""
+QUEUE_COUNTS_SQL = "SELECT kind, status, count(*) FROM jobs WHERE status IN ('queued', 'running') GROUP BY kind, status"
+
+def enqueue(conn_str, kind, document_id, user_id):
+    with get_db(conn_str) as conn:
+        cur = conn.cursor()
+        cur.execute(ENQUEUE_SQL, (kind, document_id, user_id))
+        return cur.fetchone()[0]
+
+def enqueue_many(conn_str, kind, document_ids, user_id):
+    """Queue one job per document in a single statement; returns {document_id: job_id}."""
+    if not document_ids:
+        return {}
+    with get_db(conn_str) as conn:
+        cur = conn.cursor()
+        rows = psycopg2.extras.execute_values(
+            cur, "INSERT INTO jobs (kind, document_id, user_id) VALUES %s RETURNING document_id, id",
+            [(kind, document_id, user_id) for document_id in document_ids], fetch=True)
+        return dict(rows)
+
+def get_job(conn_str, job_id, user_id):
+    with get_db(conn_str) as conn:
+        cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+        cur.execute(JOB_SQL, (job_id, user_id))
+        return cur.fetchone()
+
+def claim_job(conn_str):
+    # Jobs left 'running' by a worker that died are picked up again once
+    # stale, unless they have used up their attempts: a job that keeps
+    # killing its worker is failed rather than handed to the next one.
+    with get_db(conn_str) as conn:
+        cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+        cur.execute("""
+            UPDATE jobs SET status = 'failed', error = 'Worker died while running the job', finished_at = now()
+            WHERE status = 'running' AND started_at < now() - make_interval(secs => %s) AND attempts >= %s
+        """, (Config.JOB_STALE_AFTER, Config.JOB_MAX_ATTEMPTS))
+        cur.execute("""
+            UPDATE jobs SET status = 'running', started_at = now(), attempts = attempts + 1
+            WHERE id = (
+                SELECT id FROM jobs
+                WHERE (status = 'queued' AND (run_after IS NULL OR run_after <= now()))
+                   OR (status = 'running' AND started_at < now() - make_interval(secs => %s))
+                ORDER BY id
+                FOR UPDATE SKIP LOCKED
+                LIMIT 1
+            )
+            RETURNING id, kind, document_id, user_id, attempts
+        """, (Config.JOB_STALE_AFTER,))
+        return cur.fetchone()
+
+def finish_job(conn_str, job_id, result):
+    with get_db(conn_str) as conn:
+        cur = conn.cursor()
+        cur.execute(
+            "UPDATE jobs SET status = 'done', result = %s, error = NULL, finished_at = now() WHERE id = %s",
+            (result, job_id),
+        )
+
+def fail_job(conn_str, job, error, retry):
+    # Retries back off exponentially, so a dependency that is down (the LLM,
+    # the disk) does not use up every attempt within a second.
+    status = 'queued' if retry and job['attempts'] < Config.JOB_MAX_ATTEMPTS else 'failed'
+    delay = Config.JOB_RETRY_BACKOFF * 2 ** (job['attempts'] - 1)
+    with get_db(conn_str) as conn:
+        cur = conn.cursor()
+        cur.execute("""
+            UPDATE jobs SET status = %s, error = %s,
+                            finished_at = CASE WHEN %s = 'failed' THEN now() END,
+                            run_after = CASE WHEN %s = 'queued' THEN now() + make_interval(secs => %s) END
+            WHERE id = %s
+        """, (status, error, status, status, delay, job['id']))
+
+def queue_counts(conn_str):
+    """{(kind, status): count} for queued and running jobs."""
+    with get_db(conn_str) as conn:
+        cur = conn.cursor()
+        cur.execute(QUEUE_COUNTS_SQL)
+        return {(kind, status): count for kind, status, count in cur.fetchall()}
+
+def analyze_from_cache(conn_str, document_id, filename, content_hash=None):
+    """Serve an analysis straight from the cache, skipping the queue. Returns None on a miss."""
+    try:
+        key = analysis_cache_key(document_path(filename, content_hash), content_hash)
+    except OSError:
+        return None
+    analysis = cache.get(conn_str, key)
+    if analysis is not None:
+        save_analysis(conn_str, document_id, analysis)
+    return analysis
+
+def extract_on_upload(conn_str, document_id, user_id, path):
+    """Populate the text store for a new upload according to Config.EXTRACT_ON_UPLOAD."""
+    if Config.EXTRACT_ON_UPLOAD == 'background':
+        enqueue(conn_str, 'extract', document_id, user_id)
+    elif Config.EXTRACT_ON_UPLOAD == 'inline':
+        try:
+            textstore.extract_and_store(conn_str, document_id, path)
+        except ExtractionError:
+            log.warning("Text extraction failed for document %s", document_id, exc_info=True)
+
+def extract_on_upload_many(conn_str, documents, user_id):
+    """extract_on_upload for (document_id, path) pairs, queueing background jobs in one statement."""
+    if Config.EXTRACT_ON_UPLOAD == 'background':
+        enqueue_many(conn_str, 'extract', [document_id for document_id, _ in documents], user_id)
+    else:
+        for document_id, path in documents:
+            extract_on_upload(conn_str, document_id, user_id, path)
+
+def after_upload(conn_str, document_id, user_id, path):
+    """Background work for a new upload: text extraction and preview rendering."""
+    extract_on_upload(conn_str, document_id, user_id, path)
+    if Config.PREVIEW_ON_UPLOAD and previews.available():
+        enqueue(conn_str, 'preview', document_id, user_id)
+
+def after_upload_many(conn_str, documents, user_id):
+    extract_on_upload_many(conn_str, documents, user_id)
+    if Config.PREVIEW_ON_UPLOAD and previews.available():
+        enqueue_many(conn_str, 'preview', [document_id for document_id, _ in documents], user_id)
+
+def _job_document(conn_str, job):
+    """Return (path, content_hash) of the job's document."""
+    with get_db(conn_str) as conn:
+        cur = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
+        cur.execute(DOCUMENT_SQL, (job['document_id'], job['user_id']))
+        doc = cur.fetchone()
+    if not doc:
+        raise JobError("Document not found")
+    return document_path(doc['filename'], doc['content_hash']), doc['content_hash']
+
+def run_extraction(conn_str, job):
+    try:
+        pages = textstore.extract_and_store(conn_str, job['document_id'], _job_document(conn_str, job)[0])
+    except ExtractionError as e:
+        raise JobError("Failed to extract text") from e
+    return f"{len(pages)} pages extracted"
+
+def run_previews(conn_str, job):
+    path, content_hash = _job_document(conn_str, job)
+    try:
+        count = previews.render_document(path, previews.preview_key(job['document_id'], content_hash))
+    except previews.PreviewError as e:
+        raise JobError("Failed to render previews") from e
+    return f"{count} previews rendered"
+
+def run_analysis(conn_str, job):
+    path, content_hash = _job_document(conn_str, job)
+    try:
+        key = analysis_cache_key(path, content_hash)
+    except OSError as e:
+        raise JobError("Document file missing") from e
+    analysis = cache.get(conn_str, key)
+    if analysis is None:
+        try:
+            text = textstore.get_text(conn_str, job['document_id'], path, Config.ANALYSIS_MAX_CHARS)
+        except ExtractionError as e:
+            raise JobError("Failed to extract text") from e
+        start = time.monotonic()
+        analysis = analyze_text(text, conn_str)
+        cache.put(conn_str, key, analysis, time.monotonic() - start)
+    save_analysis(conn_str, job['document_id'], analysis)
+    return analysis
+
+HANDLERS = {
+    'analyze': run_analysis,
+    'extract': run_extraction,
+    'preview': run_previews,
+}
+
+def run_one(conn_str):
+    """Claim and run a single job. Returns False when the queue is empty."""
+    job = claim_job(conn_str)
+    if job is None:
+        return False
+    trace = metrics.begin()
+    try:
+        result = HANDLERS[job['kind']](conn_str, job)
+    except JobError as e:
+        fail_job(conn_str, job, str(e), retry=False)
+    except Exception as e:
+        log.exception("Job %s failed", job['id'])
+        fail_job(conn_str, job, str(e), retry=True)
+    else:
+        finish_job(conn_str, job['id'], result)
+    log.info("Job %s (%s) took %.3fs: %s", job['id'], job['kind'], trace.elapsed(),
+             metrics.format_stages(trace.stages) or 'no stages')
+    return True
+
+def worker_loop(conn_str, poll_interval, stopping=None):
+    while stopping is None or not stopping.is_set():
+        try:
+            if run_one(conn_str):
+                continue
+        except Exception:
+            log.exception("Job worker error")
+        if stopping is None:
+            time.sleep(poll_interval)
+        else:
+            stopping.wait(poll_interval)
+
+def _exit_on_sigterm():
+    # Exit through SystemExit so finally blocks and exit handlers run.
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+def _worker_main(conn_str, poll_interval, stopping):
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # Ctrl-C reaches the whole group; the parent stops us
+    _exit_on_sigterm()
+    try:
+        worker_loop(conn_str, poll_interval, stopping)
+    finally:
+        extraction.shutdown()
+
+def _start_worker(ctx, conn_str, stopping):
+    # Not daemonic: daemonic processes may not start children, and the
+    # extraction pool is one. stop_workers ends them instead.
+    proc = ctx.Process(target=_worker_main, args=(conn_str, Config.JOB_POLL_INTERVAL, stopping))
+    proc.start()
+    return proc
+
+def _supervise(ctx, conn_str, workers, stopping):
+    # Replace workers that died (killed for memory, crashed in a native
+    # library); the job they were running is reclaimed once stale.
+    while not stopping.wait(Config.JOB_POLL_INTERVAL):
+        for i, proc in enumerate(workers):
+            if not proc.is_alive() and not stopping.is_set():
+                log.warning("Job worker %s exited with code %s; restarting it", proc.pid, proc.exitcode)
+                workers[i] = _start_worker(ctx, conn_str, stopping)
+
+_groups = []  # (workers, stopping) for each start_workers call in this process
+
+def start_workers(conn_str, count=None):
+    # spawn, not fork: a forked child would share the parent's pooled sockets.
+    ctx = multiprocessing.get_context('spawn')
+    stopping = ctx.Event()
+    workers = [_start_worker(ctx, conn_str, stopping) for _ in range(Config.JOB_WORKERS if count is None else count)]
+    threading.Thread(target=_supervise, args=(ctx, conn_str, workers, stopping), name='job-supervisor',
+                     daemon=True).start()
+    if not _groups:
+        # Registered after multiprocessing's own exit handler, so it runs
+        # first; that one would otherwise wait forever on the workers.
+        atexit.register(stop_workers)
+    _groups.append((workers, stopping))
+    return workers
+
+def stop_workers(timeout=None):
+    """Stop this process's workers, terminating those still busy after timeout seconds (JOB_STOP_TIMEOUT)."""
+    # A terminated worker's job is reclaimed once stale.
+    deadline = time.monotonic() + (Config.JOB_STOP_TIMEOUT if timeout is None else timeout)
+    groups = _groups[:]
+    _groups.clear()
+    for _, stopping in groups:
+        stopping.set()
+    for workers, _ in groups:
+        for proc in workers:
+            proc.join(max(0, deadline - time.monotonic()))
+            if proc.is_alive():
+                log.warning("Job worker %s did not stop in time; terminating it", proc.pid)
+                proc.terminate()
+                proc.join()
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    from db import init_db
+    init_db(Config.DB_CONN_STR)
+    _exit_on_sigterm()
+    start_workers(Config.DB_CONN_STR)
+    try:
+        while True:
+            time.sleep(60)  # the supervisor thread keeps the workers running
+    except KeyboardInterrupt:
+        pass  # stop_workers runs at exit
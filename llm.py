@@ -0,0 +1,302 @@
+# llm.py
+# HTTP calls to the Ollama generate endpoint, spread over the backends in
+# OLLAMA_ENDPOINTS. Each call goes to the backend with the fewest calls in
+# flight from this process, at most OLLAMA_BACKEND_CONCURRENCY each; past
+# that, calls wait up to OLLAMA_QUEUE_TIMEOUT for a slot. Connection errors,
+# timeouts and 429/5xx responses are retried on another backend when there
+# is one, up to OLLAMA_MAX_RETRIES times with jittered exponential backoff.
+# A stream is only retried until its first token.
+#
+# Each backend has a circuit breaker: OLLAMA_BREAKER_THRESHOLD consecutive
+# failures take it out of rotation for OLLAMA_BREAKER_COOLDOWN seconds, then
+# a single trial call decides whether it comes back. A background thread
+# also probes each backend's /api/tags every OLLAMA_HEALTH_INTERVAL seconds
+# and skips the ones that do not answer. With no usable backend left, calls
+# fail fast with LLMUnavailable.
+#
+# Backend state is per process, like the database pool, and shared by the
+# sync client here (one pooled requests.Session) and async_llm.
+import asyncio
+import json
+import logging
+import os
+import random
+import threading
+import time
+from urllib.parse import urljoin
+import requests
+import requests.adapters
+from config import Config
+import metrics
+
+log = logging.getLogger(__name__)
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+class LLMError(Exception):
+    pass
+
+class BackendError(LLMError):
+    """The backend failed rather than the request; worth retrying on another."""
+
+class LLMUnavailable(LLMError):
+    """No backend could take the call: every circuit is open or unhealthy, or no slot freed up in time."""
+
+class Backend:
+    def __init__(self, url):
+        self.url = url
+        self.health_url = urljoin(url, 'tags')  # .../api/generate -> .../api/tags
+        self.outstanding = 0
+        self.healthy = True
+        self.failures = 0  # consecutive
+        self.opened_at = None  # when the circuit opened; None while closed
+        self.probing = False  # the trial call of a half-open circuit is in flight
+        self.requests = 0
+        self.errors = 0
+
+    def circuit(self, now):
+        if self.opened_at is None:
+            return 'closed'
+        return 'half_open' if now - self.opened_at >= Config.OLLAMA_BREAKER_COOLDOWN else 'open'
+
+    def usable(self, now):
+        circuit = self.circuit(now)
+        return self.healthy and (circuit == 'closed' or circuit == 'half_open' and not self.probing)
+
+class Balancer:
+    """Least-outstanding-requests choice among the usable backends, with a per-backend cap."""
+
+    def __init__(self, urls):
+        self.backends = [Backend(url) for url in urls]
+        self._cond = threading.Condition()
+        self._waiters = []  # (loop, asyncio.Event) of async callers waiting for a slot
+
+    def _take(self, exclude):
+        # Reserve a slot, preferring backends not in exclude (those already
+        # tried by this call); None if every usable backend is full.
+        now = time.monotonic()
+        usable = [b for b in self.backends if b.usable(now)]
+        if not usable:
+            raise LLMUnavailable("No LLM backend available")
+        free = [b for b in usable if b.outstanding < Config.OLLAMA_BACKEND_CONCURRENCY]
+        if not free:
+            return None
+        backend = min([b for b in free if b not in exclude] or free, key=lambda b: (b.outstanding, random.random()))
+        trial = backend.opened_at is not None
+        if trial:
+            backend.probing = True
+        backend.outstanding += 1
+        backend.requests += 1
+        return backend, trial
+
+    def _check_deadline(self, deadline):
+        if time.monotonic() >= deadline:
+            raise LLMUnavailable(f"No LLM backend slot free after {Config.OLLAMA_QUEUE_TIMEOUT}s")
+
+    def acquire(self, exclude=()):
+        """(backend, trial) for one call; pass both back to release."""
+        deadline = time.monotonic() + Config.OLLAMA_QUEUE_TIMEOUT
+        with self._cond:
+            while True:
+                taken = self._take(exclude)
+                if taken is not None:
+                    return taken
+                self._check_deadline(deadline)
+                # Wake up at least every second to see circuits whose cooldown has passed.
+                self._cond.wait(min(deadline - time.monotonic(), 1.0))
+
+    async def acquire_async(self, exclude=()):
+        loop = asyncio.get_running_loop()
+        deadline = time.monotonic() + Config.OLLAMA_QUEUE_TIMEOUT
+        while True:
+            waiter = (loop, asyncio.Event())
+            with self._cond:
+                taken = self._take(exclude)
+                if taken is not None:
+                    return taken
+                self._check_deadline(deadline)
+                self._waiters.append(waiter)
+            try:
+                await asyncio.wait_for(waiter[1].wait(), min(deadline - time.monotonic(), 1.0))
+            except asyncio.TimeoutError:
+                pass
+            finally:
+                with self._cond:
+                    if waiter in self._waiters:
+                        self._waiters.remove(waiter)
+
+    def release(self, backend, trial, ok):
+        """ok: True on success, False on a backend failure, None if the call says nothing about the backend."""
+        with self._cond:
+            backend.outstanding -= 1
+            if trial:
+                backend.probing = False
+            if ok:
+                backend.failures = 0
+                if backend.opened_at is not None:
+                    log.info("LLM backend %s recovered", backend.url)
+                    backend.opened_at = None
+            elif ok is False:
+                backend.errors += 1
+                backend.failures += 1
+                if trial or backend.opened_at is None and backend.failures >= Config.OLLAMA_BREAKER_THRESHOLD:
+                    log.warning("LLM backend %s failed %d times in a row; out of rotation for %ss",
+                                backend.url, backend.failures, Config.OLLAMA_BREAKER_COOLDOWN)
+                    backend.opened_at = time.monotonic()
+            self._wake()
+
+    def set_healthy(self, backend, healthy):
+        with self._cond:
+            if healthy != backend.healthy:
+                log.log(logging.INFO if healthy else logging.WARNING, "LLM backend %s health check %s",
+                        backend.url, 'passed' if healthy else 'failed')
+                backend.healthy = healthy
+                self._wake()
+
+    def _wake(self):
+        self._cond.notify_all()
+        for loop, event in self._waiters:
+            loop.call_soon_threadsafe(event.set)
+
+    def stats(self):
+        now = time.monotonic()
+        with self._cond:
+            return [{"url": b.url, "outstanding": b.outstanding, "healthy": b.healthy, "circuit": b.circuit(now),
+                     "requests": b.requests, "errors": b.errors} for b in self.backends]
+
+_balancer = None
+_session = None
+_state_pid = None
+_state_lock = threading.Lock()
+
+def _state():
+    global _balancer, _session, _state_pid
+    with _state_lock:
+        if _balancer is None or _state_pid != os.getpid():
+            _session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_connections=len(Config.OLLAMA_ENDPOINTS),
+                                                    pool_maxsize=Config.OLLAMA_MAX_CONNECTIONS)
+            _session.mount('http://', adapter)
+            _session.mount('https://', adapter)
+            _balancer = Balancer(Config.OLLAMA_ENDPOINTS)
+            _state_pid = os.getpid()
+            if Config.OLLAMA_HEALTH_INTERVAL > 0:
+                threading.Thread(target=_check_health, args=(_balancer, _session), name='llm-health',
+                                 daemon=True).start()
+        return _balancer, _session
+
+def balancer():
+    return _state()[0]
+
+def session():
+    return _state()[1]
+
+def reset():
+    """Forget backend state, e.g. after changing Config.OLLAMA_ENDPOINTS."""
+    global _balancer
+    with _state_lock:
+        _balancer = None
+
+def backend_stats():
+    return balancer().stats()
+
+def _check_health(owner, http):
+    while _balancer is owner:
+        time.sleep(Config.OLLAMA_HEALTH_INTERVAL)
+        for backend in owner.backends:
+            try:
+                healthy = http.get(backend.health_url, timeout=Config.OLLAMA_CONNECT_TIMEOUT).status_code == 200
+            except requests.RequestException:
+                healthy = False
+            owner.set_healthy(backend, healthy)
+
+def backoff(attempt):
+    """Seconds to wait before retry number attempt: exponential, jittered so callers spread out."""
+    return Config.OLLAMA_RETRY_BACKOFF * 2 ** (attempt - 1) * random.uniform(0.5, 1.0)
+
+def payload(prompt, stream):
+    return {"model": Config.OLLAMA_MODEL, "prompt": prompt, "stream": stream}
+
+def status_error(status, body):
+    error = BackendError if status in RETRY_STATUSES else LLMError
+    return error(f"LLM backend returned {status}: {body[:200]}")
+
+def _timeout():
+    return (Config.OLLAMA_CONNECT_TIMEOUT, Config.OLLAMA_READ_TIMEOUT)
+
+def parse_chunk(line):
+    """(token, done) from one line of a streamed response."""
+    chunk = json.loads(line)
+    if chunk.get('error'):
+        raise LLMError(chunk['error'])
+    return chunk.get('response') or '', bool(chunk.get('done'))
+
+RETRYABLE = (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError, BackendError)
+
+def generate(prompt):
+    owner = balancer()  # released on the same object even if reset() swaps the balancer mid-call
+    tried = []
+    for attempt in range(Config.OLLAMA_MAX_RETRIES + 1):
+        if attempt:
+            time.sleep(backoff(attempt))
+        with metrics.stage('llm_queue'):
+            backend, trial = owner.acquire(tried)
+        ok = None
+        try:
+            with metrics.stage('llm'):
+                resp = session().post(backend.url, json=payload(prompt, False), timeout=_timeout())
+            if resp.status_code >= 400:
+                raise status_error(resp.status_code, resp.text)
+            response = resp.json().get('response', '')
+            ok = True
+            return response
+        except RETRYABLE as e:
+            ok = False
+            error = e
+            log.warning("LLM call to %s failed (attempt %d): %s", backend.url, attempt + 1, e)
+        finally:
+            owner.release(backend, trial, ok)
+        tried.append(backend)
+    raise LLMError(f"LLM call failed after {Config.OLLAMA_MAX_RETRIES + 1} attempts") from error
+
+def generate_stream(prompt):
+    """Yield response tokens as Ollama generates them.
+
+    The llm stage covers the whole stream, including time the consumer spends between tokens.
+    """
+    owner = balancer()
+    tried = []
+    for attempt in range(Config.OLLAMA_MAX_RETRIES + 1):
+        if attempt:
+            time.sleep(backoff(attempt))
+        with metrics.stage('llm_queue'):
+            backend, trial = owner.acquire(tried)
+        ok = None
+        started = False
+        try:
+            with metrics.stage('llm'), session().post(
+                backend.url, json=payload(prompt, True), stream=True, timeout=_timeout(),
+            ) as resp:
+                if resp.status_code >= 400:
+                    raise status_error(resp.status_code, resp.text)
+                for line in resp.iter_lines():
+                    if not line:
+                        continue
+                    token, done = parse_chunk(line)
+                    if token:
+                        started = True
+                        yield token
+                    if done:
+                        break
+            ok = True
+            return
+        except RETRYABLE as e:
+            ok = False
+            if started:
+                raise LLMError(f"LLM stream from {backend.url} broke off") from e
+            error = e
+            log.warning("LLM stream from %s failed (attempt %d): %s", backend.url, attempt + 1, e)
+        finally:
+            owner.release(backend, trial, ok)
+        tried.append(backend)
+    raise LLMError(f"LLM stream failed after {Config.OLLAMA_MAX_RETRIES + 1} attempts") from error
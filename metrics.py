@@ -0,0 +1,325 @@
+# metrics.py
+# In-process instrumentation. Requests are timed per route, and the work
+# inside them per stage: db_connect (pool checkout), db_query, extraction,
+# llm (and llm_queue, waiting for a backend slot), hashing (bcrypt, file
+# SHA-256) and preview rendering. Gauges count work in flight;
+# /metrics renders everything in the Prometheus text format. Values are
+# per process, like db.pool_stats, so each server process is scraped on its
+# own. Job workers run in separate processes and log a stage breakdown per
+# job instead. /metrics and the /stats/* endpoints answer only requests
+# carrying "Authorization: Bearer <STATS_TOKEN>", and 404 when no token is set.
+#
+# With PROFILE_SLOW_REQUESTS set (sync app only), a sampler thread records
+# the stack of every thread serving a request each PROFILE_INTERVAL seconds.
+# Requests slower than the threshold get their samples written to PROFILE_DIR
+# as collapsed stacks, one "frame;frame;frame count" line each, which
+# flamegraph.pl, inferno and speedscope read directly.
+import contextvars
+import hmac
+import logging
+import os
+import re
+import sys
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter
+from contextlib import contextmanager
+from werkzeug.wsgi import ClosingIterator
+from config import Config
+
+log = logging.getLogger(__name__)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+HELP = {
+    'lucudocs_http_request_duration_seconds': 'Request latency by route, including streamed response bodies.',
+    'lucudocs_stage_duration_seconds': 'Time spent in each stage of request and job handling.',
+    'lucudocs_in_flight': 'Operations in progress in this process.',
+    'lucudocs_db_pool_connections': 'Database pool connections by state.',
+    'lucudocs_db_pool_timeouts_total': 'Pool checkouts that gave up waiting for a connection.',
+    'lucudocs_analysis_cache_events_total': 'Analysis cache lookups and stores by outcome.',
+    'lucudocs_jobs': 'Queued and running jobs in the shared queue, across all worker processes.',
+    'lucudocs_llm_backend_in_flight': 'LLM calls in progress per backend from this process.',
+    'lucudocs_llm_backend_up': '1 while an LLM backend passes health checks and its circuit is closed.',
+    'lucudocs_llm_backend_errors_total': 'Failed LLM calls per backend.',
+}
+
+class Histogram:
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+class Trace:
+    """Timing of one request or job: total time, seconds per stage, and profiler samples."""
+
+    def __init__(self, profile=False):
+        self.start = time.perf_counter()
+        self.route = None
+        self.stages = {}
+        self.samples = Counter() if profile else None
+
+    def elapsed(self):
+        return time.perf_counter() - self.start
+
+_lock = threading.Lock()
+_histograms = {}  # (name, labels) -> Histogram
+_gauges = {}  # (name, labels) -> value
+_current = contextvars.ContextVar('metrics_trace', default=None)
+
+def _labels(labels):
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+def observe(name, seconds, **labels):
+    if not Config.METRICS_ENABLED:
+        return
+    key = (name, _labels(labels))
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = Histogram()
+        histogram.observe(seconds)
+
+def set_gauge(name, value, **labels):
+    with _lock:
+        _gauges[(name, _labels(labels))] = value
+
+def add_gauge(name, delta, **labels):
+    key = (name, _labels(labels))
+    with _lock:
+        _gauges[key] = _gauges.get(key, 0) + delta
+
+def clear_gauge(name):
+    with _lock:
+        for key in [key for key in _gauges if key[0] == name]:
+            del _gauges[key]
+
+def update_gauges(pool, queue, cache_events, backends):
+    """Copy state kept elsewhere (pool stats, job counts, cache counters, LLM backends) into gauges before rendering."""
+    for state in ('in_use', 'idle', 'max_size'):
+        set_gauge('lucudocs_db_pool_connections', pool[state], state=state)
+    if 'timeouts' in pool:
+        set_gauge('lucudocs_db_pool_timeouts_total', pool['timeouts'])
+    clear_gauge('lucudocs_jobs')
+    for (kind, status), count in queue.items():
+        set_gauge('lucudocs_jobs', count, kind=kind, status=status)
+    for event, count in cache_events.items():
+        if event != 'seconds_saved':
+            set_gauge('lucudocs_analysis_cache_events_total', count, event=event)
+    for backend in backends:
+        set_gauge('lucudocs_llm_backend_in_flight', backend['outstanding'], backend=backend['url'])
+        set_gauge('lucudocs_llm_backend_up', int(backend['healthy'] and backend['circuit'] == 'closed'),
+                  backend=backend['url'])
+        set_gauge('lucudocs_llm_backend_errors_total', backend['errors'], backend=backend['url'])
+
+def stats_access(authorization):
+    """None if an Authorization header may read the stats endpoints, else the status code to answer with."""
+    if not Config.STATS_TOKEN:
+        return 404
+    if not hmac.compare_digest((authorization or '').encode(), f'Bearer {Config.STATS_TOKEN}'.encode()):
+        return 401
+    return None
+
+def record_stage(name, seconds):
+    observe('lucudocs_stage_duration_seconds', seconds, stage=name)
+    trace = _current.get()
+    if trace is not None:
+        trace.stages[name] = trace.stages.get(name, 0.0) + seconds
+
+@contextmanager
+def stage(name):
+    """Time the block as one stage of the current request or job."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(name, time.perf_counter() - start)
+
+@contextmanager
+def in_flight(kind):
+    add_gauge('lucudocs_in_flight', 1, kind=kind)
+    try:
+        yield
+    finally:
+        add_gauge('lucudocs_in_flight', -1, kind=kind)
+
+def begin(profile=False):
+    """Start a trace for the current request or job; stages recorded in this context add to it."""
+    trace = Trace(profile and Config.PROFILE_SLOW_REQUESTS > 0)
+    _current.set(trace)
+    if trace.samples is not None:
+        _sampler.add(threading.get_ident(), trace)
+    return trace
+
+def set_route(route):
+    trace = _current.get()
+    if trace is not None:
+        trace.route = route
+
+def finish_request(trace, method, status):
+    elapsed = trace.elapsed()
+    route = trace.route or 'unmatched'
+    observe('lucudocs_http_request_duration_seconds', elapsed, method=method, route=route, status=status)
+    if trace.samples is not None:
+        _sampler.remove(trace)
+        if elapsed >= Config.PROFILE_SLOW_REQUESTS and trace.samples:
+            _dump_profile(trace, method, route, elapsed)
+    return elapsed
+
+def format_stages(stages):
+    return ', '.join(f"{name} {seconds:.3f}s" for name, seconds in sorted(stages.items(), key=lambda s: -s[1]))
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _series(name, labels, extra=()):
+    pairs = [f'{key}="{_escape(value)}"' for key, value in labels + tuple(extra)]
+    return f"{name}{{{','.join(pairs)}}}" if pairs else name
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+def render():
+    """Every histogram and gauge in the Prometheus text exposition format."""
+    with _lock:
+        histograms = [(key, list(h.counts), h.sum, h.count, h.buckets) for key, h in _histograms.items()]
+        gauges = list(_gauges.items())
+    lines = []
+    typed = set()
+
+    def header(name, kind):
+        if name not in typed:
+            typed.add(name)
+            lines.append(f"# HELP {name} {HELP.get(name, name)}")
+            lines.append(f"# TYPE {name} {kind}")
+
+    for (name, labels), counts, total, count, buckets in sorted(histograms):
+        header(name, 'histogram')
+        cumulative = 0
+        for bound, bucket_count in zip(buckets, counts):
+            cumulative += bucket_count
+            lines.append(f"{_series(name + '_bucket', labels, [('le', repr(bound))])} {cumulative}")
+        lines.append(f"{_series(name + '_bucket', labels, [('le', '+Inf')])} {count}")
+        lines.append(f"{_series(name + '_sum', labels)} {total!r}")
+        lines.append(f"{_series(name + '_count', labels)} {count}")
+    for (name, labels), value in sorted(gauges):
+        header(name, 'counter' if name.endswith('_total') else 'gauge')
+        lines.append(f"{_series(name, labels)} {_number(value)}")
+    return '\n'.join(lines) + '\n'
+
+class StackSampler:
+    """Samples the stacks of threads with an active profiled trace."""
+
+    def __init__(self):
+        self._active = {}  # thread id -> Trace
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def add(self, thread_id, trace):
+        with self._lock:
+            self._active[thread_id] = trace
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='metrics-sampler', daemon=True)
+                self._thread.start()
+
+    def remove(self, trace):
+        with self._lock:
+            for thread_id, active in list(self._active.items()):
+                if active is trace:
+                    del self._active[thread_id]
+
+    def _run(self):
+        while True:
+            time.sleep(Config.PROFILE_INTERVAL)
+            with self._lock:
+                active = list(self._active.items())
+            if not active:
+                continue
+            frames = sys._current_frames()
+            for thread_id, trace in active:
+                frame = frames.get(thread_id)
+                if frame is not None:
+                    trace.samples[_fold(frame)] += 1
+
+_sampler = StackSampler()
+
+def _fold(frame):
+    stack = []
+    while frame is not None:
+        code = frame.f_code
+        stack.append(f"{frame.f_globals.get('__name__', '?')}:{code.co_qualname}")
+        frame = frame.f_back
+    return ';'.join(reversed(stack))
+
+def _dump_profile(trace, method, route, elapsed):
+    name = re.sub(r'[^A-Za-z0-9_.-]+', '_', f"{method}{route}").strip('_')
+    path = os.path.join(Config.PROFILE_DIR, f"{time.strftime('%Y%m%d-%H%M%S')}-{int(elapsed * 1000)}ms-{name}.folded")
+    try:
+        os.makedirs(Config.PROFILE_DIR, exist_ok=True)
+        with open(path, 'w') as f:
+            for stack, count in trace.samples.most_common():
+                f.write(f"{stack} {count}\n")
+    except OSError:
+        log.warning("Could not write profile %s", path, exc_info=True)
+        return
+    log.warning("Slow request %s %s took %.3fs (%s); stacks in %s",
+                method, route, elapsed, format_stages(trace.stages) or 'no stages', path)
+
+class WSGIMiddleware:
+    """Times each request until its response body is closed, so streamed bodies count."""
+
+    def __init__(self, app):
+        self.app = app
+
+    def __call__(self, environ, start_response):
+        trace = begin(profile=True)
+        status = []
+
+        def capture(status_line, headers, exc_info=None):
+            status[:] = [status_line.split(' ', 1)[0]]
+            return start_response(status_line, headers, exc_info)
+
+        def finish():
+            finish_request(trace, environ.get('REQUEST_METHOD', ''), status[0] if status else '500')
+            add_gauge('lucudocs_in_flight', -1, kind='requests')
+
+        add_gauge('lucudocs_in_flight', 1, kind='requests')
+        try:
+            body = self.app(environ, capture)
+        except BaseException:
+            finish()
+            raise
+        return ClosingIterator(body, finish)
+
+class ASGIMiddleware:
+    """WSGIMiddleware for ASGI apps; every request shares the event loop thread, so nothing is sampled."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+        trace = begin()
+        status = 500
+
+        async def capture(message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+            await send(message)
+
+        add_gauge('lucudocs_in_flight', 1, kind='requests')
+        try:
+            await self.app(scope, receive, capture)
+        finally:
+            finish_request(trace, scope.get('method', ''), status)
+            add_gauge('lucudocs_in_flight', -1, kind='requests')
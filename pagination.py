@@ -0,0 +1,82 @@
+# pagination.py
+# Keyset (cursor) pagination over a user's documents. Each page continues
+# strictly after the (sort value, id) of the previous page's last row, so
+# every page is an index range scan no matter how deep the client goes.
+import base64
+import datetime
+import json
+import psycopg2.extras
+from config import Config
+from db import get_db
+
+# Sort name: (column of documents, its name in listing rows).
+SORTS = {
+    'uploaded': ('uploaded_at', 'upload_date'),
+    'signed': ('signed_at', 'signed_date'),  # only signed documents have a position in this order
+}
+
+# Slim listing projection over documents d: the analysis and signature live
+# in side tables and are reduced to short previews. Needs LIST_JOINS.
+LIST_COLUMNS = """
+    d.id, d.filename, d.uploaded_at AS upload_date, d.signed_at AS signed_date,
+    a.document_id IS NOT NULL AS analyzed, left(a.analysis, 100) AS analysis_preview,
+    left(s.signature, 64) AS signature_preview
+"""
+
+LIST_JOINS = """
+    LEFT JOIN document_analyses a ON a.document_id = d.id
+    LEFT JOIN document_signatures s ON s.document_id = d.id
+"""
+
+def encode_cursor(sort_value, doc_id):
+    raw = json.dumps([sort_value.isoformat(), doc_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+def decode_cursor(cursor):
+    try:
+        sort_value, doc_id = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        return datetime.datetime.fromisoformat(sort_value), int(doc_id)
+    except (ValueError, TypeError):
+        raise ValueError("Invalid cursor")
+
+def parse_limit(value):
+    if value in (None, ''):
+        return Config.PAGE_SIZE
+    return max(1, min(int(value), Config.MAX_PAGE_SIZE))
+
+def listing_query(user_id, sort='uploaded', cursor=None, limit=None):
+    """(sql, params, limit) for one page; the query fetches one row more than limit to detect a next page."""
+    if sort not in SORTS:
+        raise ValueError(f"Unknown sort: {sort}")
+    column = SORTS[sort][0]
+    limit = limit or Config.PAGE_SIZE
+    where = ["d.user_id = %s"]
+    params = [user_id]
+    if sort == 'signed':
+        where.append("d.signed_at IS NOT NULL")
+    if cursor:
+        where.append(f"(d.{column}, d.id) < (%s, %s)")
+        params.extend(decode_cursor(cursor))
+    params.append(limit + 1)
+    return f"""
+        SELECT {LIST_COLUMNS} FROM documents d {LIST_JOINS}
+        WHERE {' AND '.join(where)}
+        ORDER BY d.{column} DESC, d.id DESC
+        LIMIT %s
+    """, params, limit
+
+def page(rows, sort, limit):
+    """(rows, next_cursor) from the rows of a listing_query; next_cursor is None on the last page."""
+    rows = [dict(row) for row in rows]
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, encode_cursor(rows[-1][SORTS[sort][1]], rows[-1]['id'])
+
+def list_documents(conn_str, user_id, sort='uploaded', cursor=None, limit=None):
+    """Return (rows, next_cursor) for one page; next_cursor is None on the last page."""
+    query, params, limit = listing_query(user_id, sort, cursor, limit)
+    with get_db(conn_str) as conn:
+        cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+        cur.execute(query, params)
+        return page(cur.fetchall(), sort, limit)
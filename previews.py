@@ -0,0 +1,195 @@
+# previews.py
+# Rendered page images, so the dashboard and document view can show a
+# document without downloading the PDF. A first-page thumbnail and
+# low-resolution page images are rendered with pypdfium2 and Pillow. This
+# normally happens in a 'preview' job queued at upload; anything missing is
+# rendered on first request. pdfium calls share extraction's PDFIUM_LOCK,
+# since pdfium is not thread-safe and requests render on their own threads.
+#
+# Images are kept under PREVIEW_DIR/ab/<key>/, where key is the content hash
+# (doc-<id> for files stored before content addressing). The directory is an
+# LRU cache bounded by PREVIEW_CACHE_MAX_BYTES: hits refresh a file's mtime,
+# and a sweep removes the least recently used files once the total outgrows
+# the bound.
+import os
+import shutil
+import threading
+import time
+import uuid
+from config import Config
+from extraction import PDFIUM_LOCK
+import metrics
+
+try:
+    import pypdfium2 as pdfium
+    from PIL import Image
+except ImportError:
+    pdfium = Image = None
+
+THUMBNAIL = 'thumb'
+MIMETYPES = {'webp': 'image/webp', 'jpeg': 'image/jpeg', 'png': 'image/png'}
+TOUCH_INTERVAL = 3600  # seconds; mtimes are refreshed at most this often
+
+class PreviewError(Exception):
+    pass
+
+def available():
+    return pdfium is not None
+
+def preview_key(document_id, content_hash):
+    return content_hash or f"doc-{document_id}"
+
+def mimetype():
+    return MIMETYPES[Config.PREVIEW_FORMAT]
+
+def _directory(key):
+    return os.path.join(Config.PREVIEW_DIR, key[:2], key)
+
+def image_path(key, name):
+    return os.path.join(_directory(key), f"{name}.{Config.PREVIEW_FORMAT}")
+
+def page_name(page_no):
+    """File name of the 1-based page_no."""
+    return f"page-{page_no:04d}"
+
+def _open(path):
+    try:
+        with PDFIUM_LOCK:
+            return pdfium.PdfDocument(path)
+    except Exception as e:
+        raise PreviewError(f"Failed to open {path}") from e
+
+def page_count(path):
+    pdf = _open(path)
+    with PDFIUM_LOCK:
+        try:
+            return len(pdf)
+        finally:
+            pdf.close()
+
+def _render_page(pdf, index, width):
+    with PDFIUM_LOCK:
+        page = pdf[index]
+        try:
+            page_width, page_height = page.get_size()
+            # Very tall pages are capped at twice the target width in height.
+            scale = min(width / page_width, 2 * width / page_height)
+            bitmap = page.render(scale=scale)
+            try:
+                # A copy, so the bitmap is freed here rather than by a finalizer outside the lock.
+                return bitmap.to_pil().copy()
+            finally:
+                bitmap.close()
+        finally:
+            page.close()
+
+def _save(image, path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    try:
+        image.convert('RGB').save(temp_path, format=Config.PREVIEW_FORMAT.upper(), quality=Config.PREVIEW_QUALITY)
+        os.replace(temp_path, path)
+    except BaseException:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        raise
+    _account(os.path.getsize(path))
+
+def render(path, key, names):
+    """Render the named images (THUMBNAIL, page_name(n)) that are not cached yet; returns how many were written."""
+    missing = [name for name in names if not os.path.exists(image_path(key, name))]
+    if not missing:
+        return 0
+    with metrics.stage('preview'):
+        pdf = _open(path)
+        try:
+            with PDFIUM_LOCK:
+                count = len(pdf)
+            written = 0
+            for name in missing:
+                if name == THUMBNAIL:
+                    index, width = 0, Config.PREVIEW_THUMB_WIDTH
+                else:
+                    index, width = int(name.split('-')[1]) - 1, Config.PREVIEW_PAGE_WIDTH
+                if not 0 <= index < count:
+                    continue
+                try:
+                    image = _render_page(pdf, index, width)
+                except Exception as e:
+                    raise PreviewError(f"Failed to render page {index + 1} of {path}") from e
+                _save(image, image_path(key, name))
+                written += 1
+            return written
+        finally:
+            with PDFIUM_LOCK:
+                pdf.close()
+
+def render_document(path, key, pages=None):
+    """The upload-time set: the thumbnail and the first PREVIEW_PAGES pages."""
+    pages = Config.PREVIEW_PAGES if pages is None else pages
+    return render(path, key, [THUMBNAIL] + [page_name(n) for n in range(1, pages + 1)])
+
+def get(path, key, name):
+    """Path of a cached image, rendering it first if needed; None if the page does not exist."""
+    target = image_path(key, name)
+    try:
+        if time.time() - os.stat(target).st_mtime > TOUCH_INTERVAL:
+            os.utime(target)
+        return target
+    except FileNotFoundError:
+        pass
+    render(path, key, [name])
+    return target if os.path.exists(target) else None
+
+def remove(key):
+    shutil.rmtree(_directory(key), ignore_errors=True)
+
+_written = 0
+_written_lock = threading.Lock()
+
+def _account(size):
+    # Sweep after every twentieth of the bound written by this process.
+    global _written
+    with _written_lock:
+        _written += size
+        due = _written >= Config.PREVIEW_CACHE_MAX_BYTES // 20
+        if due:
+            _written = 0
+    if due:
+        sweep()
+
+def sweep(max_bytes=None):
+    """Remove the least recently used images until the cache is at 90% of its bound; returns bytes freed."""
+    max_bytes = Config.PREVIEW_CACHE_MAX_BYTES if max_bytes is None else max_bytes
+    entries = []
+    total = 0
+    for root, _, files in os.walk(Config.PREVIEW_DIR):
+        for name in files:
+            if name.endswith('.tmp'):
+                continue  # being written
+            path = os.path.join(root, name)
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+            total += st.st_size
+    if total <= max_bytes:
+        return 0
+    freed = 0
+    entries.sort()
+    for _, size, path in entries:
+        if total - freed <= max_bytes * 0.9:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            continue
+        freed += size
+        try:
+            os.rmdir(os.path.dirname(path))  # only succeeds once the document has no images left
+        except OSError:
+            pass
+    return freed
@@ -0,0 +1,78 @@
+# search.py
+# Full-text search over filenames, extracted text and analyses.
+# documents.search_vector (GIN-indexed) is rebuilt for one row whenever one of
+# its inputs changes: filename (weight A), analysis (B) and the extracted text
+# vector kept in document_text.content_tsv (C).
+import psycopg2.extras
+from config import Config
+from db import get_db
+from pagination import LIST_COLUMNS, LIST_JOINS
+
+DOCUMENT_VECTOR = """
+    setweight(to_tsvector('simple', regexp_replace(coalesce(d.filename, ''), '[_.-]+', ' ', 'g')), 'A') ||
+    setweight(to_tsvector('english', coalesce((SELECT a.analysis FROM document_analyses a
+                                               WHERE a.document_id = d.id), '')), 'B') ||
+    coalesce((SELECT t.content_tsv FROM document_text t WHERE t.document_id = d.id), ''::tsvector)
+"""
+
+# Vector for extracted text; parameters are (text, Config.SEARCH_MAX_CHARS).
+CONTENT_VECTOR = "setweight(to_tsvector('english', left(%s, %s)), 'C')"
+
+# Stemmed and unstemmed forms, so filename tokens match as typed.
+QUERY = "(websearch_to_tsquery('simple', %(q)s) || websearch_to_tsquery('english', %(q)s))"
+
+# Rebuilds one document's vector; the parameter is its id.
+REFRESH_VECTOR_SQL = f"UPDATE documents d SET search_vector = {DOCUMENT_VECTOR} WHERE d.id = %s"
+
+def refresh_vector(cur, document_id):
+    """Rebuild one document's search vector inside the caller's transaction."""
+    cur.execute(REFRESH_VECTOR_SQL, (document_id,))
+
+def refresh_vectors(cur, document_ids):
+    cur.execute(f"UPDATE documents d SET search_vector = {DOCUMENT_VECTOR} WHERE d.id = ANY(%s)", (list(document_ids),))
+
+def backfill(conn_str, batch_size=1000):
+    """Index documents that predate search, a batch per transaction."""
+    while True:
+        with get_db(conn_str) as conn:
+            cur = conn.cursor()
+            cur.execute(f"""
+                UPDATE documents d SET search_vector = {DOCUMENT_VECTOR}
+                WHERE d.id IN (SELECT id FROM documents WHERE search_vector IS NULL LIMIT %s)
+            """, (batch_size,))
+            if cur.rowcount < batch_size:
+                return
+
+def search_documents(conn_str, user_id, q, limit=None, offset=0):
+    """Return (rows, next_offset) ranked by relevance; next_offset is None on the last page.
+
+    Ranking reads every candidate's vector, so for very common terms only the
+    newest SEARCH_MAX_CANDIDATES matches are ranked.
+    """
+    limit = limit or Config.PAGE_SIZE
+    with get_db(conn_str) as conn:
+        cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+        cur.execute(f"""
+            SELECT {LIST_COLUMNS}, d.rank,
+                   ts_headline('english', coalesce(a.analysis, ''), {QUERY}, 'MaxFragments=1, MaxWords=20, StartSel="", StopSel=""') AS headline
+            FROM (
+                SELECT id, filename, uploaded_at, signed_at, ts_rank(search_vector, {QUERY}) AS rank
+                FROM documents
+                WHERE id IN (
+                    SELECT id FROM documents
+                    WHERE user_id = %(user_id)s AND search_vector @@ {QUERY}
+                    ORDER BY id DESC
+                    LIMIT %(candidates)s
+                )
+                ORDER BY rank DESC, id DESC
+                LIMIT %(limit)s OFFSET %(offset)s
+            ) AS d {LIST_JOINS}
+            ORDER BY d.rank DESC, d.id DESC
+        """, {"q": q, "user_id": user_id, "limit": limit + 1, "offset": offset,
+              "candidates": Config.SEARCH_MAX_CANDIDATES})
+        rows = cur.fetchall()
+    next_offset = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_offset = offset + limit
+    return rows, next_offset
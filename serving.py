@@ -0,0 +1,66 @@
+# serving.py
+# Sends stored PDFs with conditional and Range support, so PDF viewers can
+# load documents incrementally and a browser revalidating a file it already
+# has gets a 304. Content-addressed files use their SHA-256 as a strong ETag.
+# With FILE_SERVE_ACCEL the body is left to the front-end proxy:
+#   'x-accel'     nginx; FILE_ACCEL_PREFIX is an internal location aliased to UPLOADS_DIR
+#   'x-sendfile'  Apache mod_xsendfile, lighttpd
+import os
+from urllib.parse import quote
+from flask import abort, request
+from werkzeug.utils import send_file
+from config import Config
+import previews
+from storage import document_path
+
+def send_preview(doc, name):
+    """Response with a rendered preview image (previews.THUMBNAIL or previews.page_name(n)) of a documents row."""
+    if not previews.available():
+        abort(404)
+    source = document_path(doc['filename'], doc['content_hash'])
+    try:
+        path = previews.get(source, previews.preview_key(doc['id'], doc['content_hash']), name)
+    except (OSError, previews.PreviewError):
+        path = None
+    if path is None:
+        abort(404)
+    try:
+        response = send_file(path, request.environ, mimetype=previews.mimetype(), etag=True,
+                             max_age=Config.PREVIEW_MAX_AGE)
+    except FileNotFoundError:
+        abort(404)  # evicted in the meantime
+    # The image of a document id never changes, so browsers need not revalidate.
+    response.cache_control.public = False
+    response.cache_control.private = True
+    response.cache_control.immutable = True
+    return response
+
+def send_document(doc, as_attachment=False):
+    """Response for a documents row with filename and content_hash."""
+    path = os.path.abspath(document_path(doc['filename'], doc['content_hash']))
+    accel = Config.FILE_SERVE_ACCEL
+    try:
+        response = send_file(
+            path, request.environ, mimetype='application/pdf', as_attachment=as_attachment,
+            download_name=doc['filename'], etag=doc['content_hash'] or True,
+            conditional=not accel, use_x_sendfile=bool(accel),
+        )
+    except FileNotFoundError:
+        abort(404)
+    response.cache_control.private = True
+    if not accel:
+        # werkzeug only sets this on 206s; viewers look for it on the first 200 before asking for ranges.
+        response.accept_ranges = 'bytes'
+        return response
+    # The proxy answers Range requests itself; revalidation is still answered here.
+    response = response.make_conditional(request.environ)
+    sendfile = response.headers.pop('X-Sendfile', None)
+    if response.status_code == 304:
+        return response
+    response.headers.pop('Content-Length', None)  # the body comes from the proxy
+    if accel == 'x-accel':
+        relative = os.path.relpath(path, os.path.abspath(Config.UPLOADS_DIR)).replace(os.sep, '/')
+        response.headers['X-Accel-Redirect'] = Config.FILE_ACCEL_PREFIX.rstrip('/') + '/' + quote(relative)
+    else:
+        response.headers['X-Sendfile'] = sendfile
+    return response
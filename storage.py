@@ -0,0 +1,152 @@
+# storage.py
+# Content-addressed PDF storage. Uploads are streamed to a temporary file in
+# UPLOADS_DIR/partial while their SHA-256 is computed, then moved to
+# UPLOADS_DIR/objects/ab/cd/<sha256>. Identical content is stored once and
+# shared by every document row with that content_hash; the object and its
+# rendered previews are removed together with its last reference.
+import hashlib
+import os
+import uuid
+import psycopg2.extras
+from werkzeug.utils import secure_filename
+from config import Config
+from db import get_db
+import previews
+import search
+
+DEFAULT_FILENAME = 'document.pdf'
+
+# One of a user's documents; parameters are (document_id, user_id).
+DOCUMENT_SQL = "SELECT id, filename, content_hash FROM documents WHERE id = %s AND user_id = %s"
+
+class UploadTooLarge(Exception):
+    pass
+
+def safe_filename(name):
+    """secure_filename, or DEFAULT_FILENAME when nothing of the name itself survives (e.g. all non-ASCII)."""
+    if not name:
+        return ''
+    # Checked on the stem: secure_filename('счёт.pdf') is 'pdf'.
+    if not secure_filename(os.path.splitext(name)[0]):
+        return DEFAULT_FILENAME
+    return secure_filename(name)
+
+def object_path(content_hash):
+    return os.path.join(Config.UPLOADS_DIR, 'objects', content_hash[:2], content_hash[2:4], content_hash)
+
+def partial_path(name):
+    return os.path.join(Config.UPLOADS_DIR, 'partial', name)
+
+def document_path(filename, content_hash=None):
+    """Path of a document's PDF; rows from before content addressing live at UPLOADS_DIR/filename."""
+    if content_hash:
+        return object_path(content_hash)
+    return os.path.join(Config.UPLOADS_DIR, filename)
+
+def remove_file(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass  # already gone, or not ours to delete; the row is what matters
+
+def copy_stream(stream, f, digest=None, limit=None):
+    """Copy stream into the open file f block by block, returning the bytes written."""
+    written = 0
+    while True:
+        block = stream.read(Config.UPLOAD_BLOCK_SIZE)
+        if not block:
+            return written
+        written += len(block)
+        if limit is not None and written > limit:
+            raise UploadTooLarge("Upload exceeds the allowed size")
+        f.write(block)
+        if digest is not None:
+            digest.update(block)
+
+def receive(stream):
+    """Stream an upload to a temporary file; returns (temp_path, sha256, size)."""
+    path = partial_path(uuid.uuid4().hex)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    digest = hashlib.sha256()
+    try:
+        with open(path, 'wb') as f:
+            size = copy_stream(stream, f, digest, Config.UPLOAD_MAX_SIZE)
+    except BaseException:
+        remove_file(path)
+        raise
+    return path, digest.hexdigest(), size
+
+def _lock_content(cur, content_hashes):
+    # Serializes placing and releasing objects across processes until the
+    # transaction ends; sorted so concurrent batches cannot deadlock.
+    for content_hash in sorted(set(content_hashes)):
+        cur.execute("SELECT pg_advisory_xact_lock(hashtext(%s))", (content_hash,))
+
+def create_documents(conn_str, user_id, received):
+    """Move received files into the object store and insert their rows in one transaction.
+
+    received holds (filename, temp_path, content_hash, size) tuples; returns
+    (id, path) pairs in the same order. The temporary files are consumed
+    either way. Content that is already stored is simply referenced again.
+    """
+    placed = []
+    try:
+        with get_db(conn_str) as conn:
+            cur = conn.cursor()
+            _lock_content(cur, [item[2] for item in received])
+            try:
+                for _, temp_path, content_hash, _ in received:
+                    path = object_path(content_hash)
+                    if not os.path.exists(path):
+                        os.makedirs(os.path.dirname(path), exist_ok=True)
+                        os.replace(temp_path, path)
+                        placed.append(path)
+                rows = psycopg2.extras.execute_values(cur, """
+                    INSERT INTO documents (user_id, filename, content_hash, size) VALUES %s RETURNING id
+                """, [(user_id, filename, content_hash, size)
+                      for filename, _, content_hash, size in received], fetch=True)
+                ids = [row[0] for row in rows]
+                search.refresh_vectors(cur, ids)
+            except Exception:
+                for path in placed:
+                    remove_file(path)
+                raise
+    finally:
+        for item in received:
+            remove_file(item[1])
+    return [(doc_id, object_path(item[2])) for doc_id, item in zip(ids, received)]
+
+def create_document(conn_str, user_id, filename, temp_path, content_hash, size):
+    """Single-file create_documents; returns (id, path)."""
+    return create_documents(conn_str, user_id, [(filename, temp_path, content_hash, size)])[0]
+
+def delete_documents(conn_str, document_ids, user_id):
+    """Delete the user's documents among document_ids, and every file no longer referenced.
+
+    Returns the set of ids that were deleted.
+    """
+    with get_db(conn_str) as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT id, filename, content_hash FROM documents WHERE id = ANY(%s) AND user_id = %s",
+                    (list(document_ids), user_id))
+        rows = cur.fetchall()
+        if not rows:
+            return set()
+        hashes = {content_hash for _, _, content_hash in rows if content_hash}
+        _lock_content(cur, hashes)
+        cur.execute("DELETE FROM documents WHERE id = ANY(%s) AND user_id = %s RETURNING id",
+                    ([row[0] for row in rows], user_id))
+        deleted = {row[0] for row in cur.fetchall()}
+        cur.execute("SELECT DISTINCT content_hash FROM documents WHERE content_hash = ANY(%s)", (list(hashes),))
+        for content_hash in hashes - {row[0] for row in cur.fetchall()}:
+            remove_file(object_path(content_hash))
+            previews.remove(content_hash)
+        for doc_id, filename, content_hash in rows:
+            if not content_hash and doc_id in deleted:
+                remove_file(document_path(filename))
+                previews.remove(previews.preview_key(doc_id, None))
+    return deleted
+
+def delete_document(conn_str, document_id, user_id):
+    """Delete one document, and its file if nothing else references it. Returns False if not found."""
+    return bool(delete_documents(conn_str, [document_id], user_id))
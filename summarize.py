@@ -0,0 +1,92 @@
+# summarize.py
+# Map-reduce summarization: text that does not fit one prompt is split into
+# token-bounded chunks, the chunks are summarized concurrently, and the chunk
+# summaries are reduced into the final analysis. Chunk summaries are cached,
+# so a retried job only reruns the chunks that failed.
+import hashlib
+import time
+from concurrent.futures import ThreadPoolExecutor
+from config import Config
+import cache
+import llm
+
+def estimate_tokens(word):
+    # Rough BPE estimate: about four characters per token.
+    return len(word) // 4 + 1
+
+def split_chunks(text, max_tokens):
+    chunks = []
+    words = []
+    tokens = 0
+    for word in text.split():
+        cost = estimate_tokens(word)
+        if words and tokens + cost > max_tokens:
+            chunks.append(' '.join(words))
+            words = []
+            tokens = 0
+        words.append(word)
+        tokens += cost
+    if words:
+        chunks.append(' '.join(words))
+    return chunks
+
+def build_prompt(text):
+    return Config.ANALYSIS_PROMPT.format(text=text)
+
+def chunk_prompt(chunk):
+    return Config.SUMMARY_CHUNK_PROMPT.format(text=chunk)
+
+def chunk_cache_key(chunk):
+    return cache.make_key('chunk', hashlib.sha256(chunk.encode()).hexdigest(),
+                          Config.OLLAMA_MODEL, Config.SUMMARY_CHUNK_PROMPT)
+
+def _summarize_chunk(conn_str, chunk):
+    prompt = chunk_prompt(chunk)
+    if conn_str is None:
+        return llm.generate(prompt)
+    key = chunk_cache_key(chunk)
+    summary = cache.get(conn_str, key)
+    if summary is None:
+        start = time.monotonic()
+        summary = llm.generate(prompt)
+        cache.put(conn_str, key, summary, time.monotonic() - start)
+    return summary
+
+def map_chunks(conn_str, chunks, parallelism=None):
+    """Summarize chunks concurrently; raises the first failure after every chunk has finished."""
+    parallelism = parallelism or Config.SUMMARY_PARALLELISM
+    with ThreadPoolExecutor(max_workers=min(parallelism, len(chunks))) as executor:
+        futures = [executor.submit(_summarize_chunk, conn_str, chunk) for chunk in chunks]
+        errors = [f.exception() for f in futures if f.exception() is not None]
+        if errors:
+            raise errors[0]
+        return [f.result() for f in futures]
+
+def plan_prompt(text):
+    """The map-reduce as a generator, so sync and async callers share it: it yields lists of chunks,
+    is sent their summaries, and returns the final prompt (StopIteration.value)."""
+    max_tokens = Config.SUMMARY_CHUNK_TOKENS
+    chunks = split_chunks(text, max_tokens)
+    if len(chunks) <= 1:
+        return build_prompt(text)
+    for _ in range(Config.SUMMARY_MAX_LEVELS):
+        joined = '\n\n'.join((yield chunks))
+        chunks = split_chunks(joined, max_tokens)
+        if len(chunks) <= 1:
+            break
+    else:
+        joined = ' '.join(joined.split()[:max_tokens])
+    return Config.SUMMARY_REDUCE_PROMPT.format(summaries=joined)
+
+def prepare_prompt(text, conn_str=None, parallelism=None):
+    """Return the final prompt for text, running the map phase first when it is too long for one call."""
+    plan = plan_prompt(text)
+    summaries = None
+    try:
+        while True:
+            summaries = map_chunks(conn_str, plan.send(summaries), parallelism)
+    except StopIteration as done:
+        return done.value
+
+def summarize(text, conn_str=None, parallelism=None):
+    return llm.generate(prepare_prompt(text, conn_str, parallelism))
@@ -0,0 +1,118 @@
+# textstore.py
+# Extracted PDF text, computed once per document and kept zlib-compressed
+# per page, so analysis and previews never have to reparse the PDF.
+import zlib
+import psycopg2.extras
+from config import Config
+from db import get_db
+import search
+from extraction import extract_pages
+
+def store_pages(conn_str, document_id, pages):
+    rows = [(document_id, page_no, zlib.compress(text.encode())) for page_no, text in enumerate(pages)]
+    byte_size = sum(len(row[2]) for row in rows)
+    char_count = sum(len(text) for text in pages)
+    with get_db(conn_str) as conn:
+        cur = conn.cursor()
+        cur.execute(f"""
+            INSERT INTO document_text (document_id, page_count, char_count, byte_size, content_tsv)
+            VALUES (%s, %s, %s, %s, {search.CONTENT_VECTOR})
+            ON CONFLICT (document_id) DO UPDATE
+            SET page_count = EXCLUDED.page_count, char_count = EXCLUDED.char_count,
+                byte_size = EXCLUDED.byte_size, content_tsv = EXCLUDED.content_tsv, extracted_at = now()
+        """, (document_id, len(pages), char_count, byte_size, ' '.join(pages), Config.SEARCH_MAX_CHARS))
+        cur.execute("DELETE FROM document_pages WHERE document_id = %s", (document_id,))
+        psycopg2.extras.execute_values(
+            cur, "INSERT INTO document_pages (document_id, page_no, content) VALUES %s", rows)
+        search.refresh_vector(cur, document_id)
+
+def extract_and_store(conn_str, document_id, path):
+    pages = extract_pages(path)
+    store_pages(conn_str, document_id, pages)
+    return pages
+
+def text_info(conn_str, document_id):
+    with get_db(conn_str) as conn:
+        cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+        cur.execute(
+            "SELECT page_count, char_count, byte_size, extracted_at FROM document_text WHERE document_id = %s",
+            (document_id,))
+        return cur.fetchone()
+
+PAGE_COUNT_SQL = "SELECT page_count FROM document_text WHERE document_id = %s"
+
+# Parameters are (document_id, start, stop, stop); stop may be None.
+PAGES_SQL = """
+    SELECT content FROM document_pages
+    WHERE document_id = %s AND page_no >= %s AND (%s::int IS NULL OR page_no < %s)
+    ORDER BY page_no
+"""
+
+# (page_count, content) rows; a single row with a NULL content for a document
+# without pages, none for one never extracted. The parameter is document_id.
+TEXT_SQL = """
+    SELECT t.page_count, p.content FROM document_text t
+    LEFT JOIN document_pages p ON p.document_id = t.document_id
+    WHERE t.document_id = %s ORDER BY p.page_no
+"""
+
+def decompress(content):
+    return zlib.decompress(bytes(content)).decode()
+
+class TextBuilder:
+    """Joins the contents of TEXT_SQL rows like extraction.extract_all, up to max_chars."""
+
+    def __init__(self, max_chars=None):
+        self.max_chars = max_chars
+        self.found = False
+        self._parts = []
+        self._length = 0
+
+    def add(self, content):
+        """Take one row's content; returns False once no more rows are needed."""
+        self.found = True
+        if content is None:
+            return False
+        text = decompress(content)
+        self._parts.append(text)
+        self._length += len(text) + 1
+        return self.max_chars is None or self._length < self.max_chars
+
+    def text(self):
+        """The joined text, or None if no row was added (the document was never extracted)."""
+        if not self.found:
+            return None
+        text = ' '.join(self._parts)
+        return text if self.max_chars is None else text[:self.max_chars]
+
+def load_pages(conn_str, document_id, start=0, stop=None):
+    """Return stored page texts in [start, stop), or None if the document was never extracted."""
+    with get_db(conn_str) as conn:
+        cur = conn.cursor()
+        cur.execute(PAGE_COUNT_SQL, (document_id,))
+        if cur.fetchone() is None:
+            return None
+        cur.execute(PAGES_SQL, (document_id, start, stop, stop))
+        return [decompress(row[0]) for row in cur.fetchall()]
+
+def load_text(conn_str, document_id, max_chars=None):
+    """Return the stored text joined like extraction.extract_all, or None if not extracted."""
+    builder = TextBuilder(max_chars)
+    with get_db(conn_str) as conn:
+        cur = conn.cursor(name='document_pages')  # server-side, so we can stop early
+        cur.itersize = 16
+        cur.execute(TEXT_SQL, (document_id,))
+        for _, content in cur:
+            if not builder.add(content):
+                break
+        cur.close()
+    return builder.text()
+
+def get_text(conn_str, document_id, path, max_chars=None):
+    """Stored text for the document, extracting and storing it first if needed."""
+    text = load_text(conn_str, document_id, max_chars)
+    if text is None:
+        text = ' '.join(extract_and_store(conn_str, document_id, path))
+        if max_chars is not None:
+            text = text[:max_chars]
+    return text
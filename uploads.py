@@ -0,0 +1,153 @@
+# uploads.py
+# Resumable chunked uploads. A client opens a session with the file's name and
+# total size, sends the bytes in any number of chunks (each starting at the
+# offset the server reports) and completes the session once everything has
+# arrived. Chunks are appended to UPLOADS_DIR/partial/<session id> as they are
+# read from the request, so an interrupted upload resumes where it stopped.
+import fcntl
+import hashlib
+import os
+import threading
+import uuid
+import psycopg2.extras
+from config import Config
+from db import get_db
+import cache
+import storage
+
+class UploadError(Exception):
+    def __init__(self, message, status=400, offset=None):
+        super().__init__(message)
+        self.status = status
+        self.offset = offset
+
+# Running SHA-256 per session: session id -> (offset, digest). A session whose
+# chunks arrive at another process (or after a restart) is hashed from disk
+# on completion instead.
+_digests = {}
+_digests_lock = threading.Lock()
+
+def _offset(session_id):
+    try:
+        return os.path.getsize(storage.partial_path(session_id))
+    except FileNotFoundError:
+        return 0
+
+def _describe(session):
+    return {"upload_id": session['id'], "filename": session['filename'],
+            "size": session['size'], "offset": _offset(session['id'])}
+
+def _open_locked(session_id):
+    f = open(storage.partial_path(session_id), 'ab')
+    try:
+        fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        f.close()
+        raise UploadError("Another request is writing to this upload", 409)
+    return f
+
+def expire_sessions(conn_str):
+    with get_db(conn_str) as conn:
+        cur = conn.cursor()
+        cur.execute("DELETE FROM upload_sessions WHERE updated_at < now() - make_interval(secs => %s) RETURNING id",
+                    (Config.UPLOAD_SESSION_TTL,))
+        expired = [row[0] for row in cur.fetchall()]
+    for session_id in expired:
+        _forget(session_id)
+
+def _forget(session_id):
+    with _digests_lock:
+        _digests.pop(session_id, None)
+    storage.remove_file(storage.partial_path(session_id))
+
+def create_session(conn_str, user_id, filename, size, sha256=None):
+    if not filename:
+        raise UploadError("Filename required")
+    if not isinstance(size, int) or size <= 0:
+        raise UploadError("Size must be a positive integer")
+    if size > Config.UPLOAD_MAX_SIZE:
+        raise UploadError("Upload exceeds the allowed size", 413)
+    expire_sessions(conn_str)
+    session_id = uuid.uuid4().hex
+    os.makedirs(os.path.dirname(storage.partial_path(session_id)), exist_ok=True)
+    open(storage.partial_path(session_id), 'wb').close()
+    with get_db(conn_str) as conn:
+        cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+        cur.execute("""
+            INSERT INTO upload_sessions (id, user_id, filename, size, sha256) VALUES (%s, %s, %s, %s, %s)
+            RETURNING id, filename, size
+        """, (session_id, user_id, filename, size, sha256.lower() if sha256 else None))
+        session = cur.fetchone()
+    return _describe(session)
+
+def _get(conn_str, session_id, user_id, touch=False):
+    with get_db(conn_str) as conn:
+        cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+        if touch:
+            cur.execute("""
+                UPDATE upload_sessions SET updated_at = now() WHERE id = %s AND user_id = %s
+                RETURNING id, filename, size, sha256
+            """, (session_id, user_id))
+        else:
+            cur.execute("SELECT id, filename, size, sha256 FROM upload_sessions WHERE id = %s AND user_id = %s",
+                        (session_id, user_id))
+        session = cur.fetchone()
+    if session is None:
+        raise UploadError("Upload not found", 404)
+    return session
+
+def get_session(conn_str, session_id, user_id):
+    return _describe(_get(conn_str, session_id, user_id))
+
+def append_chunk(conn_str, session_id, user_id, offset, stream):
+    """Append the bytes in stream at offset, which must equal the bytes received so far. Returns the new offset."""
+    session = _get(conn_str, session_id, user_id, touch=True)
+    with _open_locked(session_id) as f:
+        current = f.tell()
+        if offset != current:
+            raise UploadError("Offset does not match the bytes received", 409, current)
+        with _digests_lock:
+            at, digest = _digests.pop(session_id, (0, hashlib.sha256() if current == 0 else None))
+        if at != current:
+            digest = None
+        try:
+            storage.copy_stream(stream, f, digest, session['size'] - current)
+        except storage.UploadTooLarge:
+            f.truncate(current)
+            raise UploadError("Chunk extends past the declared size", 413, current)
+        # On any other error the bytes that did arrive are kept, so a dropped
+        # connection resumes from there; the session is then hashed from disk.
+        f.flush()
+        end = f.tell()
+    if digest is not None:
+        with _digests_lock:
+            _digests[session_id] = (end, digest)
+    return end
+
+def complete(conn_str, session_id, user_id):
+    """Turn a fully received session into a document; returns (document id, filename, path)."""
+    session = _get(conn_str, session_id, user_id)
+    with _open_locked(session_id) as f:
+        received = f.tell()
+        if received != session['size']:
+            raise UploadError("Upload is incomplete", 409, received)
+        with _digests_lock:
+            at, digest = _digests.pop(session_id, (None, None))
+        path = storage.partial_path(session_id)
+        content_hash = digest.hexdigest() if at == received else cache.file_sha256(path)
+        if session['sha256'] and session['sha256'] != content_hash:
+            cancel(conn_str, session_id, user_id)
+            raise UploadError("Checksum mismatch", 422)
+        doc_id, path = storage.create_document(
+            conn_str, user_id, session['filename'], path, content_hash, received)
+    cancel(conn_str, session_id, user_id)
+    return doc_id, session['filename'], path
+
+def cancel(conn_str, session_id, user_id):
+    with get_db(conn_str) as conn:
+        cur = conn.cursor()
+        cur.execute("DELETE FROM upload_sessions WHERE id = %s AND user_id = %s", (session_id, user_id))
+        found = cur.rowcount > 0
+    if found:
+        _forget(session_id)
+    return found
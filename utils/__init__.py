@@ -1 +1,3 @@
-from .auth import *
\ No newline at end of file
+from .auth import *
+from .passwords import *
+from .streaming import *
\ No newline at end of file
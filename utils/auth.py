@@ -1,8 +1,113 @@
 # utils/auth.py
+import datetime
+import hashlib
+import threading
+import time
+import uuid
 from functools import wraps
 from flask import request, jsonify
 import jwt
+import psycopg2.extras
+from cache import LRUCache
 from config import Config
+from db import get_db
+
+# Verified token payloads and user rows (id and username only, never the
+# password hash), so chatty API clients skip jwt.decode and the users query.
+# Token entries never outlive the token's own exp.
+_tokens = LRUCache(Config.AUTH_CACHE_SIZE, Config.AUTH_CACHE_TTL)
+_users = LRUCache(Config.AUTH_CACHE_SIZE, Config.AUTH_CACHE_TTL)
+
+# Revoked token ids -> expiry (unix time). Revocations made by other processes
+# are picked up from the revoked_tokens table every AUTH_REVOCATION_REFRESH seconds.
+_revoked = {}
+_revoked_lock = threading.Lock()
+_revoked_loaded_at = 0.0
+
+def _token_key(token):
+    return hashlib.sha256(token.encode()).hexdigest()
+
+# Claims the code below reads; a validly signed token without them is invalid, not a server error.
+REQUIRED_CLAIMS = ["exp", "user_id"]
+
+def _token_id(payload, token):
+    return payload.get('jti') or _token_key(token)
+
+def issue_token(user_id):
+    expiration = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(hours=24)
+    payload = {"user_id": user_id, "exp": expiration, "jti": uuid.uuid4().hex}
+    return jwt.encode(payload, Config.JWT_SECRET, algorithm="HS256")
+
+def _refresh_revocations(force=False):
+    global _revoked_loaded_at
+    if not Config.AUTH_REVOCATION_DB:
+        return
+    now = time.time()
+    if not force and now - _revoked_loaded_at < Config.AUTH_REVOCATION_REFRESH:
+        return
+    with get_db(Config.DB_CONN_STR) as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT token_id, extract(epoch FROM expires_at) FROM revoked_tokens WHERE expires_at > now()")
+        rows = cur.fetchall()
+    with _revoked_lock:
+        _revoked.clear()
+        _revoked.update((token_id, float(expires)) for token_id, expires in rows)
+        _revoked_loaded_at = now
+
+def is_revoked(token_id):
+    _refresh_revocations()
+    with _revoked_lock:
+        expires = _revoked.get(token_id)
+    return expires is not None and expires > time.time()
+
+def verify_token(token):
+    """Return the token's payload, raising jwt.InvalidTokenError if it is invalid, expired or revoked."""
+    key = _token_key(token)
+    payload = _tokens.get(key) if Config.AUTH_CACHE_ENABLED else None
+    if payload is None:
+        payload = jwt.decode(token, Config.JWT_SECRET, algorithms=["HS256"], options={"require": REQUIRED_CLAIMS})
+        if Config.AUTH_CACHE_ENABLED:
+            _tokens.put(key, payload, ttl=payload['exp'] - time.time())
+    elif payload['exp'] <= time.time():
+        _tokens.pop(key)
+        raise jwt.ExpiredSignatureError("Signature has expired")
+    if is_revoked(_token_id(payload, token)):
+        raise jwt.InvalidTokenError("Token has been revoked")
+    return payload
+
+def revoke_token(token):
+    payload = jwt.decode(token, Config.JWT_SECRET, algorithms=["HS256"],
+                         options={"verify_exp": False, "require": REQUIRED_CLAIMS})
+    token_id = _token_id(payload, token)
+    _tokens.pop(_token_key(token))
+    with _revoked_lock:
+        _revoked[token_id] = float(payload['exp'])
+    if Config.AUTH_REVOCATION_DB:
+        with get_db(Config.DB_CONN_STR) as conn:
+            cur = conn.cursor()
+            cur.execute("""
+                INSERT INTO revoked_tokens (token_id, expires_at) VALUES (%s, to_timestamp(%s))
+                ON CONFLICT (token_id) DO NOTHING
+            """, (token_id, payload['exp']))
+            cur.execute("DELETE FROM revoked_tokens WHERE expires_at < now()")
+
+def get_user(user_id):
+    user = _users.get(user_id) if Config.AUTH_CACHE_ENABLED else None
+    if user is None:
+        with get_db(Config.DB_CONN_STR) as conn:
+            cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+            cur.execute("SELECT id, username FROM users WHERE id = %s", (user_id,))
+            user = cur.fetchone()
+        if user is not None and Config.AUTH_CACHE_ENABLED:
+            _users.put(user_id, user)
+    return user
+
+def get_user_by_username(username):
+    """User row including the password hash, for login; read fresh every time so the hash is never cached."""
+    with get_db(Config.DB_CONN_STR) as conn:
+        cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+        cur.execute("SELECT id, username, password FROM users WHERE username = %s", (username,))
+        return cur.fetchone()
 
 def auth_required(f):
     @wraps(f)
@@ -11,9 +116,13 @@ def auth_required(f):
         if not token:
             return jsonify({"error": "Authorization header required"}), 401
         try:
-            payload = jwt.decode(token, Config.JWT_SECRET, algorithms=["HS256"])
-            request.user_id = payload['user_id']
-        except:
+            payload = verify_token(token)
+        except jwt.InvalidTokenError:
+            return jsonify({"error": "Invalid token"}), 401
+        user = get_user(payload['user_id'])
+        if user is None:
             return jsonify({"error": "Invalid token"}), 401
+        request.user_id = user['id']
+        request.user = user
         return f(*args, **kwargs)
-    return decorated_function
\ No newline at end of file
+    return decorated_function
@@ -0,0 +1,12 @@
+# utils/json_provider.py
+import datetime
+from flask.json.provider import DefaultJSONProvider
+
+class JSONProvider(DefaultJSONProvider):
+    """Timestamps as ISO 8601, the format document dates had while they were stored as text."""
+
+    @staticmethod
+    def default(o):
+        if isinstance(o, datetime.date):
+            return o.isoformat()
+        return DefaultJSONProvider.default(o)
@@ -0,0 +1,118 @@
+# utils/passwords.py
+# bcrypt hashing off the request threads: work runs in a small process pool,
+# and when more than BCRYPT_MAX_QUEUE requests are already waiting we fail
+# fast with PasswordServiceBusy instead of piling up behind a login storm.
+# A hash that times out keeps its slot until the pool has finished it, and a
+# pool broken by a dead worker is replaced.
+import logging
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
+import bcrypt
+from config import Config
+from db import get_db
+import metrics
+
+log = logging.getLogger(__name__)
+
+class PasswordServiceBusy(Exception):
+    pass
+
+_executor = None
+_executor_lock = threading.Lock()
+_slots = threading.BoundedSemaphore(max(Config.BCRYPT_WORKERS, 1) + Config.BCRYPT_MAX_QUEUE)
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None and Config.BCRYPT_WORKERS > 0:
+            _executor = ProcessPoolExecutor(
+                max_workers=Config.BCRYPT_WORKERS,
+                mp_context=multiprocessing.get_context('spawn'),
+            )
+        return _executor
+
+def _replace_broken(executor):
+    global _executor
+    with _executor_lock:
+        if _executor is executor:
+            log.warning("Password hashing pool is broken; starting a new one")
+            _executor = None
+    executor.shutdown(wait=False, cancel_futures=True)
+
+def _hash(password, rounds):
+    return bcrypt.hashpw(password.encode(), bcrypt.gensalt(rounds)).decode()
+
+def _check(password, hashed):
+    return bcrypt.checkpw(password.encode(), hashed.encode())
+
+def _run(fn, *args):
+    if not _slots.acquire(blocking=False):
+        raise PasswordServiceBusy("Too many password operations in progress")
+    executor = _get_executor()
+    if executor is None:
+        try:
+            with metrics.stage('hashing'):
+                return fn(*args)
+        finally:
+            _slots.release()
+    try:
+        future = executor.submit(fn, *args)
+    except RuntimeError as e:  # broken, or shut down by another thread replacing it
+        _slots.release()
+        if isinstance(e, BrokenProcessPool):
+            _replace_broken(executor)
+        raise PasswordServiceBusy("Password service restarting") from e
+    future.add_done_callback(lambda f: _slots.release())
+    try:
+        with metrics.stage('hashing'):
+            return future.result(timeout=Config.BCRYPT_TIMEOUT)
+    except FutureTimeout as e:
+        raise PasswordServiceBusy("Password operation timed out") from e
+    except BrokenProcessPool as e:
+        _replace_broken(executor)
+        raise PasswordServiceBusy("Password service restarting") from e
+
+def hash_password(password):
+    return _run(_hash, password, Config.BCRYPT_ROUNDS)
+
+def check_password(password, hashed):
+    return _run(_check, password, hashed)
+
+def hash_cost(hashed):
+    # bcrypt hashes look like $2b$<cost>$<salt+hash>
+    try:
+        return int(hashed.split('$')[2])
+    except (IndexError, ValueError):
+        return 0
+
+def needs_rehash(hashed):
+    return hash_cost(hashed) < Config.BCRYPT_ROUNDS
+
+def rehash_if_needed(user, password):
+    """After a successful login, upgrade an outdated hash to the current work factor in the background."""
+    if not needs_rehash(user['password']):
+        return
+    executor = _get_executor()
+    if executor is None or not _slots.acquire(blocking=False):
+        return  # no pool, or busy: try again on a later login
+
+    def save(future):
+        _slots.release()
+        if future.exception() is not None:
+            log.warning("Password rehash failed for user %s", user['id'], exc_info=future.exception())
+            return
+        with get_db(Config.DB_CONN_STR) as conn:
+            cur = conn.cursor()
+            cur.execute("UPDATE users SET password = %s WHERE id = %s AND password = %s",
+                        (future.result(), user['id'], user['password']))
+
+    try:
+        future = executor.submit(_hash, password, Config.BCRYPT_ROUNDS)
+    except RuntimeError as e:
+        _slots.release()
+        if isinstance(e, BrokenProcessPool):
+            _replace_broken(executor)
+        return
+    future.add_done_callback(save)
@@ -0,0 +1,49 @@
+# utils/streaming.py
+import json
+import logging
+from flask import Response, stream_with_context
+
+log = logging.getLogger(__name__)
+
+def _sse(payload, event=None):
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(payload)}\n\n"
+
+def _ndjson(payload, event=None):
+    if event:
+        payload = dict(payload, event=event)
+    return json.dumps(payload) + "\n"
+
+def format_message(payload, event=None, ndjson=False):
+    return (_ndjson if ndjson else _sse)(payload, event)
+
+STREAM_HEADERS = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+
+def stream_mimetype(ndjson=False):
+    return 'application/x-ndjson' if ndjson else 'text/event-stream'
+
+def token_stream_response(tokens, ndjson=False):
+    """Stream tokens to the client as Server-Sent Events (default) or JSON lines.
+
+    Each token is sent as {"token": ...}; the stream ends with a "done" event
+    carrying the full text, or an "error" event if generation failed.
+    """
+    fmt = _ndjson if ndjson else _sse
+
+    def generate():
+        parts = []
+        try:
+            for token in tokens:
+                parts.append(token)
+                yield fmt({"token": token})
+        except Exception:
+            log.exception("Streaming analysis failed")
+            yield fmt({"error": "Failed to analyze"}, event="error")
+            return
+        yield fmt({"analysis": ''.join(parts)}, event="done")
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype=stream_mimetype(ndjson),
+        headers=STREAM_HEADERS,
+    )